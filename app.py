@@ -2,47 +2,132 @@ import os
 from flask import Flask
 from flask_migrate import Migrate
 from flask_cors import CORS
-import logging
-from pythonjsonlogger import jsonlogger
 
 from routes.home_routes import home
 from routes.api_routes import api
+from routes.webhook_routes import webhooks
 from extensions.database import setup_db, db
+from extensions import log_pipeline
+from extensions.auth import token as auth_token
+from services import detectors, ingestion, metrics, nlp_pool, patient_dictionary, redaction_cache, redaction_jobs, vault
 
 
-def create_app():
-    'Application factory function'
+def create_app(test_config=None):
+    'Application factory function, `test_config` overrides the default settings'
     app = Flask(__name__)
-    setup_db(app)
-    Migrate(app, db, compare_type=True)
     CORS(app, expose_headers="Authorization")
 
-    logger = logging.getLogger()
-    logger.handlers.clear() # Clear Flask logger handlers
-    logger.setLevel(logging.DEBUG)
-
-    formatter = jsonlogger.JsonFormatter("{message}{asctime}{name}{levelname}", style='{')
-
-    file_handler = logging.FileHandler('app.log')
-    file_handler.setFormatter(formatter)
-
-    console_hanler = logging.StreamHandler()
-    console_hanler.setFormatter(formatter)
-    
-    logger.addHandler(file_handler)
-    logger.addHandler(console_hanler)
-
     default_config = dict(
         THREADED=True,
         DEBUG='true',
         TEMPLATES_AUTO_RELOAD=True,
         SQLALCHEMY_DATABASE_URI=os.getenv("SQLALCHEMY_DATABASE_URI", "sqlite:///fallback.db"),
-        LOGGING_LEVEL=os.getenv("LOGGING_LEVEL", "DEBUG"),
-        SECRET_KEY=os.getenv("SECRET_KEY", "mysecretkey")
+        LOGGING_LEVEL=os.getenv("LOGGING_LEVEL", "INFO"),
+        # Log records go through a bounded queue to a writer thread; the file rotates at LOG_MAX_BYTES
+        LOG_FILE=os.getenv("LOG_FILE", "app.log"),
+        LOG_MAX_BYTES=int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024))),
+        LOG_BACKUP_COUNT=int(os.getenv("LOG_BACKUP_COUNT", "5")),
+        LOG_QUEUE_SIZE=int(os.getenv("LOG_QUEUE_SIZE", "10000")),
+        LOG_CONSOLE=os.getenv("LOG_CONSOLE", "true").lower() == "true",
+        # DEBUG/INFO records per second per logger (0 disables), and the share kept from hot-path loggers
+        LOG_RATE_LIMIT=float(os.getenv("LOG_RATE_LIMIT", "100")),
+        LOG_RATE_BURST=int(os.getenv("LOG_RATE_BURST", "200")),
+        LOG_SAMPLE_RATE=float(os.getenv("LOG_SAMPLE_RATE", "1.0")),
+        LOG_SAMPLED_LOGGERS=os.getenv("LOG_SAMPLED_LOGGERS", "services.redaction,services.ingestion"),
+        SECRET_KEY=os.getenv("SECRET_KEY", "mysecretkey"),
+        # Connection pool of the app's database engine, passed on as SQLALCHEMY_ENGINE_OPTIONS
+        DB_POOL_SIZE=int(os.getenv("DB_POOL_SIZE", "5")),
+        DB_MAX_OVERFLOW=int(os.getenv("DB_MAX_OVERFLOW", "3")),
+        DB_POOL_TIMEOUT=int(os.getenv("DB_POOL_TIMEOUT", "30")),
+        DB_POOL_RECYCLE=int(os.getenv("DB_POOL_RECYCLE", "280")),
+        DB_POOL_PRE_PING=os.getenv("DB_POOL_PRE_PING", "true").lower() == "true",
+        DB_SEARCH_PATH=os.getenv("DB_SEARCH_PATH", "public"),
+        DB_STATEMENT_TIMEOUT_MS=int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "0")),
+        # Schema changes go through Alembic migrations; only set this for throwaway databases
+        DB_CREATE_ALL=os.getenv("DB_CREATE_ALL", "false").lower() == "true",
+        # spaCy model shared by all redaction requests in this process
+        SPACY_MODEL=os.getenv("SPACY_MODEL", nlp_pool.DEFAULT_MODEL),
+        SPACY_POOL_SIZE=int(os.getenv("SPACY_POOL_SIZE", "1")),
+        SPACY_EXCLUDE=os.getenv("SPACY_EXCLUDE", ",".join(nlp_pool.DEFAULT_EXCLUDE)),
+        SPACY_WARMUP=os.getenv("SPACY_WARMUP", "true").lower() == "true",
+        # Batch redaction: nlp.pipe batch size, NER worker processes and request size limit
+        REDACTION_BATCH_SIZE=int(os.getenv("REDACTION_BATCH_SIZE", "64")),
+        REDACTION_N_PROCESS=int(os.getenv("REDACTION_N_PROCESS", "1")),
+        REDACTION_MAX_BATCH_ITEMS=int(os.getenv("REDACTION_MAX_BATCH_ITEMS", "5000")),
+        # Cache of redaction plans for repeated texts, keyed by an HMAC of the text (0 disables it)
+        REDACTION_CACHE_SIZE=int(os.getenv("REDACTION_CACHE_SIZE", "0")),
+        REDACTION_CACHE_TTL=int(os.getenv("REDACTION_CACHE_TTL", "3600")),
+        REDACTION_CACHE_KEY=os.getenv("REDACTION_CACHE_KEY"),
+        # Streaming redaction of long texts: characters per chunk and overlap kept between chunks
+        REDACTION_STREAM_CHUNK_SIZE=int(os.getenv("REDACTION_STREAM_CHUNK_SIZE", "100000")),
+        REDACTION_STREAM_OVERLAP=int(os.getenv("REDACTION_STREAM_OVERLAP", "1000")),
+        # Match known patient names, emails and phones from the patients table during hybrid redaction
+        REDACTION_DICTIONARY=os.getenv("REDACTION_DICTIONARY", "false").lower() == "true",
+        REDACTION_DICTIONARY_MIN_LENGTH=int(os.getenv("REDACTION_DICTIONARY_MIN_LENGTH", "3")),
+        REDACTION_DICTIONARY_LOWERCASE_NAMES=os.getenv("REDACTION_DICTIONARY_LOWERCASE_NAMES", "false").lower() == "true",
+        # Hybrid redaction detectors: the enabled ones (comma separated, all when unset), input length from which
+        # they run on REDACTION_DETECTOR_WORKERS threads (0 never), per-detector timing and skipping NER for texts
+        # without letters
+        REDACTION_DETECTORS=os.getenv("REDACTION_DETECTORS"),
+        REDACTION_PARALLEL_MIN_CHARS=int(os.getenv("REDACTION_PARALLEL_MIN_CHARS", "0")),
+        REDACTION_DETECTOR_WORKERS=int(os.getenv("REDACTION_DETECTOR_WORKERS", "4")),
+        REDACTION_DETECTOR_TIMING=os.getenv("REDACTION_DETECTOR_TIMING", "true").lower() == "true",
+        REDACTION_SKIP_NER_WITHOUT_LETTERS=os.getenv("REDACTION_SKIP_NER_WITHOUT_LETTERS", "true").lower() == "true",
+        # Verified tokens are cached until they expire; user records for USER_CACHE_TTL seconds
+        TOKEN_CACHE_SIZE=int(os.getenv("TOKEN_CACHE_SIZE", "10000")),
+        USER_CACHE_TTL=int(os.getenv("USER_CACHE_TTL", "60")),
+        # Background redaction jobs: worker processes, queue depth, timeout and result lifetime in seconds,
+        # and how workers are started ("spawn" or "forkserver"; "fork" copies the web process's threads and locks)
+        REDACTION_JOB_WORKERS=int(os.getenv("REDACTION_JOB_WORKERS", "2")),
+        REDACTION_JOB_MAX_PENDING=int(os.getenv("REDACTION_JOB_MAX_PENDING", "100")),
+        REDACTION_JOB_TIMEOUT=int(os.getenv("REDACTION_JOB_TIMEOUT", "120")),
+        REDACTION_JOB_RESULT_TTL=int(os.getenv("REDACTION_JOB_RESULT_TTL", "600")),
+        REDACTION_JOB_START_METHOD=os.getenv("REDACTION_JOB_START_METHOD", "spawn"),
+        # Webhook ingestion: messages are written in batches of INGESTION_BATCH_SIZE or after INGESTION_MAX_DELAY seconds
+        INGESTION_BATCH_SIZE=int(os.getenv("INGESTION_BATCH_SIZE", "100")),
+        INGESTION_MAX_DELAY=float(os.getenv("INGESTION_MAX_DELAY", "0.5")),
+        INGESTION_MAX_PENDING=int(os.getenv("INGESTION_MAX_PENDING", "10000")),
+        INGESTION_DEDUPE_SIZE=int(os.getenv("INGESTION_DEDUPE_SIZE", "100000")),
+        INGESTION_BACKGROUND=os.getenv("INGESTION_BACKGROUND", "true").lower() == "true",
+        # Webhook signature secrets and Meta's subscription verify token. A webhook without its secret is refused,
+        # unless WEBHOOK_ALLOW_UNSIGNED is set for local testing
+        WHATSAPP_APP_SECRET=os.getenv("WHATSAPP_APP_SECRET"),
+        WHATSAPP_VERIFY_TOKEN=os.getenv("WHATSAPP_VERIFY_TOKEN"),
+        TWILIO_AUTH_TOKEN=os.getenv("TWILIO_AUTH_TOKEN"),
+        WEBHOOK_ALLOW_UNSIGNED=os.getenv("WEBHOOK_ALLOW_UNSIGNED", "false").lower() == "true",
+        # Tokenization vault: its own database (the main one when unset), token key and hot-token LRU size.
+        # Without VAULT_KEY there is no vault, and INGESTION_TOKENIZE refuses to start.
+        VAULT_DATABASE_URL=os.getenv("VAULT_DATABASE_URL"),
+        VAULT_KEY=os.getenv("VAULT_KEY"),
+        VAULT_CACHE_SIZE=int(os.getenv("VAULT_CACHE_SIZE", "10000")),
+        # Store incoming messages with vault tokens instead of fixed redaction placeholders
+        INGESTION_TOKENIZE=os.getenv("INGESTION_TOKENIZE", "false").lower() == "true",
+        # Stage timers behind /metrics; a sample rate below 1 times only that share of calls
+        METRICS_ENABLED=os.getenv("METRICS_ENABLED", "true").lower() == "true",
+        METRICS_SAMPLE_RATE=float(os.getenv("METRICS_SAMPLE_RATE", "1.0")),
+        METRICS_TOKEN=os.getenv("METRICS_TOKEN"),
     )
     app.config.update(default_config)
+    if test_config:
+        app.config.update(test_config)
+    log_pipeline.init_app(app)
+    # No connection is opened here; the first query connects (and pre-pings) lazily.
+    setup_db(app, (test_config or {}).get("SQLALCHEMY_DATABASE_URI"))
+    Migrate(app, db, compare_type=True)
+
+    # Load the NER model before the first request instead of on every /redact call
+    nlp_pool.init_app(app)
+    redaction_cache.init_app(app)
+    patient_dictionary.init_app(app)
+    detectors.init_app(app)
+    redaction_jobs.init_app(app)
+    auth_token.init_app(app)
+    metrics.init_app(app)
+    vault.init_app(app)
+    ingestion.init_app(app)
 
     # Register the home blueprint
     app.register_blueprint(home)
     app.register_blueprint(api)
+    app.register_blueprint(webhooks)
     return app
\ No newline at end of file
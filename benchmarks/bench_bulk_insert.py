@@ -0,0 +1,63 @@
+# bench_bulk_insert.py
+# Loads Message rows into a SQLite file database with the per-row CRUDMixin.insert()
+# loop and with Message.bulk_insert(), and compares their throughput. The per-row
+# loop commits and refreshes every row, so it only runs on a sample.
+#
+# Usage: python -m benchmarks.bench_bulk_insert --messages 100000 --loop-sample 2000
+
+import argparse
+import logging
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from flask import Flask
+
+from extensions.database import setup_db
+from models.message import Message
+from models.patient import Patient
+
+
+def rows(count, offset=0):
+    start = datetime(2020, 1, 1)
+    return [{'phone': '+10000000000', 'patient_id': 1, 'sender': 'patient', 'content': f'Message number {number}',
+             'timestamp': start + timedelta(seconds=number), 'msg_metadata': {'wa_status': 'delivered'}}
+            for number in range(offset, offset + count)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-row CRUDMixin.insert() vs. Message.bulk_insert().")
+    parser.add_argument("--messages", type=int, default=100_000)
+    parser.add_argument("--loop-sample", type=int, default=2000)
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    app = Flask(__name__)
+    app.config.update(DB_CREATE_ALL=True)
+    setup_db(app, f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'messages.db')}")
+    with app.app_context():
+        Patient(email='patient@example.com').insert()
+
+        sample = rows(args.loop_sample)
+        start = time.perf_counter()
+        for row in sample:
+            Message(**row).insert()
+        loop_rate = len(sample) / (time.perf_counter() - start)
+
+        data = rows(args.messages, offset=args.loop_sample)
+        start = time.perf_counter()
+        result = Message.bulk_insert(data, chunk_size=args.chunk_size)
+        elapsed = time.perf_counter() - start
+        assert result.written == args.messages and not result.failures
+        bulk_rate = args.messages / elapsed
+
+        print(f"per-row insert(): {loop_rate:>10.0f} rows/s ({args.loop_sample} rows)")
+        print(f"bulk_insert():    {bulk_rate:>10.0f} rows/s ({args.messages} rows in {elapsed:.2f} s, "
+              f"chunks of {args.chunk_size})")
+        print(f"speedup:          {bulk_rate / loop_rate:>10.1f}x")
+
+
+if __name__ == "__main__":
+    main()
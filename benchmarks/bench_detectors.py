@@ -0,0 +1,78 @@
+# bench_detectors.py
+# Compares the detector registry's schedules on synthetic notes (see corpus.py):
+# every detector one after another versus on worker threads for inputs of growing
+# size, and NER on texts without letters versus skipping it. Also prints how long
+# each detector takes on the same notes. Without a downloaded model, --untrained
+# runs a freshly initialized NER component, which costs about what a trained one does.
+#
+# Usage: python -m benchmarks.bench_detectors --sizes 5000,50000,500000 [--untrained | --blank]
+
+import argparse
+import logging
+import time
+
+from benchmarks.corpus import generate_corpus
+from services.detectors import PATTERN_DETECTORS, DetectorRegistry, NerDetector, RegexDetector
+from services.nlp_pool import DEFAULT_MODEL, ModelPool
+
+
+def best_time(function, text, rounds):
+    best = float('inf')
+    for _ in range(rounds):
+        start = time.perf_counter()
+        function(text)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sequential vs parallel detectors and the NER short circuit.")
+    parser.add_argument("--sizes", default="5000,50000,500000", help="Input lengths in characters.")
+    parser.add_argument("--model", default=DEFAULT_MODEL)
+    parser.add_argument("--blank", action="store_true", help="Use a blank spaCy pipeline instead of the model.")
+    parser.add_argument("--untrained", action="store_true", help="Use an untrained NER component instead of the model.")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    if args.blank or args.untrained:
+        import spacy
+        nlp = spacy.blank("en")
+        if args.untrained:
+            nlp.add_pipe("ner").add_label("PERSON")
+            nlp.initialize()
+        pool = ModelPool(nlp=nlp)
+    else:
+        pool = ModelPool(args.model)
+    detectors = [RegexDetector(), *PATTERN_DETECTORS, NerDetector(pool)]
+    sequential = DetectorRegistry(detectors, parallel_min_chars=0, timing=False)
+    parallel = DetectorRegistry(detectors, parallel_min_chars=1, workers=args.workers, timing=False)
+    parallel.detect("Start the worker threads.")
+    notes = " ".join(note.text for note in generate_corpus(200, seed=3))
+
+    print(f"{'chars':>9} {'sequential':>12} {'parallel':>12} {'speedup':>8}")
+    for size in [int(size) for size in args.sizes.split(',')]:
+        text = (notes * (size // len(notes) + 1))[:size]
+        assert parallel.detect(text) == sequential.detect(text)
+        one_by_one = best_time(sequential.detect, text, args.rounds)
+        threaded = best_time(parallel.detect, text, args.rounds)
+        print(f"{size:>9} {one_by_one * 1000:>9.1f} ms {threaded * 1000:>9.1f} ms {one_by_one / threaded:>7.2f}x")
+
+    # Lab values and fax numbers: nothing but digits, punctuation and whitespace.
+    digits = "\n".join(f"{index:04d}  555-{index % 1000:03d}-{index:04d}  {index * 7 % 300}/{index % 90}"
+                       for index in range(200))
+    skipping = DetectorRegistry(detectors, parallel_min_chars=0, timing=False)
+    always = DetectorRegistry(detectors, parallel_min_chars=0, timing=False, short_circuit=False)
+    skipped, with_ner = best_time(skipping.detect, digits, args.rounds), best_time(always.detect, digits, args.rounds)
+    print(f"\n{len(digits)} chars without letters: {with_ner * 1000:.2f} ms with NER, "
+          f"{skipped * 1000:.2f} ms skipping it ({with_ner / skipped:.0f}x)")
+
+    # The same timings are recorded as the hybrid.<name> stages at /metrics.
+    text = notes[:50000]
+    print(f"\nper detector on {len(text)} chars:")
+    for detector in detectors:
+        print(f"  {detector.name:<12} {best_time(detector.detect, text, args.rounds) * 1000:>9.2f} ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+# bench_ingestion.py
+# Load test for webhook ingestion. Serves the webhook blueprint on a local port,
+# then several stand-in senders post WhatsApp Cloud API payloads to it (with a
+# share of redeliveries and status callbacks) and the run reports messages/sec,
+# webhook response times and the queue-to-commit latency of stored messages.
+#
+# Usage: python -m benchmarks.bench_ingestion --messages 20000 --senders 8 --per-request 5
+
+import argparse
+import logging
+import os
+import statistics
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from flask import Flask
+from werkzeug.serving import make_server
+
+import models.message  # noqa: F401 (Patient.messages refers to it)
+from extensions.database import setup_db
+from models.patient import Patient
+from routes.webhook_routes import webhooks
+from services import ingestion
+from services.nlp_pool import DEFAULT_MODEL, ModelPool
+from services.redaction import ReductionService
+
+SAMPLE_TEXTS = [
+    "Hi, this is John. Can I move my appointment to Friday?",
+    "My new email is jane.smith@example.com, please update it.",
+    "Call me back at (123) 456-7890 after 5pm.",
+    "Thanks, see you next week in Berlin.",
+]
+PATIENTS = 100
+
+
+def payload(batch):
+    return {'object': 'whatsapp_business_account', 'entry': [{'changes': [{'value': {
+        'messaging_product': 'whatsapp',
+        'messages': [{'from': f'1555000{number % PATIENTS:04d}', 'id': f'wamid.{number}', 'timestamp': '1714560000',
+                      'type': 'text', 'text': {'body': SAMPLE_TEXTS[number % len(SAMPLE_TEXTS)]}}
+                     for number in batch],
+        'statuses': [{'id': f'wamid.{number - 50}', 'status': 'delivered'} for number in batch if number >= 50],
+    }}]}]}
+
+
+def percentile(samples, fraction):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(fraction * len(samples)))] * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Messages/sec and latency of the webhook ingestion pipeline.")
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--senders", type=int, default=8)
+    parser.add_argument("--per-request", type=int, default=5)
+    parser.add_argument("--redeliver", type=float, default=0.05, help="Share of requests sent twice.")
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--max-delay", type=float, default=0.5)
+    parser.add_argument("--max-pending", type=int, default=10000)
+    parser.add_argument("--retry-wait", type=float, default=0.1, help="Seconds a sender waits after a 503.")
+    parser.add_argument("--model", default=DEFAULT_MODEL)
+    parser.add_argument("--blank", action="store_true", help="Use a blank spaCy pipeline (regex redaction only).")
+    args = parser.parse_args()
+    logging.disable(logging.ERROR)
+
+    app = Flask(__name__)
+    # The stand-in senders don't sign their requests.
+    app.config.update(DB_CREATE_ALL=True, WEBHOOK_ALLOW_UNSIGNED=True)
+    setup_db(app, f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'ingestion.db')}")
+    app.register_blueprint(webhooks)
+    with app.app_context():
+        Patient.bulk_insert([{'email': f'p{number}@example.com', 'phone': f'+1555000{number:04d}'}
+                             for number in range(PATIENTS)])
+    if args.blank:
+        import spacy
+        pool = ModelPool(nlp=spacy.blank("en"))
+    else:
+        pool = ModelPool(args.model)
+    ingestor = ingestion.MessageIngestor(app, batch_size=args.batch_size, max_delay=args.max_delay,
+                                         max_pending=args.max_pending, service=ReductionService(pool=pool))
+    ingestion._ingestor = ingestor
+
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f'http://127.0.0.1:{server.server_port}/webhooks/whatsapp'
+
+    numbers = list(range(args.messages))
+    requests_to_send = [numbers[start:start + args.per_request] for start in range(0, len(numbers), args.per_request)]
+    every = int(1 / args.redeliver) if args.redeliver else 0
+    if every:
+        requests_to_send += requests_to_send[::every]
+    local = threading.local()
+
+    rejected = []
+
+    def send(batch):
+        session = getattr(local, 'session', None) or requests.Session()
+        local.session = session
+        start = time.perf_counter()
+        response = session.post(url, json=payload(batch))
+        while response.status_code == 503:
+            # Like the provider, retry a rejected delivery later (without waiting the full Retry-After).
+            rejected.append(1)
+            time.sleep(args.retry_wait)
+            response = session.post(url, json=payload(batch))
+        response.raise_for_status()
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.senders) as executor:
+        response_times = list(executor.map(send, requests_to_send))
+    sent = time.perf_counter() - start
+    deadline = time.monotonic() + 600
+    while (ingestor.stats()['stored'] + ingestor.stats()['failed'] + ingestor.stats()['unmatched'] < args.messages
+           and time.monotonic() < deadline):
+        time.sleep(0.01)
+    total = time.perf_counter() - start
+    ingestor.stop()
+    server.shutdown()
+
+    stats = ingestor.stats()
+    print(f"requests:              {len(requests_to_send)} ({args.per_request} messages each, "
+          f"{len(requests_to_send) - len(numbers) // args.per_request} redelivered, {len(rejected)} rejected with 503)")
+    print(f"accepted:              {args.messages / sent:10.0f} messages/sec")
+    print(f"stored:                {stats['stored'] / total:10.0f} messages/sec "
+          f"({stats['stored']} stored, {stats['duplicates']} duplicates dropped, {stats['failed']} failed)")
+    print(f"webhook response ms:   p50 {percentile(response_times, 0.5):.1f}  p95 {percentile(response_times, 0.95):.1f}"
+          f"  p99 {percentile(response_times, 0.99):.1f}  mean {statistics.mean(response_times) * 1000:.1f}")
+    print(f"queue to commit ms:    p50 {stats['latency_p50'] * 1000:.1f}  p95 {stats['latency_p95'] * 1000:.1f}"
+          f"  p99 {stats['latency_p99'] * 1000:.1f}  ({stats['batches']} batches)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+# bench_logging.py
+# Measures POST /redact latency through the app under four logging setups: the
+# synchronous FileHandler + StreamHandler at DEBUG that create_app used to install,
+# the queued pipeline at DEBUG, the queued pipeline at INFO, and logging disabled.
+# Uses a blank spaCy pipeline so the numbers are dominated by the request and
+# logging work rather than NER.
+#
+# Usage: python -m benchmarks.bench_logging --requests 3000
+
+import argparse
+import logging
+import os
+import statistics
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+import jwt
+import spacy
+from pythonjsonlogger import jsonlogger
+
+from app import create_app
+from extensions import log_pipeline
+from models.user import User
+from services import nlp_pool
+
+TEXT = "Please call John at 555-123-4567 or write to john.doe@example.com about Friday."
+
+
+def synchronous_logging(path):
+    """The handlers create_app installed before the queued pipeline."""
+    log_pipeline.get_log_pipeline().stop()
+    logger = logging.getLogger()
+    logger.handlers.clear()
+    logger.setLevel(logging.DEBUG)
+    formatter = jsonlogger.JsonFormatter("{message}{asctime}{name}{levelname}", style='{')
+    for handler in (logging.FileHandler(path), logging.StreamHandler(open(os.devnull, 'w'))):
+        handler.setFormatter(formatter)
+        logger.addHandler(handler)
+
+
+def measure(client, headers, count):
+    samples = []
+    for _ in range(count):
+        start = time.perf_counter()
+        response = client.post('/redact', json={'text_to_redact': TEXT}, headers=headers)
+        samples.append(time.perf_counter() - start)
+        assert response.status_code == 200
+    samples.sort()
+    return statistics.median(samples) * 1000, samples[int(len(samples) * 0.95)] * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="POST /redact latency with DEBUG logging on and off.")
+    parser.add_argument("--requests", type=int, default=3000)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    os.environ['SECRET_KEY'] = 'bench-secret'
+    nlp_pool.configure()
+    nlp_pool._pools[nlp_pool._default_key] = nlp_pool.ModelPool(nlp=spacy.blank("en"))
+
+    def make_app(level):
+        app = create_app({
+            "SQLALCHEMY_DATABASE_URI": f"sqlite:///{os.path.join(directory, 'bench.db')}",
+            "DB_CREATE_ALL": True, "SPACY_WARMUP": False, "LOGGING_LEVEL": level,
+            "LOG_FILE": os.path.join(directory, 'app.log'), "LOG_CONSOLE": False,
+            # Rate limits off, so DEBUG writes every record like the old setup did.
+            "LOG_RATE_LIMIT": 0,
+        })
+        return app
+
+    app = make_app("DEBUG")
+    with app.app_context():
+        if not User.query.filter_by(username='bench').first():
+            user = User(username='bench', role='admin', permissions='get:redaction')
+            user.set_password('bench')
+            user.insert()
+    claims = {'username': 'bench', 'role': 'admin', 'permissions': 'get:redaction',
+              'exp': datetime.now(timezone.utc) + timedelta(hours=1)}
+    headers = {'Authorization': 'Bearer ' + jwt.encode(claims, 'bench-secret', algorithm='HS256')}
+
+    results = {}
+    synchronous_logging(os.path.join(directory, 'sync.log'))
+    results['synchronous, DEBUG'] = measure(app.test_client(), headers, args.requests)
+    for level in ("DEBUG", "INFO"):
+        app = make_app(level)
+        results[f'queued, {level}'] = measure(app.test_client(), headers, args.requests)
+        log_pipeline.get_log_pipeline().flush(timeout=60)
+    logging.disable(logging.CRITICAL)
+    results['logging disabled'] = measure(app.test_client(), headers, args.requests)
+    logging.disable(logging.NOTSET)
+
+    baseline = results['logging disabled'][0]
+    for name, (median, p95) in results.items():
+        print(f"{name:<20} median {median:6.3f} ms  p95 {p95:6.3f} ms  ({median - baseline:+.3f} ms)")
+
+
+if __name__ == "__main__":
+    main()
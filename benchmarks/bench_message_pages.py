@@ -0,0 +1,80 @@
+# bench_message_pages.py
+# Seeds a SQLite database with a large message history and compares how long a
+# page of GET /messages takes near the start and deep into the history, with
+# keyset pagination and with the OFFSET pagination it replaces.
+#
+# Usage: python -m benchmarks.bench_message_pages --messages 1000000
+
+import argparse
+import logging
+import os
+import statistics
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from flask import Flask
+from sqlalchemy import insert, select
+
+from extensions.database import db, setup_db
+from models.message import Message
+from models.patient import Patient
+from routes.api_routes import MESSAGE_LIST_COLUMNS
+from routes.home_routes import dashboard_counts
+from services.pagination import encode_cursor, keyset_page
+
+
+def seed(messages, patients, chunk=50000):
+    db.session.execute(insert(Patient), [
+        {'email': f'patient{number}@example.com', 'tz': 'UTC'} for number in range(patients)])
+    start = datetime(2020, 1, 1)
+    for offset in range(0, messages, chunk):
+        db.session.execute(insert(Message), [
+            {'phone': '+10000000000', 'patient_id': number % patients + 1, 'sender': 'patient',
+             'content': f'Message number {number}', 'timestamp': start + timedelta(seconds=number),
+             'messenger': 'WhatsApp', 'is_read_by_admin': False}
+            for number in range(offset, min(offset + chunk, messages))])
+    db.session.commit()
+
+
+def timed(func, repeat=20):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Keyset vs. OFFSET page latency over a large message table.")
+    parser.add_argument("--messages", type=int, default=1_000_000)
+    parser.add_argument("--patients", type=int, default=1000)
+    parser.add_argument("--limit", type=int, default=50)
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    app = Flask(__name__)
+    app.config.update(DB_CREATE_ALL=True)
+    setup_db(app, f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'messages.db')}")
+    with app.app_context():
+        start = time.perf_counter()
+        seed(args.messages, args.patients)
+        print(f"seeded {args.messages} messages in {time.perf_counter() - start:.1f} s")
+
+        statement = select(*MESSAGE_LIST_COLUMNS).where(Message.timestamp.isnot(None))
+        newest = datetime(2020, 1, 1) + timedelta(seconds=args.messages)
+        print(f"{'depth':>10} {'keyset ms':>10} {'offset ms':>10}")
+        for depth in (0, args.messages // 100, args.messages // 2, args.messages - args.limit):
+            # The cursor of the row just before `depth`, as the previous page would have returned it.
+            cursor = encode_cursor(newest - timedelta(seconds=depth), args.messages - depth + 1) if depth else None
+            keyset = timed(lambda: keyset_page(db.session, statement, (Message.timestamp, Message.id), cursor, args.limit))
+            offset = timed(lambda: db.session.execute(
+                statement.order_by(Message.timestamp.desc(), Message.id.desc()).offset(depth).limit(args.limit)).all())
+            print(f"{depth:>10} {keyset:>10.2f} {offset:>10.2f}")
+
+        print(f"dashboard counts: {timed(dashboard_counts, repeat=5):.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+# bench_metrics.py
+# Measures what the stage timers cost: runs hybrid_redact and redact_with_regex
+# over the same texts with metrics disabled, timing every call, and sampling one
+# call in 100, and reports the overhead relative to the disabled run. End-to-end
+# differences of a few percent are within the noise of a shared machine, so the
+# cost of the instrumentation itself is also timed on its own.
+#
+# Usage: python -m benchmarks.bench_metrics --texts 2000 --rounds 5 [--blank]
+
+import argparse
+import logging
+import random
+import time
+import timeit
+
+from services import metrics
+from services.nlp_pool import DEFAULT_MODEL, ModelPool
+from services.redaction import RedactionSpan, ReductionService
+
+WORDS = "the patient asked about results tomorrow appointment clinic dose morning".split()
+
+
+def corpus(count, seed=3):
+    rng = random.Random(seed)
+    texts = []
+    for number in range(count):
+        words = rng.choices(WORDS, k=rng.randint(10, 60))
+        words.insert(rng.randrange(len(words)), f'user{number}@example.com')
+        words.insert(rng.randrange(len(words)), f'555-{number % 1000:03d}-{number % 10000:04d}')
+        texts.append(' '.join(words))
+    return texts
+
+
+def best_time(function, texts, rounds):
+    best = float('inf')
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for text in texts:
+            function(text)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def instrumentation_cost(instance, stages, number=200_000):
+    """Microseconds the calls added to one redaction with `stages` timed stages take."""
+    spans = [RedactionSpan(0, 4, 'ner', 'PERSON', ''), RedactionSpan(5, 9, 'regex', 'EMAIL', '')]
+
+    def instrumented():
+        for _ in range(stages):
+            started = instance.start()
+            if started is not None:
+                instance.record('bench', started)
+        if started is not None:
+            instance.observe_redaction('bench', 'text', spans)
+    def bare():
+        for _ in range(stages):
+            started = None
+        return started
+    return (timeit.timeit(instrumented, number=number) - timeit.timeit(bare, number=number)) / number * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Overhead of the per-stage redaction metrics.")
+    parser.add_argument("--texts", type=int, default=2000)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--model", default=DEFAULT_MODEL)
+    parser.add_argument("--blank", action="store_true", help="Use a blank spaCy pipeline (regex redaction only).")
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    if args.blank:
+        import spacy
+        pool = ModelPool(nlp=spacy.blank("en"))
+    else:
+        pool = ModelPool(args.model)
+    service = ReductionService(pool=pool, cache=None)
+    texts = corpus(args.texts)
+
+    settings = {'disabled': metrics.Metrics(enabled=False), 'every call': metrics.Metrics(),
+                '1 in 100': metrics.Metrics(sample_every=100)}
+    for name, function in (('hybrid_redact', service.hybrid_redact), ('redact_with_regex', service.redact_with_regex)):
+        times = {}
+        # Alternate the settings round by round so drift affects them all alike.
+        for _ in range(args.rounds):
+            for setting, instance in settings.items():
+                metrics._metrics = instance
+                elapsed = best_time(function, texts, 1)
+                times[setting] = min(times.get(setting, float('inf')), elapsed)
+        baseline = times['disabled']
+        for setting, elapsed in times.items():
+            print(f"{name:<18} {setting:<11} {elapsed / len(texts) * 1e6:8.2f} us/call "
+                  f"({(elapsed / baseline - 1) * 100:+.2f}%)")
+        per_call = baseline / len(texts) * 1e6
+        stages = 3 if name == 'hybrid_redact' else 1
+        for setting, instance in settings.items():
+            cost = instrumentation_cost(instance, stages)
+            print(f"{name:<18} {setting:<11} instrumentation alone {cost:6.3f} us/call "
+                  f"({cost / per_call * 100:.2f}% of a call)")
+
+
+if __name__ == "__main__":
+    main()
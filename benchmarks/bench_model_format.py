@@ -0,0 +1,73 @@
+# bench_model_format.py
+# Compares serializing Message rows with the old __dict__ scan, with the mapper based
+# CRUDMixin.format() on ORM objects, and with Message.format_rows() on a column-only
+# query. Times include running the query and building the objects or rows.
+#
+# Usage: python -m benchmarks.bench_model_format --messages 100000
+
+import argparse
+import logging
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from flask import Flask
+from sqlalchemy import insert, select
+
+from extensions.database import db, setup_db
+from models.message import Message
+from models.patient import Patient
+
+
+def dict_scan(instance):
+    """The serializer CRUDMixin.format used before, kept here as the baseline."""
+    return {key: value.isoformat() if isinstance(value, datetime) else value
+            for key, value in instance.__dict__.items() if not key.startswith('_')}
+
+
+def seed(messages):
+    db.session.execute(insert(Patient), [{'email': 'patient@example.com', 'tz': 'UTC'}])
+    start = datetime(2020, 1, 1)
+    db.session.execute(insert(Message), [
+        {'phone': '+10000000000', 'patient_id': 1, 'sender': 'patient', 'content': f'Message number {number}',
+         'timestamp': start + timedelta(seconds=number), 'messenger': 'WhatsApp', 'is_read_by_admin': False}
+        for number in range(messages)])
+    db.session.commit()
+
+
+def run(label, func, messages):
+    db.session.expunge_all()
+    start = time.perf_counter()
+    rows = func()
+    elapsed = time.perf_counter() - start
+    assert len(rows) == messages
+    print(f"{label:<34} {elapsed * 1000:>9.1f} {messages / elapsed:>12.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="__dict__ scan vs. mapper based CRUDMixin.format vs. format_rows.")
+    parser.add_argument("--messages", type=int, default=100_000)
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    app = Flask(__name__)
+    app.config.update(DB_CREATE_ALL=True)
+    setup_db(app, f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'messages.db')}")
+    with app.app_context():
+        seed(args.messages)
+        columns = (Message.id, Message.patient_id, Message.sender, Message.content, Message.timestamp,
+                   Message.messenger, Message.status, Message.is_read_by_admin)
+        only = [column.key for column in columns]
+
+        print(f"{'serializer':<34} {'ms':>9} {'rows/s':>12}")
+        run('__dict__ scan (ORM objects)', lambda: [dict_scan(m) for m in Message.query.all()], args.messages)
+        run('format() (ORM objects)', lambda: [m.format() for m in Message.query.all()], args.messages)
+        run('format(only=...) (ORM objects)', lambda: [m.format(only=only) for m in Message.query.all()],
+            args.messages)
+        run('format_rows() (column query)',
+            lambda: Message.format_rows(db.session.execute(select(*columns)).all()), args.messages)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+# bench_model_pool.py
+# Compares per-request redaction latency when the spaCy model is loaded on every
+# request (the old behaviour of /redact) against the shared model pool.
+#
+# Usage: python -m benchmarks.bench_model_pool --requests 50
+
+import argparse
+import logging
+import statistics
+import time
+
+import spacy
+
+from services.nlp_pool import DEFAULT_EXCLUDE, DEFAULT_MODEL, ModelPool
+from services.redaction import ReductionService
+
+SAMPLE_TEXT = (
+    "Contact Mr. John Doe in Berlin at john.doe@example.com or his assistant "
+    "Jane Smith. His number is (123) 456-7890."
+)
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def report(label, samples):
+    print(
+        f"{label:<28} p50={percentile(samples, 50) * 1000:8.2f} ms  "
+        f"p99={percentile(samples, 99) * 1000:8.2f} ms  "
+        f"mean={statistics.mean(samples) * 1000:8.2f} ms"
+    )
+
+
+def bench_load_per_request(model, requests):
+    samples = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        service = ReductionService(nlp=spacy.load(model))
+        service.hybrid_redact(SAMPLE_TEXT)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def bench_shared_pool(model, requests):
+    pool = ModelPool(model, size=1, exclude=DEFAULT_EXCLUDE)
+    samples = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        service = ReductionService(pool=pool)
+        service.hybrid_redact(SAMPLE_TEXT)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-request redaction latency: model load per request vs. shared pool.")
+    parser.add_argument("--model", default=DEFAULT_MODEL)
+    parser.add_argument("--requests", type=int, default=50)
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    report("before: load per request", bench_load_per_request(args.model, args.requests))
+    report("after: shared model pool", bench_shared_pool(args.model, args.requests))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+# bench_patient_format.py
+# Seeds a SQLite database with patients who speak a few languages each and compares
+# serializing all of them with per-object Patient.format() (one languages query per
+# patient) against Patient.format_many().
+#
+# Usage: python -m benchmarks.bench_patient_format --patients 10000
+
+import argparse
+import logging
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from flask import Flask
+from sqlalchemy import event, insert
+
+from extensions.database import db, setup_db
+from models.language import Language, languages_patients
+import models.message  # noqa: F401 (Patient.messages refers to it)
+from models.patient import Patient
+
+TIMEZONES = ['UTC', 'Europe/Berlin', 'Europe/Zurich', 'America/New_York', 'Asia/Tokyo', 'Australia/Sydney']
+
+
+def seed(patients, languages):
+    db.session.execute(insert(Language), [{'name': f'Language {number}'} for number in range(languages)])
+    start = datetime(2020, 1, 1)
+    db.session.execute(insert(Patient), [
+        {'email': f'patient{number}@example.com', 'first_name': f'First{number}', 'last_name': f'Last{number}',
+         'tz': TIMEZONES[number % len(TIMEZONES)], 'created_at': start + timedelta(hours=number)}
+        for number in range(patients)])
+    db.session.execute(insert(languages_patients), [
+        {'patient_id': number + 1, 'language_id': (number + offset) % languages + 1}
+        for number in range(patients) for offset in range(number % 3 + 1)])
+    db.session.commit()
+
+
+def run(label, func, statements):
+    db.session.expunge_all()
+    statements.clear()
+    start = time.perf_counter()
+    rows = func()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<26} {elapsed * 1000:>10.1f} {len(statements):>8}")
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-object Patient.format() vs. bulk Patient.format_many().")
+    parser.add_argument("--patients", type=int, default=10_000)
+    parser.add_argument("--languages", type=int, default=20)
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    app = Flask(__name__)
+    app.config.update(DB_CREATE_ALL=True)
+    setup_db(app, f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'patients.db')}")
+    with app.app_context():
+        seed(args.patients, args.languages)
+        statements = []
+        event.listen(db.engine, 'before_cursor_execute',
+                     lambda *call: call[2] != 'BEGIN' and statements.append(call[2]))
+
+        print(f"{'serializer':<26} {'ms':>10} {'queries':>8}")
+        expected = run('format() per patient', lambda: [patient.format() for patient in Patient.query.all()],
+                       statements)
+        rows = run('format_many(query)', lambda: Patient.format_many(Patient.query), statements)
+        assert rows == expected
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+# bench_suite.py
+# Throughput and latency suite for redaction over a seeded synthetic corpus (see
+# corpus.py). Measures docs/sec, chars/sec, latency percentiles and peak RSS of
+# redact_with_regex, redact_with_nlp, hybrid_redact and POST /redact through the
+# Flask test client. Each target runs in a fresh process, so its peak RSS is its
+# own. Results are written as JSON; given a baseline file, a drop in throughput or
+# a rise in p95 latency beyond the threshold makes the run exit with status 1.
+#
+# Usage: python -m benchmarks.bench_suite --docs 500 --output bench.json [--baseline old.json --threshold 0.1]
+
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+from benchmarks.corpus import generate_corpus
+from services.nlp_pool import DEFAULT_MODEL
+
+TARGETS = ('regex', 'nlp', 'hybrid', 'route')
+# Metrics compared against a baseline, and whether higher values are better.
+COMPARED = {'docs_per_sec': True, 'chars_per_sec': True, 'latency_p95_ms': False}
+
+
+def percentile(samples, q: float) -> float:
+    """The nearest-rank q-quantile of already sorted samples."""
+    return samples[min(len(samples) - 1, max(0, int(round(q * len(samples))) - 1))]
+
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere.
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def _model_pool(model: str, blank: bool):
+    from services.nlp_pool import ModelPool
+    if blank:
+        import spacy
+        return ModelPool(nlp=spacy.blank("en"))
+    return ModelPool(model)
+
+
+def _route_client(model: str, blank: bool):
+    """Returns a function that posts one text to /redact through the test client of a fresh app."""
+    import jwt
+    from app import create_app
+    from models.user import User
+    from services import nlp_pool
+
+    directory = tempfile.mkdtemp()
+    os.environ['SECRET_KEY'] = 'bench-secret'
+    app = create_app({
+        "SQLALCHEMY_DATABASE_URI": f"sqlite:///{os.path.join(directory, 'bench.db')}",
+        "DB_CREATE_ALL": True, "SPACY_MODEL": model, "SPACY_WARMUP": False,
+        "LOG_FILE": os.path.join(directory, 'app.log'), "LOG_CONSOLE": False,
+    })
+    if blank:
+        nlp_pool._pools[nlp_pool._default_key] = _model_pool(model, blank)
+    with app.app_context():
+        user = User(username='bench', role='admin', permissions='get:redaction')
+        user.set_password('bench')
+        user.insert()
+    claims = {'username': 'bench', 'role': 'admin', 'permissions': 'get:redaction',
+              'exp': datetime.now(timezone.utc) + timedelta(hours=1)}
+    headers = {'Authorization': 'Bearer ' + jwt.encode(claims, 'bench-secret', algorithm='HS256')}
+    client = app.test_client()
+
+    def post(text):
+        response = client.post('/redact', json={'text_to_redact': text}, headers=headers)
+        if response.status_code != 200:
+            raise RuntimeError(f"/redact answered {response.status_code}: {response.get_data(as_text=True)}")
+    return post
+
+
+def _target_function(target: str, model: str, blank: bool):
+    if target == 'route':
+        return _route_client(model, blank)
+    from services.redaction import ReductionService
+    # Regex redaction never touches the model, so don't load it into that target's process.
+    service = ReductionService(pool=_model_pool(model, blank or target == 'regex'))
+    return {'regex': service.redact_with_regex, 'nlp': service.redact_with_nlp,
+            'hybrid': service.hybrid_redact}[target]
+
+
+def run_target(target: str, corpus_options: dict, model: str = DEFAULT_MODEL, blank: bool = False,
+               warmup: int = 20, rounds: int = 3) -> dict:
+    """Redacts the corpus one document at a time with `target` and summarizes the fastest of `rounds` passes."""
+    texts = [note.text for note in generate_corpus(**corpus_options)]
+    redact = _target_function(target, model, blank)
+    for text in texts[:warmup]:
+        redact(text)
+
+    elapsed, latencies = float('inf'), []
+    for _ in range(rounds):
+        samples = []
+        start = time.perf_counter()
+        for text in texts:
+            began = time.perf_counter()
+            redact(text)
+            samples.append(time.perf_counter() - began)
+        took = time.perf_counter() - start
+        if took < elapsed:
+            elapsed, latencies = took, sorted(samples)
+    return {
+        'docs': len(texts),
+        'chars': sum(map(len, texts)),
+        'seconds': elapsed,
+        'docs_per_sec': len(texts) / elapsed,
+        'chars_per_sec': sum(map(len, texts)) / elapsed,
+        'latency_p50_ms': percentile(latencies, 0.50) * 1000,
+        'latency_p95_ms': percentile(latencies, 0.95) * 1000,
+        'latency_p99_ms': percentile(latencies, 0.99) * 1000,
+        'latency_max_ms': latencies[-1] * 1000,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    """Returns a message for every compared metric that got worse than the baseline by more than `threshold`."""
+    regressions = []
+    for target, current in results['results'].items():
+        previous = baseline.get('results', {}).get(target)
+        if not previous:
+            continue
+        for metric, higher_is_better in COMPARED.items():
+            old, new = previous.get(metric), current.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            if (-change if higher_is_better else change) > threshold:
+                regressions.append(f"{target} {metric}: {old:.2f} -> {new:.2f} ({change:+.1%})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Redaction throughput and latency suite with regression check.")
+    parser.add_argument("--docs", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--min-chars", type=int, default=200)
+    parser.add_argument("--max-chars", type=int, default=2000)
+    parser.add_argument("--targets", default=",".join(TARGETS))
+    parser.add_argument("--model", default=DEFAULT_MODEL)
+    parser.add_argument("--blank", action="store_true", help="Use a blank spaCy pipeline (regex redaction only).")
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--rounds", type=int, default=3, help="Passes over the corpus; the fastest is reported.")
+    parser.add_argument("--output", help="Write the results to this JSON file.")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to compare against.")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Tolerated relative regression.")
+    args = parser.parse_args()
+
+    corpus_options = dict(docs=args.docs, seed=args.seed, min_chars=args.min_chars, max_chars=args.max_chars)
+    results = {
+        'meta': {
+            'corpus': corpus_options,
+            'model': 'blank' if args.blank else args.model,
+            'rounds': args.rounds,
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'created_at': datetime.now(timezone.utc).isoformat(),
+        },
+        'results': {},
+    }
+    context = multiprocessing.get_context('spawn')
+    for target in [name.strip() for name in args.targets.split(',') if name.strip()]:
+        if target not in TARGETS:
+            parser.error(f"Unknown target {target!r}, expected some of {', '.join(TARGETS)}")
+        with context.Pool(1, initializer=logging.disable, initargs=(logging.INFO,)) as pool:
+            summary = pool.apply(run_target, (target, corpus_options, args.model, args.blank, args.warmup,
+                                                  args.rounds))
+        results['results'][target] = summary
+        print(f"{target:<7} {summary['docs_per_sec']:>9.1f} docs/s {summary['chars_per_sec'] / 1000:>9.1f} kchars/s  "
+              f"p50 {summary['latency_p50_ms']:7.3f} ms  p95 {summary['latency_p95_ms']:7.3f} ms  "
+              f"p99 {summary['latency_p99_ms']:7.3f} ms  peak RSS {summary['peak_rss_mb']:6.1f} MB")
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as source:
+            baseline = json.load(source)
+        if baseline.get('meta', {}).get('corpus') != corpus_options:
+            print("Warning: the baseline was measured on a different corpus.")
+        regressions = compare(results, baseline, args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+# bench_vault.py
+# Detokenizes a page of stored messages three ways: one SELECT per token (what a
+# naive per-message lookup does), TokenVault.detokenize_many() with a cold LRU
+# (one batched query per 500 tokens) and detokenize_many() again with the LRU warm.
+#
+# Usage: python -m benchmarks.bench_vault --messages 10000 --values 2000
+
+import argparse
+import logging
+import os
+import random
+import tempfile
+import time
+
+from flask import Flask
+from sqlalchemy import select
+
+import models.message  # noqa: F401 (the main bind's tables are created too)
+import models.patient  # noqa: F401
+from extensions.database import db, setup_db
+from models.vault import VaultEntry
+from services.redaction import RedactionSpan
+from services.vault import TOKEN_PATTERN, TokenVault
+
+
+def corpus(count, values, seed=7):
+    """Builds texts that each mention two of `values` names, with their redaction plans."""
+    rng = random.Random(seed)
+    names = [f'Name{number}' for number in range(values)]
+    texts, plans = [], []
+    for _ in range(count):
+        first, second = rng.choice(names), rng.choice(names)
+        text = f'{first} asked whether {second} can move the appointment to Friday.'
+        start = len(first) + len(' asked whether ')
+        texts.append(text)
+        plans.append([RedactionSpan(0, len(first), 'ner', 'PERSON', ''),
+                      RedactionSpan(start, start + len(second), 'ner', 'PERSON', '')])
+    return texts, plans
+
+
+def naive_detokenize(texts):
+    def value(match):
+        found = db.session.execute(select(VaultEntry.value).where(VaultEntry.token == match.group(2))).scalar()
+        return found if found is not None else match.group(0)
+    return [TOKEN_PATTERN.sub(value, text) for text in texts]
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-token SELECTs vs. batched, LRU-cached detokenization.")
+    parser.add_argument("--messages", type=int, default=10_000)
+    parser.add_argument("--values", type=int, default=2000)
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    app = Flask(__name__)
+    app.config.update(DB_CREATE_ALL=True)
+    setup_db(app, f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'vault.db')}")
+    with app.app_context():
+        texts, plans = corpus(args.messages, args.values)
+        tokenized, tokenize_time = timed(TokenVault(b'bench').tokenize_many, texts, plans)
+
+        naive, naive_time = timed(naive_detokenize, tokenized)
+        vault = TokenVault(b'bench', cache_size=args.values)
+        cold, cold_time = timed(vault.detokenize_many, tokenized)
+        warm, warm_time = timed(vault.detokenize_many, tokenized)
+        assert naive == cold == warm == texts
+
+        print(f"tokenize_many():          {tokenize_time * 1000:>9.1f} ms ({args.messages} messages, "
+              f"{VaultEntry.query.count()} vault entries)")
+        print(f"per-token SELECT:         {naive_time * 1000:>9.1f} ms ({2 * args.messages} queries)")
+        print(f"detokenize_many(), cold:  {cold_time * 1000:>9.1f} ms ({naive_time / cold_time:.1f}x)")
+        print(f"detokenize_many(), warm:  {warm_time * 1000:>9.1f} ms ({naive_time / warm_time:.1f}x, "
+              f"{vault.hits} hits, {vault.misses} misses)")
+
+
+if __name__ == "__main__":
+    main()
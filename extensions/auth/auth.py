@@ -1,24 +1,25 @@
-import json
 from flask import request, jsonify, redirect
 from ..models import Interpreter
 from ..models import Patient
 from functools import wraps
 from jose import jwt
-from urllib.request import urlopen
 import os
 from dotenv import load_dotenv
 from flask import session, abort
-import requests
 import logging
 from typing import Union
 
 from ..utils import check_login
+from .jwks import get_jwks_cache, verify_token
+from .management import ManagementClient
 
 load_dotenv()
 
 AUTH0_DOMAIN = os.environ['AUTH0_DOMAIN']
 ALGORITHMS = os.getenv('ALGORITHMS')
 API_AUDIENCE = os.getenv('API_AUDIENCE')
+# Seconds the identity provider's signing keys are cached for
+JWKS_TTL = int(os.getenv('JWKS_TTL', '600'))
 # AUTH0_CALLBACK_URL = os.getenv("AUTH0_CALLBACK_URL")
 
 
@@ -74,58 +75,46 @@ def check_permissions(permission, payload) -> bool:
 
 def verify_decode_jwt(token, domain) -> dict:
     # on signup token has no permissions yet
-    jsonurl = urlopen(f'https://{domain}/.well-known/jwks.json')
-    jwks = json.loads(jsonurl.read())
     unverified_header = jwt.get_unverified_header(token)
-    rsa_key = {}
     if 'kid' not in unverified_header:
         raise AuthError({
             'code': 'invalid_header',
             'description': 'Authorization malformed.'
         }, 401)
 
-    for key in jwks['keys']:
-        if key['kid'] == unverified_header['kid']:
-            rsa_key = {
-                'kty': key['kty'],
-                'kid': key['kid'],
-                'use': key['use'],
-                'n': key['n'],
-                'e': key['e']
-            }
-    if rsa_key:
-        try:
-            payload = jwt.decode(
-                token,
-                rsa_key,
-                algorithms=ALGORITHMS,
-                audience=API_AUDIENCE,
-                issuer='https://' + AUTH0_DOMAIN + '/'
-            )
-
-            return payload
-
-        except jwt.ExpiredSignatureError:
-            session.clear()
-            raise AuthError({
-                'code': 'token_expired',
-                'description': 'Token expired.'
-            }, 401)
-
-        except jwt.JWTClaimsError:
-            raise AuthError({
-                'code': 'invalid_claims',
-                'description': 'Ivalid claims. Check the audience and issuer.'
-            }, 401)
-        except Exception:
-            raise AuthError({
-                'code': 'invalid_header',
-                'description': 'Unable to parse authentication token.'
-            }, 400)
-    raise AuthError({
-        'code': 'invalid_header',
-                'description': 'Unable to find the appropriate key.'
-    }, 401)
+    # The signing keys come from an in-process cache instead of a JWKS request per call.
+    try:
+        return verify_token(
+            token,
+            get_jwks_cache(domain, ttl=JWKS_TTL),
+            algorithms=ALGORITHMS,
+            audience=API_AUDIENCE,
+            issuer='https://' + AUTH0_DOMAIN + '/'
+        )
+
+    except LookupError:
+        raise AuthError({
+            'code': 'invalid_header',
+            'description': 'Unable to find the appropriate key.'
+        }, 401)
+
+    except jwt.ExpiredSignatureError:
+        session.clear()
+        raise AuthError({
+            'code': 'token_expired',
+            'description': 'Token expired.'
+        }, 401)
+
+    except jwt.JWTClaimsError:
+        raise AuthError({
+            'code': 'invalid_claims',
+            'description': 'Ivalid claims. Check the audience and issuer.'
+        }, 401)
+    except Exception:
+        raise AuthError({
+            'code': 'invalid_header',
+            'description': 'Unable to parse authentication token.'
+        }, 400)
 
 
 class AuthError(Exception):
@@ -169,32 +158,27 @@ def requires_auth(permission="", role=""):
     return requires_auth_decorator
 
 
-def _get_management_token():
-    """ GET Management API Access Token """
-    AUTH0_ID = os.environ.get("AUTH0_ID")
-    JWT_CODE_SIGNING_SECRET = os.environ.get("JWT_CODE_SIGNING_SECRET")
-    AUTH0_DOMAIN = os.environ.get("AUTH0_DOMAIN")
-
-    payload = {
-        "grant_type": "client_credentials",
-        "client_id": AUTH0_ID,
-        "client_secret": JWT_CODE_SIGNING_SECRET,
-        "audience": f"https://{AUTH0_DOMAIN}/api/v2/"
-    }
-
-    headers = {'content-type': "application/x-www-form-urlencoded"}
+_management_client = None
 
-    url = f'https://{AUTH0_DOMAIN}/oauth/token'
 
-    response = requests.post(
-        url, headers=headers, data=payload
-    )
+def get_management_client() -> ManagementClient:
+    """ The Management API client shared by the helpers below, one pooled session per process """
+    global _management_client
+    if _management_client is None:
+        _management_client = ManagementClient(
+            os.environ.get("AUTH0_DOMAIN"),
+            os.environ.get("AUTH0_ID"),
+            os.environ.get("JWT_CODE_SIGNING_SECRET"),
+        )
+    return _management_client
 
-    data = response.json()
 
-    if data.get("access_token"):
-        return data["access_token"]
-    else:
+def _get_management_token():
+    """ GET Management API Access Token, reused until shortly before it expires """
+    try:
+        return get_management_client().token()
+    except Exception as error:
+        logging.error("Management API token error %s", error)
         return redirect("/logout")
 
 
@@ -206,45 +190,21 @@ def get_auth0_user(user_id):
     Scopes/permissions needed: read:users && read:user_idp_tokens
     """
 
-    AUTH0_DOMAIN = os.environ.get("AUTH0_DOMAIN")
+    return get_management_client().get_user(user_id)
 
-    management_token = _get_management_token()
 
-    HEADERS = {
-        'authorization': f"Bearer {management_token} ",
-    }
+def get_auth0_users(user_ids, max_workers=8) -> dict:
+    """ Fetching many users from auth0 concurrently, returns a dict keyed by user_id """
 
-    url = f'https://{AUTH0_DOMAIN}/api/v2/users/{user_id}'
-
-    response = requests.get(
-        url, headers=HEADERS
-    )
-
-    return response.json()
+    return get_management_client().get_users(user_ids, max_workers=max_workers)
 
 
 def add_role(USER_ID, ROLE_ID) -> Union[None, dict]:
     """ Adding role to a user by user_id and role_id """
 
-    AUTH0_DOMAIN = os.environ.get("AUTH0_DOMAIN")
-
 # Access Token for the Management API with the scopes read:roles and
 # update:users
-    management_token = _get_management_token()
-
-    HEADERS = {
-        'content-type': "application/json",
-        'authorization': f"Bearer {management_token} ",
-        'cache-control': "no-cache"
-    }
-
-    url = f'https://{AUTH0_DOMAIN}/api/v2/users/{USER_ID}/roles'
-
-    payload = {"roles": [f"{ROLE_ID}"]}
-
-    response = requests.post(
-        url, headers=HEADERS, json=payload
-    )
+    response = get_management_client().add_role(USER_ID, ROLE_ID)
     logging.info("response from add role %s", response)
 
     if response.status_code != 204:
@@ -259,47 +219,30 @@ def add_role(USER_ID, ROLE_ID) -> Union[None, dict]:
     return data
 
 
-def refresh_token(code) -> None:
-    """ Refreshing token at auth0 """
+def add_roles(USER_IDS, ROLE_ID, max_workers=8) -> dict:
+    """ Adding one role to many users concurrently,
+    returns the status code per user_id (204 on success) """
 
-    headers = {'content-type': "application/x-www-form-urlencoded"}
+    statuses = get_management_client().add_roles(USER_IDS, ROLE_ID, max_workers=max_workers)
+    failed = [user_id for user_id, status in statuses.items() if status != 204]
+    if failed:
+        logging.error("Couldn't assign role to %s users", len(failed))
+    return statuses
 
-    url = f'https://{AUTH0_DOMAIN}/oauth/token'
 
-    payload = {
-        "grant_type": 'authorization_code',
-        "client_id": os.environ.get("AUTH0_ID"),
-        "client_secret": os.environ.get("JWT_CODE_SIGNING_SECRET"),
-        "code": code,
-        "redirect_uri": os.environ.get("AUTH0_CALLBACK_URL")
-    }
+def refresh_token(code) -> None:
+    """ Refreshing token at auth0 """
 
-    requests.post(
-        url, headers=headers, data=payload
-    )
+    get_management_client().exchange_code(code, os.environ.get("AUTH0_CALLBACK_URL"))
 
 
 def delete_user(USER_ID) -> Union[None, dict]:
     """ Deleting users from auth0,
     will work only for production api with delete:users,,delete:current_user permission """
 
-    AUTH0_DOMAIN = os.environ.get("AUTH0_DOMAIN")
-
     # Access Token for the Management API with the scopes read:roles and
     # update:users
-    management_token = _get_management_token()
-
-    HEADERS = {
-        'content-type': "application/json",
-        'authorization': f"Bearer {management_token} ",
-        'cache-control': "no-cache"
-    }
-
-    url = f'https://{AUTH0_DOMAIN}/api/v2/users/{USER_ID}'
-
-    response = requests.delete(
-        url, headers=HEADERS
-    )
+    response = get_management_client().delete_user(USER_ID)
 
     if response.status_code != 204:
         logging.error("Deleting %s", response.json())
@@ -0,0 +1,142 @@
+import json
+import logging
+import threading
+import time
+from typing import Optional
+from urllib.request import urlopen
+
+from jose import jwk, jwt
+
+logger = logging.getLogger(__name__)
+
+
+class JWKSCache:
+    """
+    An in-process cache of an identity provider's signing keys, keyed by `kid`.
+
+    Keys are turned into key objects once per fetch, so verifying a token never
+    parses the JWK again. The key set is refetched when it is older than `ttl`,
+    or right away when a token names a `kid` the cache doesn't know (the provider
+    rotated its keys). Forced refetches are limited to one per `min_refetch_interval`
+    so tokens with made-up `kid`s can't make every request call the provider.
+    If a refetch fails, the keys already cached keep being used.
+    """
+
+    def __init__(self, url: str, ttl: float = 600, min_refetch_interval: float = 30, timeout: float = 5,
+                 algorithm: str = 'RS256', clock=time.monotonic):
+        self.url = url
+        self.ttl = ttl
+        self.min_refetch_interval = min_refetch_interval
+        self.timeout = timeout
+        self.algorithm = algorithm
+        self._clock = clock
+        self._keys = {}
+        self._fetched_at = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.fetches = 0
+
+    def _fetch(self) -> dict:
+        with urlopen(self.url, timeout=self.timeout) as response:
+            jwks = json.loads(response.read())
+        keys = {}
+        for key in jwks.get('keys', []):
+            if key.get('kty') != 'RSA' or key.get('use', 'sig') != 'sig':
+                continue
+            keys[key['kid']] = jwk.construct(key, key.get('alg', self.algorithm))
+        return keys
+
+    def refresh(self, fetched_before: Optional[float] = None) -> dict:
+        """
+        Fetches the key set again and returns it.
+
+        With `fetched_before`, the fetch is skipped when another thread already
+        refreshed the keys after that time, so concurrent misses share one fetch.
+        """
+        with self._lock:
+            if fetched_before is not None and self._fetched_at is not None and self._fetched_at > fetched_before:
+                return self._keys
+            try:
+                keys = self._fetch()
+            except Exception as error:
+                logger.error(f"Fetching the JWKS from {self.url} failed: {error}")
+                if not self._keys:
+                    raise
+                # Keep the stale keys and try again after min_refetch_interval, not on every request.
+                self._fetched_at = self._clock() - self.ttl + self.min_refetch_interval
+                return self._keys
+            finally:
+                self.fetches += 1
+            self._keys = keys
+            self._fetched_at = self._clock()
+            logger.info(f"Fetched {len(keys)} signing key(s) from {self.url}.")
+            return keys
+
+    def get_key(self, kid: str):
+        """Returns the key object for `kid`, or None if the provider doesn't have it."""
+        now = self._clock()
+        fetched_at = self._fetched_at
+        keys = self._keys
+        if fetched_at is None or now - fetched_at >= self.ttl:
+            keys = self.refresh(fetched_before=now - self.ttl)
+        elif kid not in keys and now - fetched_at >= self.min_refetch_interval:
+            keys = self.refresh(fetched_before=fetched_at)
+        return keys.get(kid)
+
+    def start(self, interval: Optional[float] = None):
+        """Refreshes the keys in a daemon thread before they expire, so requests don't wait on a fetch."""
+        if self._thread is not None:
+            return
+        interval = interval or self.ttl * 0.8
+
+        def run():
+            while not self._stop.wait(interval):
+                try:
+                    self.refresh()
+                except Exception:
+                    # Nothing is cached yet (`refresh` logged why); keep the thread alive and retry next interval.
+                    pass
+
+        self._thread = threading.Thread(target=run, name='jwks-refresh', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_jwks_cache(domain: str, ttl: float = 600, background: bool = True) -> JWKSCache:
+    """Returns the process-wide key cache for an Auth0 domain, starting its background refresh."""
+    cache = _caches.get(domain)
+    if cache is None:
+        with _caches_lock:
+            cache = _caches.get(domain)
+            if cache is None:
+                cache = JWKSCache(f'https://{domain}/.well-known/jwks.json', ttl=ttl)
+                if background:
+                    cache.start()
+                _caches[domain] = cache
+    return cache
+
+
+def verify_token(token: str, cache: JWKSCache, algorithms, audience: str, issuer: str) -> dict:
+    """
+    Verifies a token against the cached signing keys and returns its claims.
+
+    Raises `LookupError` when the token has no `kid` or the provider has no key for it.
+    Expired tokens and bad claims raise the usual `jose.jwt` errors.
+    """
+    kid = jwt.get_unverified_header(token).get('kid')
+    if not kid:
+        raise LookupError('Token header has no kid.')
+    key = cache.get_key(kid)
+    if key is None:
+        raise LookupError(f'No signing key found for kid {kid}.')
+    return jwt.decode(token, key, algorithms=algorithms, audience=audience, issuer=issuer)
@@ -0,0 +1,149 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+
+def make_session(pool_size: int = 10, retries: int = 3, backoff: float = 0.3) -> requests.Session:
+    """
+    Returns a `requests.Session` that keeps connections alive and retries transient failures.
+
+    Connection errors and 429/5xx responses are retried with exponential backoff,
+    honouring `Retry-After`. POST and DELETE are retried as well, so the session is
+    only for requests that can safely be sent twice: the Management API calls used
+    here and the client-credentials token request. Pass `retries=0` for anything else.
+    """
+    retry = Retry(
+        total=retries,
+        backoff_factor=backoff,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=None,
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+class ManagementClient:
+    """
+    A client for the Auth0 Management API that shares one pooled session.
+
+    The client-credentials token is reused until `expiry_margin` seconds before its
+    `expires_in` runs out, instead of being requested before every call. A 401
+    drops the cached token and the call is retried once with a new one.
+
+    Authorization codes are single-use, so `exchange_code` posts on a second
+    session without retries: a retry after a lost response would only get
+    `invalid_grant` back and hide whether the first exchange succeeded.
+    """
+
+    def __init__(self, domain: str, client_id: str, client_secret: str, base_url: Optional[str] = None,
+                 timeout=(3.05, 10), expiry_margin: float = 60, session: Optional[requests.Session] = None,
+                 clock=time.monotonic):
+        self.domain = domain
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.base_url = (base_url or f'https://{domain}').rstrip('/')
+        self.timeout = timeout
+        self.expiry_margin = expiry_margin
+        self.session = session or make_session()
+        self.code_session = make_session(pool_size=1, retries=0)
+        self._clock = clock
+        self._token = None
+        self._token_expires_at = 0.0
+        self._token_lock = threading.Lock()
+        self.token_fetches = 0
+
+    def _oauth_token(self, payload: dict, session: Optional[requests.Session] = None) -> dict:
+        response = (session or self.session).post(
+            f'{self.base_url}/oauth/token',
+            headers={'content-type': "application/x-www-form-urlencoded"},
+            data=payload,
+            timeout=self.timeout,
+        )
+        return response.json()
+
+    def token(self) -> str:
+        """Returns a Management API access token, requesting a new one only when the cached one is about to expire."""
+        with self._token_lock:
+            if self._token and self._clock() < self._token_expires_at:
+                return self._token
+            data = self._oauth_token({
+                "grant_type": "client_credentials",
+                "client_id": self.client_id,
+                "client_secret": self.client_secret,
+                "audience": f"https://{self.domain}/api/v2/"
+            })
+            self.token_fetches += 1
+            if not data.get("access_token"):
+                raise RuntimeError(f"No Management API token returned: {data.get('error', 'unknown error')}")
+            self._token = data["access_token"]
+            self._token_expires_at = self._clock() + float(data.get("expires_in", 0)) - self.expiry_margin
+            return self._token
+
+    def invalidate_token(self):
+        with self._token_lock:
+            self._token = None
+
+    def request(self, method: str, path: str, **kwargs) -> requests.Response:
+        """Sends an authenticated request to the Management API, e.g. `request('GET', '/users/<id>')`."""
+        url = f'{self.base_url}/api/v2{path}'
+        kwargs.setdefault('timeout', self.timeout)
+        headers = dict(kwargs.pop('headers', None) or {})
+        for attempt in range(2):
+            headers['authorization'] = f"Bearer {self.token()}"
+            response = self.session.request(method, url, headers=headers, **kwargs)
+            if response.status_code != 401 or attempt:
+                return response
+            # The token was revoked or rotated before it expired.
+            self.invalidate_token()
+        return response
+
+    def get_user(self, user_id: str) -> dict:
+        return self.request('GET', f'/users/{user_id}').json()
+
+    def add_role(self, user_id: str, role_id: str) -> requests.Response:
+        return self.request('POST', f'/users/{user_id}/roles', json={"roles": [f"{role_id}"]},
+                            headers={'cache-control': "no-cache"})
+
+    def delete_user(self, user_id: str) -> requests.Response:
+        return self.request('DELETE', f'/users/{user_id}', headers={'cache-control': "no-cache"})
+
+    def exchange_code(self, code: str, redirect_uri: Optional[str]) -> dict:
+        """Exchanges an authorization code for the user's tokens."""
+        return self._oauth_token({
+            "grant_type": 'authorization_code',
+            "client_id": self.client_id,
+            "client_secret": self.client_secret,
+            "code": code,
+            "redirect_uri": redirect_uri
+        }, session=self.code_session)
+
+    def _map(self, func, items, max_workers: int) -> list:
+        items = list(items)
+        if not items:
+            return []
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as executor:
+            return list(executor.map(func, items))
+
+    def get_users(self, user_ids: Iterable[str], max_workers: int = 8) -> dict:
+        """Fetches many users, at most `max_workers` at a time. Returns a dict keyed by user id."""
+        user_ids = list(user_ids)
+        return dict(zip(user_ids, self._map(self.get_user, user_ids, max_workers)))
+
+    def add_roles(self, user_ids: Iterable[str], role_id: str, max_workers: int = 8) -> dict:
+        """Assigns one role to many users, at most `max_workers` at a time. Returns the status code per user id."""
+        user_ids = list(user_ids)
+        responses = self._map(lambda user_id: self.add_role(user_id, role_id), user_ids, max_workers)
+        return {user_id: response.status_code for user_id, response in zip(user_ids, responses)}
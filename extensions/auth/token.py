@@ -0,0 +1,142 @@
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, FrozenSet, NamedTuple, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class CachedUser(NamedTuple):
+    """The fields of a `User` that authenticated routes need, kept without a database session."""
+    id: int
+    username: str
+    role: str
+    is_active: bool
+    permissions: FrozenSet[str]
+
+    @classmethod
+    def from_user(cls, user) -> 'CachedUser':
+        return cls(user.id, user.username, user.role, bool(user.is_active), permission_set(user.permissions))
+
+
+class VerifiedToken(NamedTuple):
+    """Claims of a token whose signature and expiry have been checked."""
+    claims: dict
+    username: str
+    role: Optional[str]
+    permissions: FrozenSet[str]
+
+
+def permission_set(permissions) -> FrozenSet[str]:
+    """Turns a space separated permissions string (or a list of them) into a set."""
+    if not permissions:
+        return frozenset()
+    if isinstance(permissions, str):
+        permissions = permissions.split()
+    return frozenset(permissions)
+
+
+class TokenCache:
+    """
+    Caches verified token claims and user records for the `token_required` decorator.
+
+    Claims are kept until the token's own `exp`, so a cached token never outlives
+    its signature check. Tokens are stored under their SHA-256 digest. User records
+    are kept for `user_ttl` seconds, and `invalidate_user` drops both a user's
+    record and every token cached for them.
+    """
+
+    def __init__(self, max_entries: int = 10000, user_ttl: float = 60, clock=time.time):
+        self.max_entries = max_entries
+        self.user_ttl = user_ttl
+        self._clock = clock
+        self._tokens = OrderedDict()
+        self._users = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _token_key(token: str) -> str:
+        return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+    def _put(self, entries: OrderedDict, key, value):
+        entries[key] = value
+        entries.move_to_end(key)
+        while len(entries) > self.max_entries:
+            entries.popitem(last=False)
+
+    def verify(self, token: str, decode: Callable[[str], dict]) -> VerifiedToken:
+        """Returns the verified claims of `token`, calling `decode` only on a miss or after `exp`."""
+        key = self._token_key(token)
+        now = self._clock()
+        with self._lock:
+            entry = self._tokens.get(key)
+            if entry is not None and entry[0] > now:
+                self._tokens.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self._tokens.pop(key, None)
+            self.misses += 1
+        claims = decode(token)
+        verified = VerifiedToken(claims, claims['username'], claims.get('role'), permission_set(claims.get('permissions')))
+        expires_at = claims.get('exp')
+        if expires_at is not None:
+            with self._lock:
+                self._put(self._tokens, key, (float(expires_at), verified))
+        return verified
+
+    def user(self, username: str, load: Callable[[str], object]) -> Optional[CachedUser]:
+        """Returns the cached record for `username`, calling `load` when it is missing or stale."""
+        now = self._clock()
+        with self._lock:
+            entry = self._users.get(username)
+            if entry is not None and entry[0] > now:
+                self._users.move_to_end(username)
+                return entry[1]
+        user = load(username)
+        if user is None:
+            return None
+        cached = CachedUser.from_user(user)
+        with self._lock:
+            self._put(self._users, username, (now + self.user_ttl, cached))
+        return cached
+
+    def invalidate_user(self, user_id=None, username: Optional[str] = None):
+        """Forgets a user's record and tokens, found by id, username or both."""
+        with self._lock:
+            usernames = {username} if username else set()
+            usernames.update(name for name, (_, cached) in self._users.items() if cached.id == user_id)
+            for name in usernames:
+                self._users.pop(name, None)
+            stale = [key for key, (_, verified) in self._tokens.items() if verified.username in usernames]
+            for key in stale:
+                del self._tokens[key]
+        if usernames:
+            logger.info(f"Cleared cached credentials of user id={user_id}.")
+
+    def clear(self):
+        with self._lock:
+            self._tokens.clear()
+            self._users.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+_cache = TokenCache()
+
+
+def get_token_cache() -> TokenCache:
+    """Returns the process-wide token cache."""
+    return _cache
+
+
+def init_app(application):
+    """Sizes the process-wide token cache from the app config."""
+    global _cache
+    _cache = TokenCache(
+        max_entries=int(application.config.get("TOKEN_CACHE_SIZE", 10000)),
+        user_ttl=float(application.config.get("USER_CACHE_TTL", 60)),
+    )
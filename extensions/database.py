@@ -1,10 +1,14 @@
 from flask_migrate import Migrate
+import logging
 import os
+import threading
+import time
 from dotenv.main import load_dotenv
 from sqlalchemy import MetaData
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy import create_engine, text
+from sqlalchemy import event, exc, text
+from sqlalchemy.engine import make_url
 from sqlalchemy.pool import QueuePool
 
 load_dotenv()
@@ -26,30 +30,199 @@ metadata = MetaData(naming_convention=convention)
 
 db = SQLAlchemy(metadata=metadata)
 
-def setup_db(application, database_url=DATABASE_URL):
-    if database_url[0:10] != "postgresql":
-        database_url = database_url.replace("postgres", "postgresql")
-    engine = create_engine(
-        database_url,
-        echo=False,  # Set to False in production if you don't want SQL logs
-        poolclass=QueuePool,
-        pool_size=5,         # Max persistent connections in pool
-        max_overflow=3,       # Extra temporary connections
-        pool_timeout=30,      # Seconds to wait before giving up on a connection
-        pool_pre_ping=True,   # Automatically check connection liveness
-        pool_recycle=280 
+
+class PoolMetrics:
+    """Counters for connection pool usage, updated from pool events."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.connects = 0
+            self.checkouts = 0
+            self.checkins = 0
+            self.timeouts = 0
+            self.wait_seconds_total = 0.0
+            self.wait_seconds_max = 0.0
+            self.overflow_max = 0
+
+    def record_wait(self, seconds: float, overflow: int, timed_out: bool = False):
+        with self._lock:
+            self.wait_seconds_total += seconds
+            self.wait_seconds_max = max(self.wait_seconds_max, seconds)
+            self.overflow_max = max(self.overflow_max, overflow)
+            if timed_out:
+                self.timeouts += 1
+
+    def count(self, name: str):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+
+pool_metrics = PoolMetrics()
+
+
+class InstrumentedQueuePool(QueuePool):
+    """A QueuePool that records how long each checkout waited for a free connection."""
+
+    def _do_get(self):
+        # QueuePool has no event before a checkout, so the wait is timed around the
+        # method that blocks on the pool's queue.
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            pool_metrics.record_wait(time.perf_counter() - start, self.overflow(), timed_out=True)
+            raise
+        pool_metrics.record_wait(time.perf_counter() - start, self.overflow())
+        return connection
+
+
+def _config(application, key, default):
+    return application.config.get(key, os.environ.get(key, default))
+
+
+def normalize_url(database_url: str) -> str:
+    """Heroku style postgres:// URLs are spelled postgresql:// by SQLAlchemy."""
+    if database_url.startswith("postgres://"):
+        database_url = "postgresql://" + database_url[len("postgres://"):]
+    return database_url
+
+
+def engine_options(application, database_url: str) -> dict:
+    """Builds `SQLALCHEMY_ENGINE_OPTIONS` from the DB_* settings in the app config or environment."""
+    url = make_url(database_url)
+    if url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:"):
+        # An in-memory database lives in a single connection, Flask-SQLAlchemy
+        # gives it a StaticPool that takes no sizing options.
+        return {}
+    return dict(
+        poolclass=InstrumentedQueuePool,
+        pool_size=int(_config(application, "DB_POOL_SIZE", 5)),  # Max persistent connections in pool
+        max_overflow=int(_config(application, "DB_MAX_OVERFLOW", 3)),  # Extra temporary connections
+        pool_timeout=float(_config(application, "DB_POOL_TIMEOUT", 30)),  # Seconds to wait before giving up on a connection
+        pool_pre_ping=str(_config(application, "DB_POOL_PRE_PING", "true")).lower() == "true",  # Check connection liveness
+        pool_recycle=int(_config(application, "DB_POOL_RECYCLE", 280)),
     )
 
-    with engine.connect() as conn:
-        conn.execute(text("SET search_path TO public;"))
+
+def enable_sqlite_savepoints(engine):
+    """
+    Lets SAVEPOINTs work on SQLite.
+
+    pysqlite only opens a transaction before DML, so a SAVEPOINT issued first opens
+    one on its own, and releasing it commits. The driver's transaction handling is
+    turned off and SQLAlchemy emits the BEGIN itself, as the SQLAlchemy docs describe.
+    """
+    @event.listens_for(engine, "connect")
+    def on_connect(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(engine, "begin")
+    def on_begin(connection):
+        connection.exec_driver_sql("BEGIN")
+
+
+def enable_sqlite_foreign_keys(engine):
+    """
+    Makes SQLite enforce foreign keys, including their ON DELETE actions, as Postgres does.
+    SQLite leaves them off unless each connection turns them on.
+    """
+    @event.listens_for(engine, "connect")
+    def on_connect(dbapi_connection, connection_record):
+        dbapi_connection.execute("PRAGMA foreign_keys=ON")
+
+
+def _instrument(engine, search_path: str, statement_timeout_ms: int):
+    """Counts pool events and sets per-connection Postgres settings when a connection is opened."""
+    is_postgres = engine.dialect.name == "postgresql"
+
+    @event.listens_for(engine, "connect")
+    def on_connect(dbapi_connection, connection_record):
+        pool_metrics.count("connects")
+        if not is_postgres:
+            return
+        cursor = dbapi_connection.cursor()
+        try:
+            cursor.execute(f"SET search_path TO {search_path}")
+            if statement_timeout_ms:
+                cursor.execute(f"SET statement_timeout = {int(statement_timeout_ms)}")
+        finally:
+            cursor.close()
+        # The settings must survive the rollback the pool does on checkin.
+        dbapi_connection.commit()
+
+    @event.listens_for(engine, "checkout")
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):
+        pool_metrics.count("checkouts")
+
+    @event.listens_for(engine, "checkin")
+    def on_checkin(dbapi_connection, connection_record):
+        pool_metrics.count("checkins")
+
+
+def pool_status(engine=None) -> dict:
+    """Returns the pool's current state together with the counters collected since startup."""
+    pool = (engine or db.engine).pool
+    status = {
+        "connects": pool_metrics.connects,
+        "checkouts": pool_metrics.checkouts,
+        "checkins": pool_metrics.checkins,
+        "timeouts": pool_metrics.timeouts,
+        "wait_seconds_total": round(pool_metrics.wait_seconds_total, 6),
+        "wait_seconds_max": round(pool_metrics.wait_seconds_max, 6),
+        "overflow_max": pool_metrics.overflow_max,
+    }
+    if isinstance(pool, QueuePool):
+        status.update(size=pool.size(), checked_out=pool.checkedout(), overflow=pool.overflow())
+    return status
+
+
+def check_connection(engine=None) -> bool:
+    """Runs a trivial query. Startup no longer connects, so this is the explicit probe."""
+    try:
+        with (engine or db.engine).connect() as conn:
+            conn.execute(text("SELECT 1"))
+        return True
+    except exc.SQLAlchemyError as error:
+        logging.error(f"Database connection check failed: {error}")
+        return False
+
+
+def setup_db(application, database_url=None):
+    """
+    Configures the app's engine without connecting to the database.
+
+    The schema is managed by Alembic (`flask db upgrade`). Set DB_CREATE_ALL to
+    create missing tables at startup instead, e.g. for a throwaway SQLite database.
+    """
+    database_url = normalize_url(database_url or DATABASE_URL or application.config["SQLALCHEMY_DATABASE_URI"])
 
     application.config["SQLALCHEMY_DATABASE_URI"] = database_url
     application.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    # Flask-SQLAlchemy creates the one engine the app uses from these options.
+    application.config.setdefault("SQLALCHEMY_ENGINE_OPTIONS", engine_options(application, database_url))
+    # The tokenization vault (models/vault.py) has its own bind, in the same database unless VAULT_DATABASE_URL is set.
+    vault_url = normalize_url(_config(application, "VAULT_DATABASE_URL", None) or database_url)
+    application.config.setdefault("SQLALCHEMY_BINDS", {}).setdefault(
+        "vault", {"url": vault_url, **engine_options(application, vault_url)})
     db.app = application
     with application.app_context():
         db.init_app(application)
-        db.create_all()  # Heroku deployment doesn't need this line
-        engine.dispose()
+        _instrument(
+            db.engine,
+            search_path=_config(application, "DB_SEARCH_PATH", "public"),
+            statement_timeout_ms=int(_config(application, "DB_STATEMENT_TIMEOUT_MS", 0)),
+        )
+        for engine in db.engines.values():
+            if engine.dialect.name == "sqlite":
+                # The bulk operations of CRUDMixin isolate failing chunks in savepoints.
+                enable_sqlite_savepoints(engine)
+                enable_sqlite_foreign_keys(engine)
+        if str(_config(application, "DB_CREATE_ALL", "false")).lower() == "true":
+            db.create_all()
 
 
 migrate = Migrate()
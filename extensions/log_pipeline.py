@@ -0,0 +1,255 @@
+import atexit
+import logging
+import queue
+import random
+import re
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import Iterable, Optional
+
+from pythonjsonlogger import jsonlogger
+
+from services.redaction import PII_REDACTOR
+
+# Fields whose values never reach a log file, wherever they appear.
+SENSITIVE_FIELDS = ('password', 'passwd', 'secret', 'token', 'authorization', 'api_key', 'vault_key')
+MASK = '***'
+
+_SENSITIVE_NAME = '|'.join(SENSITIVE_FIELDS)
+# `password=...`, `"password": "..."` and `('password', '...')` inside a message, and bearer credentials.
+_SENSITIVE_VALUE = re.compile(
+    rf"""(?i)(['"]?\w*(?:{_SENSITIVE_NAME})\w*['"]?\s*(?:[:=]|(?<=['"]),)\s*)(?:'[^']*'|"[^"]*"|[^\s,;&)}}\]]+)""")
+_BEARER = re.compile(r'(?i)\b(bearer\s+)[\w.~+/=-]+')
+_SENSITIVE_KEY = re.compile(rf'(?i){_SENSITIVE_NAME}')
+
+# Attributes every LogRecord has; anything else came in through `extra=`.
+_RECORD_ATTRIBUTES = frozenset(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime'}
+
+
+def scrub_text(text: str) -> str:
+    """Masks credentials, email addresses and phone numbers in a log message."""
+    text = _BEARER.sub(lambda match: match.group(1) + MASK, text)
+    text = _SENSITIVE_VALUE.sub(lambda match: match.group(1) + MASK, text)
+    return PII_REDACTOR.redact(text)
+
+
+def scrub_value(value):
+    """Scrubs strings and masks sensitive keys of dicts, lists and tuples, recursively."""
+    if isinstance(value, str):
+        return scrub_text(value)
+    if isinstance(value, dict):
+        return {key: MASK if isinstance(key, str) and _SENSITIVE_KEY.search(key) else scrub_value(item)
+                for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return type(value)(scrub_value(item) for item in value)
+    return value
+
+
+def scrub_record(record: logging.LogRecord) -> logging.LogRecord:
+    """Scrubs a record's message and its `extra` fields in place, before any handler formats it."""
+    record.msg = scrub_text(record.getMessage())
+    record.args = None
+    # Tracebacks are rendered here so the exception message is scrubbed too.
+    if record.exc_info:
+        record.exc_text = scrub_text(logging.Formatter().formatException(record.exc_info))
+        record.exc_info = None
+    if record.stack_info:
+        record.stack_info = scrub_text(record.stack_info)
+    for name, value in list(vars(record).items()):
+        if name in _RECORD_ATTRIBUTES:
+            continue
+        setattr(record, name, MASK if _SENSITIVE_KEY.search(name) else scrub_value(value))
+    return record
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Drops DEBUG and INFO records from chatty loggers; warnings and errors always pass.
+
+    Each logger gets a token bucket of `burst` records refilled at `rate` records per
+    second (0 turns the limit off). Records from loggers under one of the `sampled`
+    prefixes are additionally kept with probability `sample_rate`, which is meant
+    for hot-path events such as one line per redaction.
+    """
+
+    def __init__(self, rate: float = 0, burst: int = 0, sample_rate: float = 1.0,
+                 sampled: Iterable[str] = (), clock=time.monotonic, rng=random.random):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst or rate
+        self.sample_rate = sample_rate
+        self.sampled = tuple(sampled)
+        self._clock = clock
+        self._random = rng
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self.dropped = {}
+
+    def _is_sampled(self, name: str) -> bool:
+        return any(name == prefix or name.startswith(prefix + '.') for prefix in self.sampled)
+
+    def _drop(self, name: str) -> bool:
+        with self._lock:
+            self.dropped[name] = self.dropped.get(name, 0) + 1
+        return False
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        if self.sample_rate < 1 and self._is_sampled(record.name) and self._random() >= self.sample_rate:
+            return self._drop(record.name)
+        if not self.rate:
+            return True
+        now = self._clock()
+        with self._lock:
+            tokens, updated = self._buckets.get(record.name, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            allowed = tokens >= 1
+            self._buckets[record.name] = (tokens - 1 if allowed else tokens, now)
+        return allowed or self._drop(record.name)
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """
+    Hands records to the background writer without blocking the request.
+
+    The message is merged with its arguments here, since they may change once the
+    call returns, but formatting and scrubbing happen on the writer thread. When
+    the queue is full the record is counted and dropped.
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class ScrubbingQueueListener(QueueListener):
+    """Scrubs each record once on the writer thread, then passes it to every handler."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return scrub_record(record)
+
+    def enqueue_sentinel(self):
+        # Wait for room rather than fail when the queue is full at shutdown.
+        self.queue.put(self._sentinel)
+
+
+class LogPipeline:
+    """
+    Routes log records through a bounded queue to a background writer thread.
+
+    Callers pay for the level check, the rate limit and a queue put; scrubbing, JSON
+    formatting and disk writes happen on the writer thread. The log file is rotated
+    when it reaches `max_bytes`, keeping `backup_count` old files.
+    """
+
+    def __init__(self, level=logging.INFO, path: Optional[str] = 'app.log', max_bytes: int = 10 * 1024 * 1024,
+                 backup_count: int = 5, console: bool = True, queue_size: int = 10000,
+                 rate_limit: RateLimitFilter = None):
+        self.level = logging.getLevelName(level) if isinstance(level, str) else level
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.handler = NonBlockingQueueHandler(self.queue)
+        self.rate_limit = rate_limit or RateLimitFilter()
+        self.handler.addFilter(self.rate_limit)
+
+        formatter = jsonlogger.JsonFormatter("{message}{asctime}{name}{levelname}", style='{')
+        handlers = []
+        if path:
+            handlers.append(RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count, delay=True))
+        if console:
+            handlers.append(logging.StreamHandler())
+        for handler in handlers:
+            handler.setFormatter(formatter)
+        self.handlers = handlers
+        self.listener = ScrubbingQueueListener(self.queue, *handlers)
+        self._logger = None
+
+    def start(self, logger: logging.Logger = None):
+        """Replaces the handlers of `logger` (the root logger by default) with the queue and starts the writer."""
+        self._logger = logger or logging.getLogger()
+        self._logger.handlers.clear()
+        self._logger.setLevel(self.level)
+        self._logger.addHandler(self.handler)
+        self.listener.start()
+        return self
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        """Waits until the writer has handled every queued record; returns False on timeout."""
+        deadline = time.monotonic() + timeout
+        while self.queue.unfinished_tasks:
+            if time.monotonic() > deadline:
+                return False
+            time.sleep(0.001)
+        for handler in self.handlers:
+            handler.flush()
+        return True
+
+    def stop(self):
+        """Writes out the queued records, stops the writer and detaches from the logger."""
+        if self._logger is None:
+            return
+        self._logger.removeHandler(self.handler)
+        self.listener.stop()
+        for handler in self.handlers:
+            handler.close()
+        self._logger = None
+
+    def stats(self) -> dict:
+        return {
+            'queued': self.queue.qsize(),
+            'dropped_queue_full': self.handler.dropped,
+            'dropped_rate_limited': dict(self.rate_limit.dropped),
+        }
+
+
+_pipeline = None
+
+
+def get_log_pipeline() -> Optional[LogPipeline]:
+    """Returns the process-wide pipeline set up by `init_app`."""
+    return _pipeline
+
+
+def _stop():
+    if _pipeline is not None:
+        _pipeline.stop()
+
+
+def init_app(application):
+    """Sends the root logger through a new pipeline configured from the app config, stopping any previous one."""
+    global _pipeline
+    if _pipeline is None:
+        atexit.register(_stop)
+    else:
+        _pipeline.stop()
+    sampled = application.config.get("LOG_SAMPLED_LOGGERS", "")
+    if isinstance(sampled, str):
+        sampled = [name.strip() for name in sampled.split(",") if name.strip()]
+    rate_limit = RateLimitFilter(
+        rate=float(application.config.get("LOG_RATE_LIMIT", 0)),
+        burst=int(application.config.get("LOG_RATE_BURST", 0)),
+        sample_rate=float(application.config.get("LOG_SAMPLE_RATE", 1.0)),
+        sampled=sampled,
+    )
+    _pipeline = LogPipeline(
+        level=application.config.get("LOGGING_LEVEL", "INFO"),
+        path=application.config.get("LOG_FILE") or None,
+        max_bytes=int(application.config.get("LOG_MAX_BYTES", 10 * 1024 * 1024)),
+        backup_count=int(application.config.get("LOG_BACKUP_COUNT", 5)),
+        console=application.config.get("LOG_CONSOLE", True),
+        queue_size=int(application.config.get("LOG_QUEUE_SIZE", 10000)),
+        rate_limit=rate_limit,
+    ).start()
+    return _pipeline
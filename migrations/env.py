@@ -51,6 +51,19 @@ def get_metadata():
     return target_db.metadata
 
 
+def include_object(object, name, type_, reflected, compare_to):
+    """Leaves the tables of the 'vault' bind out of autogenerate.
+
+    `flask create-vault` creates them, in the main database when VAULT_DATABASE_URL
+    is unset, and they are not part of the main metadata, so autogenerate would
+    otherwise drop them.
+    """
+    import models.vault  # noqa: F401 (registers the vault bind's tables)
+
+    table = object if type_ == 'table' else getattr(object, 'table', None)
+    return table is None or table.name not in target_db.metadatas['vault'].tables
+
+
 def run_migrations_offline():
     """Run migrations in 'offline' mode.
 
@@ -65,7 +78,8 @@ def run_migrations_offline():
     """
     url = config.get_main_option("sqlalchemy.url")
     context.configure(
-        url=url, target_metadata=get_metadata(), literal_binds=True
+        url=url, target_metadata=get_metadata(), include_object=include_object,
+        literal_binds=True
     )
 
     with context.begin_transaction():
@@ -93,6 +107,7 @@ def run_migrations_online():
     conf_args = current_app.extensions['migrate'].configure_args
     if conf_args.get("process_revision_directives") is None:
         conf_args["process_revision_directives"] = process_revision_directives
+    conf_args.setdefault("include_object", include_object)
 
     connectable = get_engine()
 
@@ -0,0 +1,95 @@
+"""Initial schema: users, patients, languages and messages
+
+Revision ID: 1a3c5e7f9b2d
+Revises: 
+Create Date: 2025-09-24 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '1a3c5e7f9b2d'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # The tables as they were before bd7f0a2d7dc9, which adds users.permissions.
+    op.create_table('users',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('username', sa.String(length=50), nullable=False),
+    sa.Column('password_hash', sa.String(length=128), nullable=False),
+    sa.Column('role', sa.String(length=20), nullable=False),
+    sa.Column('full_name', sa.String(length=100), nullable=True),
+    sa.Column('is_active', sa.Boolean(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), server_default=sa.func.now(), nullable=True),
+    sa.Column('user_meta', sa.JSON(), nullable=True),
+    sa.PrimaryKeyConstraint('id', name=op.f('pk_users')),
+    sa.UniqueConstraint('username', name=op.f('uq_users_username'))
+    )
+    op.create_table('patients',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('year_of_birth', sa.Integer(), nullable=True),
+    sa.Column('first_name', sa.String(), nullable=True),
+    sa.Column('last_name', sa.String(), nullable=True),
+    sa.Column('email', sa.String(), nullable=False),
+    sa.Column('phone', sa.String(), nullable=True),
+    sa.Column('tz', sa.String(), nullable=False),
+    sa.Column('notes', sa.String(), nullable=True),
+    sa.Column('cliniko_medical_id', sa.BigInteger(), nullable=True),
+    sa.Column('cliniko_mental_id', sa.BigInteger(), nullable=True),
+    sa.Column('auth0_id', sa.String(), nullable=True),
+    sa.Column('created_at', sa.DateTime(timezone=True), nullable=True),
+    sa.Column('preferred_messenger', sa.String(length=20), nullable=True),
+    sa.PrimaryKeyConstraint('id', name=op.f('pk_patients')),
+    sa.UniqueConstraint('cliniko_medical_id', name=op.f('uq_patients_cliniko_medical_id')),
+    sa.UniqueConstraint('cliniko_mental_id', name=op.f('uq_patients_cliniko_mental_id')),
+    sa.UniqueConstraint('email', name=op.f('uq_patients_email'))
+    )
+    op.create_table('languages',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(length=100), nullable=False),
+    sa.PrimaryKeyConstraint('id', name=op.f('pk_languages')),
+    sa.UniqueConstraint('name', name=op.f('uq_languages_name'))
+    )
+    op.create_table('languages_patients',
+    sa.Column('language_id', sa.Integer(), nullable=False),
+    sa.Column('patient_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['language_id'], ['languages.id'],
+                            name=op.f('fk_languages_patients_language_id_languages')),
+    sa.ForeignKeyConstraint(['patient_id'], ['patients.id'], name=op.f('fk_languages_patients_patient_id_patients')),
+    sa.PrimaryKeyConstraint('language_id', 'patient_id', name=op.f('pk_languages_patients'))
+    )
+    op.create_table('messages',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('phone', sa.String(length=20), nullable=False),
+    sa.Column('patient_id', sa.Integer(), nullable=False),
+    sa.Column('sender', sa.String(length=20), nullable=True),
+    sa.Column('content', sa.Text(), nullable=True),
+    sa.Column('timestamp', sa.DateTime(), nullable=True),
+    sa.Column('messenger', sa.String(length=20), nullable=True),
+    sa.Column('msg_metadata', sa.JSON(), nullable=True),
+    sa.Column('wa_id', sa.String(length=200), nullable=True),
+    sa.Column('media_s3_key', sa.String(length=500), nullable=True),
+    sa.Column('media_type', sa.String(length=50), nullable=True),
+    sa.Column('status', sa.String(length=50), nullable=True),
+    sa.Column('is_read_by_admin', sa.Boolean(), nullable=False),
+    sa.ForeignKeyConstraint(['patient_id'], ['patients.id'], name=op.f('fk_messages_patient_id_patients')),
+    sa.PrimaryKeyConstraint('id', name=op.f('pk_messages'))
+    )
+    with op.batch_alter_table('messages', schema=None) as batch_op:
+        batch_op.create_index('ix_message_patient_timestamp', ['patient_id', 'timestamp'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('messages', schema=None) as batch_op:
+        batch_op.drop_index('ix_message_patient_timestamp')
+
+    op.drop_table('messages')
+    op.drop_table('languages_patients')
+    op.drop_table('languages')
+    op.drop_table('patients')
+    op.drop_table('users')
@@ -0,0 +1,26 @@
+"""Index messages by (timestamp, id) for keyset pagination
+
+Revision ID: 4c2e8f1a9b3d
+Revises: bd7f0a2d7dc9
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4c2e8f1a9b3d'
+down_revision = 'bd7f0a2d7dc9'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('messages', schema=None) as batch_op:
+        batch_op.create_index('ix_message_timestamp_id', ['timestamp', 'id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('messages', schema=None) as batch_op:
+        batch_op.drop_index('ix_message_timestamp_id')
@@ -0,0 +1,29 @@
+"""Delete a patient's messages with the patient
+
+Revision ID: 5b8d2f4a6c1e
+Revises: 9e4a6c8d0b2f
+Create Date: 2026-10-18 16:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5b8d2f4a6c1e'
+down_revision = '9e4a6c8d0b2f'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('messages', schema=None) as batch_op:
+        batch_op.drop_constraint(op.f('fk_messages_patient_id_patients'), type_='foreignkey')
+        batch_op.create_foreign_key(op.f('fk_messages_patient_id_patients'), 'patients', ['patient_id'], ['id'],
+                                    ondelete='CASCADE')
+
+
+def downgrade():
+    with op.batch_alter_table('messages', schema=None) as batch_op:
+        batch_op.drop_constraint(op.f('fk_messages_patient_id_patients'), type_='foreignkey')
+        batch_op.create_foreign_key(op.f('fk_messages_patient_id_patients'), 'patients', ['patient_id'], ['id'])
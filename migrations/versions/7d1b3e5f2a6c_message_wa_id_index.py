@@ -0,0 +1,26 @@
+"""Index messages by wa_id for webhook ingestion
+
+Revision ID: 7d1b3e5f2a6c
+Revises: 4c2e8f1a9b3d
+Create Date: 2026-10-18 14:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7d1b3e5f2a6c'
+down_revision = '4c2e8f1a9b3d'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('messages', schema=None) as batch_op:
+        batch_op.create_index('ix_message_wa_id', ['wa_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('messages', schema=None) as batch_op:
+        batch_op.drop_index('ix_message_wa_id')
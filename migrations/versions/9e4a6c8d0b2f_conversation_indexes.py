@@ -0,0 +1,32 @@
+"""Index conversations by (patient_id, timestamp, id) and unread messages
+
+Revision ID: 9e4a6c8d0b2f
+Revises: 7d1b3e5f2a6c
+Create Date: 2026-10-18 15:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9e4a6c8d0b2f'
+down_revision = '7d1b3e5f2a6c'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('messages', schema=None) as batch_op:
+        batch_op.drop_index('ix_message_patient_timestamp')
+        batch_op.create_index('ix_message_patient_timestamp', ['patient_id', 'timestamp', 'id'], unique=False)
+        batch_op.create_index('ix_message_unread_timestamp_id', ['timestamp', 'id'], unique=False,
+                              postgresql_where=sa.text('is_read_by_admin = false'),
+                              sqlite_where=sa.text('is_read_by_admin = 0'))
+
+
+def downgrade():
+    with op.batch_alter_table('messages', schema=None) as batch_op:
+        batch_op.drop_index('ix_message_unread_timestamp_id')
+        batch_op.drop_index('ix_message_patient_timestamp')
+        batch_op.create_index('ix_message_patient_timestamp', ['patient_id', 'timestamp'], unique=False)
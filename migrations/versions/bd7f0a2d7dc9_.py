@@ -1,7 +1,7 @@
 """empty message
 
 Revision ID: bd7f0a2d7dc9
-Revises: 
+Revises: 1a3c5e7f9b2d
 Create Date: 2025-09-25 10:49:39.115235
 
 """
@@ -11,7 +11,7 @@ import sqlalchemy as sa
 
 # revision identifiers, used by Alembic.
 revision = 'bd7f0a2d7dc9'
-down_revision = None
+down_revision = '1a3c5e7f9b2d'
 branch_labels = None
 depends_on = None
 
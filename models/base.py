@@ -1,18 +1,84 @@
+from sqlalchemy import insert, inspect, update
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.exc import SQLAlchemyError
 import logging
 import sys
-from datetime import datetime
+from datetime import date, datetime, time
+from functools import lru_cache
+from typing import Any, List, NamedTuple, Optional
 from extensions.database import db
 
+BULK_CHUNK_SIZE = 1000
+
+
+class BulkFailure(NamedTuple):
+    """A row a bulk operation could not write, with its position in the input."""
+    index: int
+    row: Any
+    error: str
+
+
+class BulkResult(NamedTuple):
+    """The outcome of `bulk_insert`, `bulk_upsert` or `bulk_update`."""
+    written: int
+    failures: List[BulkFailure]
+
+
+def _isoformat(value):
+    return None if value is None else value.isoformat()
+
+
+def _converter(column):
+    """The function that makes a column's values JSON serializable, or None when they already are."""
+    try:
+        python_type = column.type.python_type
+    except NotImplementedError:
+        return None
+    return _isoformat if issubclass(python_type, (date, datetime, time)) else None
+
+
+def _select(keys, only, exclude):
+    return tuple(key for key in keys if (only is None or key in only) and (exclude is None or key not in exclude))
+
+
+@lru_cache(maxsize=None)
+def _model_fields(cls, only=None, exclude=None) -> tuple:
+    """(attribute, converter) pairs for a model's columns, compiled once per class and field selection."""
+    converters = {attr.key: _converter(attr.columns[0]) for attr in inspect(cls).column_attrs}
+    return tuple((key, converters[key]) for key in _select(converters, only, exclude))
+
+
+def _maybe_isoformat(value):
+    # Columns that aren't attributes of the model (labels, functions) are checked per value.
+    return value.isoformat() if isinstance(value, (date, datetime, time)) else value
+
+
+@lru_cache(maxsize=256)
+def _row_fields(cls, row_keys, only=None, exclude=None) -> tuple:
+    """(index, key, converter) triples for the columns of a `Row`, compiled once per result shape."""
+    converters = {attr.key: _converter(attr.columns[0]) for attr in inspect(cls).column_attrs}
+    selected = _select(row_keys, only, exclude)
+    return tuple((row_keys.index(key), key, converters.get(key, _maybe_isoformat)) for key in selected)
+
+
+def _frozen(fields):
+    return None if fields is None else frozenset((fields,) if isinstance(fields, str) else fields)
+
+
 class CRUDMixin:
     """Mixin that adds convenience methods for CRUD (Create, Read, Update, Delete) operations."""
 
+    # Models whose `on_bulk_change` needs the primary keys of bulk inserted rows set this;
+    # the keys then come back with RETURNING and are added to the rows.
+    bulk_insert_returns_keys = False
+
     def insert(self):
         """Saves a new object to the database."""
         try:
             db.session.add(self)
             db.session.commit()
             db.session.refresh(self)
+            self.on_change()
             return self
         except SQLAlchemyError as error:
             db.session.rollback()
@@ -25,6 +91,7 @@ class CRUDMixin:
             db.session.delete(self)
             db.session.commit()
             logging.info(f"Instance of {self.__class__.__name__} with id={getattr(self, 'id', 'N/A')} was deleted.")
+            self.on_change()
             return True
         except SQLAlchemyError as error:
             db.session.rollback()
@@ -37,12 +104,16 @@ class CRUDMixin:
             db.session.commit()
             db.session.refresh(self)
             logging.info(f"_____UPDATED {self.__class__.__name__}")
+            self.on_change()
             return self
         except SQLAlchemyError as error:
             db.session.rollback()
             logging.error(f"ERROR IN UPDATE: {error}, {sys.exc_info()}, SELF {self}")
             return None
             
+    def on_change(self):
+        """Called after an insert, update or delete is committed. Models override it to refresh cached copies of themselves."""
+
     def dict_update(self, **kwargs):
         """
         Updates an object with a dictionary of values and commits the changes.
@@ -57,17 +128,185 @@ class CRUDMixin:
             logging.error(f"Dictionary Update Error: {e}", exc_info=True)
             return None
 
-    def format(self) -> dict:
-        """Serializes the object's attributes into a dictionary."""
-        dict_self = dict()
-        for key, value in self.__dict__.items():
-            if not key.startswith('_'):
+    @classmethod
+    def on_bulk_change(cls, rows: list):
+        """Called with the written rows after a bulk operation is committed. See `on_change`."""
+
+    @classmethod
+    def _bulk_values(cls, row) -> dict:
+        if isinstance(row, cls):
+            loaded = row.__dict__
+            return {key: loaded[key] for key, _ in _model_fields(cls) if key in loaded}
+        return dict(row)
+
+    @staticmethod
+    def _execute_chunk(session, statement, chunk, returning: bool):
+        result = session.execute(statement, chunk)
+        if returning:
+            for row, keys in zip(chunk, result):
+                row.update(keys._mapping)
+
+    @classmethod
+    def _bulk_write(cls, statement, rows, chunk_size: int, commit: bool, name: str) -> BulkResult:
+        """
+        Executes `statement` once per chunk of rows with executemany, inside one transaction.
+
+        Every chunk runs in a savepoint. When a chunk fails, it is rolled back and its
+        rows are retried one savepoint each, so a bad row costs its chunk a slower
+        retry but doesn't undo the rows around it.
+        """
+        values = [cls._bulk_values(row) for row in rows]
+        returning = bool(statement.exported_columns)
+        written, failures = [], []
+        session = db.session
+        try:
+            for start in range(0, len(values), chunk_size):
+                chunk = values[start:start + chunk_size]
                 try:
-                    if isinstance(value, datetime):
-                        value = value.isoformat()
-                    dict_self[key] = value
-                except TypeError as error:
-                    logging.error(f"Error during formatting instance: {error}", exc_info=True)
+                    with session.begin_nested():
+                        cls._execute_chunk(session, statement, chunk, returning)
+                    written.extend(chunk)
                     continue
-        return dict_self
+                except SQLAlchemyError:
+                    pass
+                for index, row in enumerate(chunk, start):
+                    try:
+                        with session.begin_nested():
+                            cls._execute_chunk(session, statement, [row], returning)
+                        written.append(row)
+                    except SQLAlchemyError as error:
+                        failures.append(BulkFailure(index, row, str(getattr(error, 'orig', None) or error)))
+            if commit:
+                session.commit()
+        except SQLAlchemyError as error:
+            session.rollback()
+            logging.error(f"ERROR IN {name} of {cls.__name__}: {error}", exc_info=True)
+            return BulkResult(0, [BulkFailure(index, row, str(error)) for index, row in enumerate(values)])
+        if failures:
+            logging.error(f"{name} of {cls.__name__}: {len(failures)} of {len(values)} rows failed, "
+                          f"first error: {failures[0].error}")
+        if commit and written:
+            cls.on_bulk_change(written)
+        return BulkResult(len(written), failures)
+
+    @classmethod
+    def bulk_insert(cls, rows, chunk_size: int = BULK_CHUNK_SIZE, commit: bool = True) -> BulkResult:
+        """
+        Inserts many rows with executemany, `chunk_size` rows per statement, in one transaction.
+
+        Args:
+            rows: Dictionaries of column values, or unsaved instances of the model.
+            chunk_size: Rows sent per statement (and per savepoint).
+            commit: Commit at the end; pass False to keep the rows in the caller's transaction.
+
+        Returns:
+            The number of rows written and the rows that failed, with their errors.
+        """
+        statement = insert(cls)
+        if cls.bulk_insert_returns_keys:
+            statement = statement.returning(*inspect(cls).primary_key, sort_by_parameter_order=True)
+        return cls._bulk_write(statement, rows, chunk_size, commit, 'BULK INSERT')
+
+    @classmethod
+    def bulk_upsert(cls, rows, index_elements: Optional[list] = None, chunk_size: int = BULK_CHUNK_SIZE,
+                    commit: bool = True) -> BulkResult:
+        """
+        Inserts rows, or updates the existing row when one conflicts on `index_elements`.
+
+        Uses `INSERT ... ON CONFLICT DO UPDATE` on PostgreSQL and SQLite, and `Session.merge`
+        per row on other databases. Only the columns present in the first row are
+        updated on conflict, so all rows should have the same keys.
+
+        Args:
+            rows: Dictionaries of column values, or instances of the model.
+            index_elements: Names of the columns of a unique constraint, the primary key when None.
+            chunk_size: Rows sent per statement (and per savepoint).
+            commit: Commit at the end; pass False to keep the rows in the caller's transaction.
+
+        Returns:
+            The number of rows written and the rows that failed, with their errors.
+        """
+        rows = [cls._bulk_values(row) for row in rows]
+        if not rows:
+            return BulkResult(0, [])
+        index_elements = list(index_elements or (column.key for column in inspect(cls).primary_key))
+        dialect = db.session.get_bind(mapper=inspect(cls)).dialect.name
+        if dialect not in ('postgresql', 'sqlite'):
+            written, failures = 0, []
+            for index, row in enumerate(rows):
+                try:
+                    with db.session.begin_nested():
+                        db.session.merge(cls(**row))
+                    written += 1
+                except SQLAlchemyError as error:
+                    failures.append(BulkFailure(index, row, str(error)))
+            if commit:
+                db.session.commit()
+            return BulkResult(written, failures)
+        statement = (postgresql.insert if dialect == 'postgresql' else sqlite.insert)(cls)
+        updated = {key: statement.excluded[key] for key in rows[0] if key not in index_elements}
+        if updated:
+            statement = statement.on_conflict_do_update(index_elements=index_elements, set_=updated)
+        else:
+            statement = statement.on_conflict_do_nothing(index_elements=index_elements)
+        return cls._bulk_write(statement, rows, chunk_size, commit, 'BULK UPSERT')
 
+    @classmethod
+    def bulk_update(cls, rows, chunk_size: int = BULK_CHUNK_SIZE, commit: bool = True) -> BulkResult:
+        """
+        Updates many existing rows by primary key with executemany, in one transaction.
+
+        Each row only needs its primary key and the columns that change; other columns
+        are left as they are.
+
+        Args:
+            rows: Dictionaries with the primary key and the new column values.
+            chunk_size: Rows sent per statement (and per savepoint).
+            commit: Commit at the end; pass False to keep the rows in the caller's transaction.
+
+        Returns:
+            The number of rows written and the rows that failed, with their errors.
+        """
+        return cls._bulk_write(update(cls), rows, chunk_size, commit, 'BULK UPDATE')
+
+    def format(self, only=None, exclude=None) -> dict:
+        """
+        Serializes the object's columns into a dictionary.
+
+        Args:
+            only: Column names to include, all columns when None.
+            exclude: Column names to leave out.
+        """
+        row = {}
+        loaded = self.__dict__
+        for key, convert in _model_fields(type(self), _frozen(only), _frozen(exclude)):
+            # Loaded values are read directly; expired or deferred ones go through the attribute.
+            value = loaded[key] if key in loaded else getattr(self, key)
+            row[key] = value if convert is None else convert(value)
+        return row
+
+    @classmethod
+    def format_rows(cls, rows, only=None, exclude=None) -> list:
+        """
+        Serializes `Row` results of a column-only query, e.g. `select(Message.id, Message.content)`,
+        like `format()` does for instances, so large listings don't need ORM objects.
+
+        Args:
+            rows: `Row` objects sharing the same columns, or instances of the model.
+            only: Column names to include, all selected columns when None.
+            exclude: Column names to leave out.
+
+        Returns:
+            A list of dictionaries, one per row.
+        """
+        rows = list(rows)
+        if not rows:
+            return []
+        only, exclude = _frozen(only), _frozen(exclude)
+        if isinstance(rows[0], cls):
+            return [CRUDMixin.format(row, only, exclude) for row in rows]
+        fields = _row_fields(cls, tuple(rows[0]._fields), only, exclude)
+        return [
+            {key: row[index] if convert is None else convert(row[index]) for index, key, convert in fields}
+            for row in rows
+        ]
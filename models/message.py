@@ -8,12 +8,22 @@ class Message(db.Model, CRUDMixin):
 
     # Database index for optimizing queries that filter or sort messages by patient and time.
     __table_args__ = (
-        db.Index('ix_message_patient_timestamp', 'patient_id', 'timestamp'),
+        # Keyset pagination of one patient's conversation (see GET /patients/<id>/messages).
+        db.Index('ix_message_patient_timestamp', 'patient_id', 'timestamp', 'id'),
+        # Only unread messages are indexed for the admin's unread view (see GET /messages/unread).
+        db.Index('ix_message_unread_timestamp_id', 'timestamp', 'id',
+                 postgresql_where=db.text('is_read_by_admin = false'),
+                 sqlite_where=db.text('is_read_by_admin = 0')),
+        # Keyset pagination over all messages, newest first (see GET /messages).
+        db.Index('ix_message_timestamp_id', 'timestamp', 'id'),
+        # Webhook ingestion looks messages up by the provider's id to drop redeliveries and set statuses.
+        db.Index('ix_message_wa_id', 'wa_id'),
     )
     id = db.Column(db.Integer, primary_key=True)
     phone = db.Column(db.String(20), nullable=False)
     # Establishes the many-to-one relationship: many messages belong to one patient.
-    patient_id = db.Column(db.Integer, db.ForeignKey("patients.id"), nullable=False)
+    # The database deletes a patient's messages with the patient (Patient.messages uses passive_deletes).
+    patient_id = db.Column(db.Integer, db.ForeignKey("patients.id", ondelete="CASCADE"), nullable=False)
     # Specifies who sent the message, e.g., 'admin' for staff or 'patient' for the patient.
     sender = db.Column(db.String(20))   
     # The text content of the message.
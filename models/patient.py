@@ -1,16 +1,54 @@
+from functools import lru_cache
 from zoneinfo import ZoneInfo
 from extensions.database import db
 from datetime import datetime
-from babel.dates import format_datetime
+from babel import Locale
+from babel.dates import get_date_format, get_datetime_format, get_time_format
+from flask_sqlalchemy.query import Query
 from .language import languages_patients
-from sqlalchemy.orm import Mapped
+from sqlalchemy import Select, inspect, select
+from sqlalchemy.orm import Mapped, selectinload
 from typing import List
 from .base import CRUDMixin
 
 
+@lru_cache(maxsize=None)
+def _zone(tz):
+    """ZoneInfo for a timezone name, or None when the name is invalid. Built once per name."""
+    try:
+        return ZoneInfo(tz)
+    except Exception:
+        return None
+
+
+@lru_cache(maxsize=32)
+def _long_datetime_formatter(locale_name):
+    """
+    Returns a function equivalent to `babel.dates.format_datetime(value, format="long",
+    locale=locale_name)` for an aware datetime, with the locale and patterns parsed once.
+    """
+    locale = Locale.parse(locale_name)
+    combined = get_datetime_format('long', locale=locale).replace("'", "")
+    time_pattern = get_time_format('long', locale=locale)
+    date_pattern = get_date_format('long', locale=locale)
+
+    @lru_cache(maxsize=4096)
+    def format_date(value):
+        # Rows created on the same day share their date part.
+        return date_pattern.apply(value, locale)
+
+    def format_long(value):
+        return combined \
+            .replace('{0}', time_pattern.apply(value.timetz(), locale, reference_date=value.date())) \
+            .replace('{1}', format_date(value.date()))
+    return format_long
+
+
 class Patient(db.Model, CRUDMixin):
     """Represents a patient in the telemedicine system."""
     __tablename__ = "patients"
+    # The redaction dictionary tracks patients by id.
+    bulk_insert_returns_keys = True
 
     id = db.Column(db.Integer, primary_key=True)
     year_of_birth = db.Column(db.Integer, nullable=True, default=None)
@@ -38,18 +76,44 @@ class Patient(db.Model, CRUDMixin):
         back_populates="patients"
     )
 
-    # One-to-many relationship with messages.
+    # One-to-many relationship with messages. A conversation can be long, so it is never
+    # loaded as a whole; query it with `patient.messages.select()` or page through it
+    # with GET /patients/<id>/messages.
     messages = db.relationship(
-        "Message", 
-        backref="patient", 
-        lazy=True)
+        "Message",
+        backref="patient",
+        lazy="write_only",
+        passive_deletes=True)
+
+    def on_change(self):
+        """Keeps the redaction dictionary of known identifiers in step with this patient."""
+        from services.patient_dictionary import get_dictionary
+        dictionary = get_dictionary()
+        if dictionary is None or not dictionary.loaded:
+            return
+        if inspect(self).was_deleted:
+            dictionary.remove_patient(self.id)
+        else:
+            dictionary.set_patient(self.id, {'first_name': self.first_name, 'last_name': self.last_name,
+                                             'email': self.email, 'phone': self.phone})
+
+    @classmethod
+    def on_bulk_change(cls, rows):
+        from services.patient_dictionary import get_dictionary
+        dictionary = get_dictionary()
+        if dictionary is not None and dictionary.loaded:
+            dictionary.update_patients(rows)
 
     def format(self):
         """Formats the patient object as a dictionary, safe for JSON serialization."""
-        
+        return self._format_row(_long_datetime_formatter('en_US'))
+
+    def _format_row(self, format_long):
+        patient_tz = _zone(self.tz)
         try:
-            patient_tz = ZoneInfo(self.tz)
-            formatted_created_at = format_datetime(self.created_at.astimezone(patient_tz), format="long", locale='en_US')
+            if patient_tz is None:
+                raise ValueError(f"Unknown timezone {self.tz!r}")
+            formatted_created_at = format_long(self.created_at.astimezone(patient_tz))
         except Exception:
             # Fallback if the timezone string is invalid for any reason
             formatted_created_at = self.created_at.isoformat()
@@ -70,3 +134,25 @@ class Patient(db.Model, CRUDMixin):
             "languages": [lang.name for lang in self.languages]
         }
 
+    @classmethod
+    def format_many(cls, patients, locale='en_US') -> list:
+        """
+        Formats many patients like `format()`, without a languages query per patient.
+
+        `patients` may be a `Patient.query`, a `select(Patient)` statement or a list of
+        patients. Languages are loaded for all of them with one `selectinload` query,
+        and timezones and the Babel formatter are reused across rows.
+        """
+        if isinstance(patients, Query):
+            patients = patients.options(selectinload(cls.languages)).all()
+        elif isinstance(patients, Select):
+            patients = db.session.scalars(patients.options(selectinload(cls.languages))).all()
+        else:
+            patients = list(patients)
+            unloaded = [patient.id for patient in patients if 'languages' in inspect(patient).unloaded]
+            if unloaded:
+                # Populates the collections of the instances already in the session.
+                db.session.scalars(
+                    select(cls).where(cls.id.in_(unloaded)).options(selectinload(cls.languages))).all()
+        format_long = _long_datetime_formatter(locale)
+        return [patient._format_row(format_long) for patient in patients]
@@ -1,5 +1,6 @@
 from extensions.database import db
 from models.base import CRUDMixin
+from extensions.auth.token import get_token_cache
 from werkzeug.security import generate_password_hash, check_password_hash
 
 
@@ -25,6 +26,16 @@ class User(db.Model, CRUDMixin):
         """Verifies the provided password against the stored hash."""
         return check_password_hash(self.password_hash, password)
     
+    def on_change(self):
+        """Makes a deactivation or permission change apply to the next request, not after the cache expires."""
+        get_token_cache().invalidate_user(self.id, self.username)
+
+    @classmethod
+    def on_bulk_change(cls, rows):
+        cache = get_token_cache()
+        for row in rows:
+            cache.invalidate_user(row.get('id'), row.get('username'))
+
     def __repr__(self):
         return f"<User id={self.id} username={self.username} role={self.role}>"
 
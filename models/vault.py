@@ -0,0 +1,20 @@
+from datetime import datetime
+
+from extensions.database import db
+from models.base import CRUDMixin
+
+
+class VaultEntry(db.Model, CRUDMixin):
+    """A sensitive value and the token that replaces it in stored messages, kept in the separate 'vault' bind."""
+    __bind_key__ = "vault"
+    __tablename__ = "vault_entries"
+
+    # HMAC of the label and value, so the same value always gets the same token.
+    token = db.Column(db.String(32), primary_key=True)
+    # The entity type the value was detected as, e.g. 'PERSON' or 'EMAIL'.
+    label = db.Column(db.String(20), nullable=False)
+    value = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.now)
+
+    def __repr__(self):
+        return f"<VaultEntry token={self.token} label={self.label}>"
@@ -1,4 +1,5 @@
-from flask import Blueprint, request, jsonify, redirect, url_for, render_template, flash
+from flask import (Blueprint, Response, request, jsonify, redirect, url_for, render_template, flash, current_app,
+                   stream_with_context)
 import logging
 import jwt
 import os
@@ -6,11 +7,32 @@ from functools import wraps
 
 from datetime import datetime, timedelta
 
+from sqlalchemy import select, tuple_, update
+
+from extensions.database import db
+from models.message import Message
+from models.patient import Patient
 from models.user import User
+from extensions.auth.token import get_token_cache
+from services.metrics import get_metrics
 from services.redaction import ReductionService
+from services.redaction_jobs import QueueFullError, get_job_queue
+from services.pagination import CursorError, MAX_LIMIT, keyset_page, parse_limit
+from services.vault import get_vault
 
 api = Blueprint('api', __name__, template_folder='templates', static_folder='static')
 
+# Ends a streamed redaction whose output was cut short by an error after the response had started.
+STREAM_ERROR_MARKER = '\n[REDACTION FAILED: the output above is incomplete]\n'
+
+def _decode_token(token):
+    return jwt.decode(token, os.environ.get('SECRET_KEY'), algorithms=['HS256'])
+
+
+def _load_user(username):
+    return User.query.filter_by(username=username).first()
+
+
 # decoreator factory
 def token_required(permissions): # permissions=['get:redaction']
     def decorator(func):
@@ -23,19 +45,29 @@ def token_required(permissions): # permissions=['get:redaction']
             if not token:
                 return jsonify({'message': 'Token is missing!'}), 401
             try:
-                payload = jwt.decode(token, os.environ.get('SECRET_KEY'), algorithms=['HS256'])
-                current_user = User.query.filter_by(username=payload['username']).first()
-                user_permissions = payload.get('permissions', '').split(" ")
-                if permissions not in user_permissions:
+                # Verified claims are cached until the token expires, and user records for a
+                # short while, so a burst of calls doesn't decode and query the database each time.
+                token_cache = get_token_cache()
+                metrics = get_metrics()
+                started = metrics.start()
+                verified = token_cache.verify(token, _decode_token)
+                if started is not None:
+                    metrics.record('auth.token', started)
+                if permissions not in verified.permissions:
                     return jsonify({'message': 'Permission denied!'}), 403
-                user_role = payload.get('role')
-                if not current_user:
+                started = metrics.start()
+                current_user = token_cache.user(verified.username, _load_user)
+                if started is not None:
+                    metrics.record('auth.user', started)
+                if not current_user or not current_user.is_active:
                     return jsonify({'message': 'User not found!'}), 401
-                value = func(current_user, user_role, *args, **kwargs)
-                return value
+                # A permission revoked since the token was issued no longer counts.
+                if permissions not in current_user.permissions:
+                    return jsonify({'message': 'Permission denied!'}), 403
             except Exception as e:
                 logging.error(f"Token decoding error: {e}")
-                return jsonify({'message': 'Token is invalid!'}), 401    
+                return jsonify({'message': 'Token is invalid!'}), 401
+            return func(current_user, verified.role, *args, **kwargs)
         return wrapper
     return decorator
 
@@ -44,7 +76,7 @@ def token_required(permissions): # permissions=['get:redaction']
 @token_required(permissions='get:redaction')
 def redact(current_user, user_role):
     ''' Redact the incoming json data with pii covering techniques '''
-    if not request.is_json():
+    if not request.is_json:
         return jsonify({'success': 'false', 'error': 'Must be JSON'}), 400
     
     try:
@@ -52,7 +84,7 @@ def redact(current_user, user_role):
         text_to_redact = data.get('text_to_redact')
 
         if not text_to_redact:
-            return jsonify({'success': 'false', 'error': "Missing 'text_to_redact' key in request"}, 400)
+            return jsonify({'success': 'false', 'error': "Missing 'text_to_redact' key in request"}), 400
         
         redaction_services = ReductionService()
         final_reduct_text = redaction_services.hybrid_redact(text_to_redact)
@@ -69,25 +101,265 @@ def redact(current_user, user_role):
         }), 500
 
 
+@api.route('/redact/batch', methods=['POST'])
+@token_required(permissions='get:redaction')
+def redact_batch(current_user, user_role):
+    ''' Redact a list of texts in one request, streaming them through the NER pipeline in batches '''
+    if not request.is_json:
+        return jsonify({'success': False, 'error': 'Must be JSON'}), 400
+
+    try:
+        data = request.get_json()
+        texts = data.get('texts')
+
+        if not isinstance(texts, list) or not texts:
+            return jsonify({'success': False, 'error': "Missing 'texts' list in request"}), 400
+
+        max_items = current_app.config.get('REDACTION_MAX_BATCH_ITEMS', 5000)
+        if len(texts) > max_items:
+            return jsonify({'success': False, 'error': f'At most {max_items} texts per batch'}), 413
+
+        redaction_services = ReductionService()
+        results = redaction_services.hybrid_redact_many(
+            texts,
+            batch_size=current_app.config.get('REDACTION_BATCH_SIZE', 64),
+            n_process=current_app.config.get('REDACTION_N_PROCESS', 1))
+
+        return jsonify({
+            'success': True,
+            'results': results
+        })
+    except Exception as error:
+        logging.error(f"A batch redaction error has occurred: {error}")
+        return jsonify({
+            'success': False,
+            'error': 'An internal error occurred during redaction.'
+        }), 500
+
+
+@api.route('/redact/stream', methods=['POST'])
+@token_required(permissions='get:redaction')
+def redact_stream(current_user, user_role):
+    ''' Redact a long plain text request body, streaming the redacted text back with chunked transfer encoding.
+    A failure in the first window returns a 500; a later one ends the body with STREAM_ERROR_MARKER. '''
+    redaction_services = ReductionService()
+    chunks = redaction_services.hybrid_redact_stream(
+        request.stream,
+        chunk_size=current_app.config.get('REDACTION_STREAM_CHUNK_SIZE', 100000),
+        overlap=current_app.config.get('REDACTION_STREAM_OVERLAP', 1000))
+    try:
+        # Redact the first window before the status line is sent, so early failures can still be a 500.
+        first = next(chunks, '')
+    except Exception as error:
+        logging.error(f"A streaming redaction error has occurred: {error}")
+        return jsonify({
+            'success': False,
+            'error': 'An internal error occurred during redaction.'
+        }), 500
+
+    def generate():
+        try:
+            yield first
+            yield from chunks
+        except Exception as error:
+            # The status line has already been sent, so the client is told in the body that the output is cut short.
+            logging.error(f"A streaming redaction error has occurred: {error}")
+            yield STREAM_ERROR_MARKER
+
+    return Response(stream_with_context(generate()), mimetype='text/plain')
+
+
+@api.route('/redact/jobs', methods=['POST'])
+@token_required(permissions='get:redaction')
+def submit_redaction_job(current_user, user_role):
+    ''' Queue a long text for redaction in a worker process and return the job id to poll '''
+    if not request.is_json:
+        return jsonify({'success': False, 'error': 'Must be JSON'}), 400
+
+    try:
+        data = request.get_json()
+        text_to_redact = data.get('text_to_redact')
+
+        if not text_to_redact or not isinstance(text_to_redact, str):
+            return jsonify({'success': False, 'error': "Missing 'text_to_redact' key in request"}), 400
+
+        job = get_job_queue().submit(text_to_redact, owner=current_user.id)
+        response = jsonify({'success': True, **job.to_dict()})
+        response.headers['Location'] = url_for('api.get_redaction_job', job_id=job.id)
+        return response, 202
+    except QueueFullError as error:
+        logging.error(f"Redaction job rejected: {error}")
+        response = jsonify({'success': False, 'error': 'Too many pending redaction jobs, try again later.'})
+        response.headers['Retry-After'] = '5'
+        return response, 429
+    except Exception as error:
+        logging.error(f"A redaction job error has occurred: {error}")
+        return jsonify({
+            'success': False,
+            'error': 'An internal error occurred during redaction.'
+        }), 500
+
+
+@api.route('/redact/jobs/<job_id>', methods=['GET'])
+@token_required(permissions='get:redaction')
+def get_redaction_job(current_user, user_role, job_id):
+    ''' Return the status of a redaction job, and the redacted text once it is done '''
+    job = get_job_queue().get(job_id, owner=current_user.id)
+    if job is None:
+        return jsonify({'success': False, 'error': 'Job not found'}), 404
+    return jsonify({'success': True, **job.to_dict()})
+
+
+# Columns returned by the listing endpoints; message metadata and media keys stay out of lists.
+PATIENT_LIST_COLUMNS = (Patient.id, Patient.first_name, Patient.last_name, Patient.preferred_messenger,
+                        Patient.created_at)
+MESSAGE_LIST_COLUMNS = (Message.id, Message.patient_id, Message.sender, Message.content, Message.timestamp,
+                        Message.messenger, Message.status, Message.is_read_by_admin)
+CONVERSATION_COLUMNS = (Message.id, Message.sender, Message.content, Message.timestamp, Message.messenger,
+                        Message.media_type, Message.status, Message.is_read_by_admin)
+
+
+@api.route('/patients', methods=['GET'])
+@token_required(permissions='get:patients')
+def list_patients(current_user, user_role):
+    ''' One page of patients ordered by id; pass the returned `next_cursor` as `?cursor=` for the next page '''
+    try:
+        limit = parse_limit(request.args.get('limit'))
+        rows, next_cursor = keyset_page(
+            db.session, select(*PATIENT_LIST_COLUMNS), (Patient.id,),
+            request.args.get('cursor'), limit, descending=False)
+    except CursorError as error:
+        return jsonify({'success': False, 'error': str(error)}), 400
+    return jsonify({'success': True, 'patients': Patient.format_rows(rows), 'next_cursor': next_cursor})
+
+
+@api.route('/messages', methods=['GET'])
+@token_required(permissions='get:messages')
+def list_messages(current_user, user_role):
+    ''' One page of messages, newest first, optionally for one `patient_id` '''
+    try:
+        limit = parse_limit(request.args.get('limit'))
+        # Messages without a timestamp can't be placed in the keyset order and are left out.
+        statement = select(*MESSAGE_LIST_COLUMNS).where(Message.timestamp.isnot(None))
+        patient_id = request.args.get('patient_id', type=int)
+        if patient_id is not None:
+            # Served by ix_message_patient_timestamp; without it by ix_message_timestamp_id.
+            statement = statement.where(Message.patient_id == patient_id)
+        rows, next_cursor = keyset_page(
+            db.session, statement, (Message.timestamp, Message.id), request.args.get('cursor'), limit)
+    except CursorError as error:
+        return jsonify({'success': False, 'error': str(error)}), 400
+    return jsonify({'success': True, 'messages': Message.format_rows(rows), 'next_cursor': next_cursor})
+
+
+@api.route('/messages/unread', methods=['GET'])
+@token_required(permissions='get:messages')
+def list_unread_messages(current_user, user_role):
+    ''' One page of the messages no admin has read yet, newest first '''
+    try:
+        limit = parse_limit(request.args.get('limit'))
+        # `== False` matches the predicate of the partial index ix_message_unread_timestamp_id.
+        statement = select(*MESSAGE_LIST_COLUMNS).where(
+            Message.is_read_by_admin == False, Message.timestamp.isnot(None))  # noqa: E712
+        rows, next_cursor = keyset_page(
+            db.session, statement, (Message.timestamp, Message.id), request.args.get('cursor'), limit)
+    except CursorError as error:
+        return jsonify({'success': False, 'error': str(error)}), 400
+    return jsonify({'success': True, 'messages': Message.format_rows(rows), 'next_cursor': next_cursor})
+
+
+def _patient_exists(patient_id):
+    return db.session.execute(select(Patient.id).where(Patient.id == patient_id)).first() is not None
+
+
+@api.route('/patients/<int:patient_id>/messages', methods=['GET'])
+@token_required(permissions='get:messages')
+def patient_conversation(current_user, user_role, patient_id):
+    ''' One page of a patient's conversation, newest first; pass `next_cursor` as `?before=` for older messages '''
+    if not _patient_exists(patient_id):
+        return jsonify({'success': False, 'error': 'Patient not found'}), 404
+    try:
+        limit = parse_limit(request.args.get('limit'))
+        # A range scan of ix_message_patient_timestamp (patient_id, timestamp, id).
+        statement = select(*CONVERSATION_COLUMNS).where(
+            Message.patient_id == patient_id, Message.timestamp.isnot(None))
+        if request.args.get('unread', '').lower() == 'true':
+            statement = statement.where(Message.is_read_by_admin == False)  # noqa: E712
+        rows, next_cursor = keyset_page(
+            db.session, statement, (Message.timestamp, Message.id), request.args.get('before'), limit)
+    except CursorError as error:
+        return jsonify({'success': False, 'error': str(error)}), 400
+    return jsonify({'success': True, 'messages': Message.format_rows(rows), 'next_cursor': next_cursor})
+
+
+@api.route('/patients/<int:patient_id>/messages/read', methods=['POST'])
+@token_required(permissions='patch:messages')
+def mark_conversation_read(current_user, user_role, patient_id):
+    '''
+    Mark a patient's unread messages as read with one UPDATE: all of them, those up to
+    and including `through_id` in conversation order, or the listed `ids`
+    '''
+    data = request.get_json(silent=True) or {}
+    through_id, ids = data.get('through_id'), data.get('ids')
+    if (through_id is not None and not isinstance(through_id, int)) or \
+            (ids is not None and (not isinstance(ids, list) or not all(isinstance(id_, int) for id_ in ids))):
+        return jsonify({'success': False, 'error': "'through_id' must be a message id and 'ids' a list of them"}), 400
+    if not _patient_exists(patient_id):
+        return jsonify({'success': False, 'error': 'Patient not found'}), 404
+
+    statement = update(Message).where(Message.patient_id == patient_id, Message.is_read_by_admin == False)  # noqa: E712
+    if ids is not None:
+        statement = statement.where(Message.id.in_(ids))
+    if through_id is not None:
+        through = select(Message.timestamp).where(Message.id == through_id, Message.patient_id == patient_id)
+        statement = statement.where(tuple_(Message.timestamp, Message.id) <= tuple_(through.scalar_subquery(), through_id))
+    result = db.session.execute(
+        statement.values(is_read_by_admin=True).execution_options(synchronize_session=False))
+    db.session.commit()
+    return jsonify({'success': True, 'updated': result.rowcount})
+
+
+@api.route('/messages/detokenize', methods=['POST'])
+@token_required(permissions='get:phi')
+def detokenize_messages(current_user, user_role):
+    ''' Return the listed messages with the vaulted values put back in place of their tokens '''
+    data = request.get_json(silent=True) or {}
+    ids = data.get('ids')
+    if not isinstance(ids, list) or not ids or not all(isinstance(id_, int) for id_ in ids):
+        return jsonify({'success': False, 'error': "Missing 'ids' list of message ids"}), 400
+    if len(ids) > MAX_LIMIT:
+        return jsonify({'success': False, 'error': f'At most {MAX_LIMIT} messages per request'}), 413
+
+    vault = get_vault()
+    if vault is None:
+        return jsonify({'success': False, 'error': 'The token vault is not configured'}), 503
+
+    rows = db.session.execute(select(Message.id, Message.content).where(Message.id.in_(ids))).all()
+    contents = vault.detokenize_many(row.content for row in rows)
+    # Every access to vaulted values is logged, without the values themselves.
+    logging.info(f"User id={current_user.id} detokenized {len(rows)} message(s).")
+    return jsonify({'success': True, 'messages': [
+        {'id': row.id, 'content': content} for row, content in zip(rows, contents)]})
+
+
 @api.route('/login', methods=['GET', 'POST'])
 def login():
     """A simple login view function that authenticates a user and returns a JWT token.""" 
     try:    
-        logging.info(f"Method {request.method} to /login")
+        logging.debug(f"Method {request.method} to /login")
         if request.method == 'POST':
+            # Only the username is ever logged, never the request body or form.
             if request.is_json:
                 user_json = request.get_json()
-                logging.info(f"User json {user_json} attempting to log in.")
                 username = user_json.get('username')
                 password = user_json.get('password')
             else:
-                logging.info(f"Form data {request.form} attempting to log in.")
                 username = request.form.get('username')
                 password = request.form.get('password')
+            logging.info(f"User {username} attempting to log in.")
 
             user = User.query.filter_by(
                 username=username).first()
-            logging.info(f"User found: {user}")
 
             if user and user.check_password(password):   
                 token = jwt.encode(
@@ -104,7 +376,7 @@ def login():
                 flash('Check your credentials and try again.')
                 return redirect(url_for('home.homepage'))
         else:
-            logging.info(f"GET request to /login")
+            logging.debug(f"GET request to /login")
             return render_template(
                 'login.html', 
                 message="Log into the Telemed")
@@ -3,27 +3,52 @@ import jwt
 import os
 import logging
 from datetime import datetime, timedelta
-from flask import Blueprint, request, render_template, jsonify, flash, redirect, url_for
+import hmac
+from flask import Blueprint, Response, current_app, request, render_template, jsonify, flash, redirect, url_for
 
 from werkzeug.security import generate_password_hash, check_password_hash
 from models.user import User
 from models.patient import Patient
 from models.language import Language
 from models.message import Message
+from sqlalchemy import func, select
+
+from extensions.database import check_connection, db, pool_status
+from services.metrics import get_metrics
 
 # Cteate a Blueprint for home routes
 home = Blueprint('home', __name__, template_folder='templates', static_folder='static')
 
 
+def dashboard_counts():
+    """Counts patients, languages and messages in one round trip, without loading any rows."""
+    counts = [select(func.count()).select_from(model).scalar_subquery() for model in (Patient, Language, Message)]
+    return db.session.execute(select(*counts)).one()
+
+
 @home.route('/')
 def homepage():
     """A simple view function that returns a welcome message."""
 
-    patients = Patient.query.all()
-    logging.info(f"Retrieved {len(patients)} patients from the database.")
-    lagnuages = Language.query.all()
-    logging.info(f"Retrieved {len(lagnuages)} languages from the database.")    
-    messages = Message.query.all()
-    logging.info(f"Retrieved {len(messages)} messages from the database.") 
+    patients, languages, messages = dashboard_counts()
+    logging.info(f"Retrieved {patients} patients from the database.")
+    logging.info(f"Retrieved {languages} languages from the database.")
+    logging.info(f"Retrieved {messages} messages from the database.")
 
     return render_template('index.html', message="Welcome to the Telemed")
+
+
+@home.route('/health/db')
+def database_pool_health():
+    """Checks the database connection and reports the pool usage: checkouts, wait times and overflow."""
+    connected = check_connection()
+    return jsonify({'connected': connected, **pool_status()}), 200 if connected else 503
+
+
+@home.route('/metrics')
+def metrics():
+    """Reports the stage latency, input size and entity count histograms in the Prometheus text format."""
+    token = current_app.config.get('METRICS_TOKEN')
+    if token and not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return jsonify({'message': 'Token is invalid!'}), 401
+    return Response(get_metrics().render(), mimetype='text/plain; version=0.0.4')
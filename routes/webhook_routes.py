@@ -0,0 +1,91 @@
+import base64
+import hashlib
+import hmac
+import logging
+
+from flask import Blueprint, Response, current_app, jsonify, request
+
+from services.ingestion import IngestionQueueFull, get_ingestor, parse_twilio, parse_whatsapp
+
+webhooks = Blueprint('webhooks', __name__, url_prefix='/webhooks')
+
+
+def _whatsapp_signature_ok(secret: str) -> bool:
+    """Checks Meta's X-Hub-Signature-256 header against the app secret."""
+    expected = 'sha256=' + hmac.new(secret.encode(), request.get_data(), hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, request.headers.get('X-Hub-Signature-256', ''))
+
+
+def _twilio_signature_ok(token: str) -> bool:
+    """Checks Twilio's X-Twilio-Signature header against the auth token."""
+    signed = request.url + ''.join(f'{key}{request.form[key]}' for key in sorted(request.form))
+    expected = base64.b64encode(hmac.new(token.encode(), signed.encode(), hashlib.sha1).digest()).decode()
+    return hmac.compare_digest(expected, request.headers.get('X-Twilio-Signature', ''))
+
+
+def _signature_error(secret_name: str, signature_ok):
+    """
+    Returns the error response for a webhook that can't be trusted, or None.
+
+    Without the secret named `secret_name` nothing can be verified, so the webhook
+    is refused unless WEBHOOK_ALLOW_UNSIGNED is set (local testing only): otherwise
+    anyone could post messages into patient conversations.
+    """
+    secret = current_app.config.get(secret_name)
+    if not secret:
+        if current_app.config.get('WEBHOOK_ALLOW_UNSIGNED'):
+            return None
+        logging.error(f"Webhook rejected, {secret_name} is not configured.")
+        return jsonify({'success': False, 'error': 'Webhook is not configured'}), 503
+    if not signature_ok(secret):
+        return jsonify({'success': False, 'error': 'Invalid signature'}), 401
+    return None
+
+
+def _queue_full():
+    logging.error("Incoming messages rejected, the ingestion queue is full.")
+    response = jsonify({'success': False, 'error': 'Too many pending messages, try again later.'})
+    response.headers['Retry-After'] = '5'
+    return response, 503
+
+
+@webhooks.route('/whatsapp', methods=['GET'])
+def verify_whatsapp():
+    ''' Answer Meta's subscription check with the challenge when the verify token matches '''
+    verify_token = current_app.config.get('WHATSAPP_VERIFY_TOKEN')
+    if (request.args.get('hub.mode') == 'subscribe' and verify_token
+            and hmac.compare_digest(request.args.get('hub.verify_token', ''), verify_token)):
+        return request.args.get('hub.challenge', ''), 200
+    return jsonify({'success': False, 'error': 'Verification failed'}), 403
+
+
+@webhooks.route('/whatsapp', methods=['POST'])
+def receive_whatsapp():
+    ''' Queue the messages and status updates of a WhatsApp webhook for redaction and storage '''
+    error = _signature_error('WHATSAPP_APP_SECRET', _whatsapp_signature_ok)
+    if error:
+        return error
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict):
+        return jsonify({'success': False, 'error': 'Must be JSON'}), 400
+    messages, statuses = parse_whatsapp(payload)
+    try:
+        accepted = get_ingestor().submit(messages, statuses)
+    except IngestionQueueFull:
+        return _queue_full()
+    return jsonify({'success': True, 'accepted': accepted, 'statuses': len(statuses)})
+
+
+@webhooks.route('/sms', methods=['POST'])
+def receive_sms():
+    ''' Queue an incoming SMS or a delivery status callback from Twilio '''
+    error = _signature_error('TWILIO_AUTH_TOKEN', _twilio_signature_ok)
+    if error:
+        return error
+    messages, statuses = parse_twilio(request.form)
+    try:
+        get_ingestor().submit(messages, statuses)
+    except IngestionQueueFull:
+        return _queue_full()
+    # An empty TwiML response: no automatic reply is sent.
+    return Response('<Response/>', mimetype='text/xml')
@@ -0,0 +1,385 @@
+import hashlib
+import logging
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, Optional
+
+from services.metrics import get_metrics
+from services.redaction import PATTERN_VERSION, PII_REDACTOR, RedactionSpan, entity_spans, merge_spans
+
+logger = logging.getLogger(__name__)
+
+# Any letter; text without one outside the cheap detectors' spans has nothing left for NER.
+_LETTER = re.compile(r"[^\W\d_]")
+
+# Off by default: NER is almost all of the work and holds the GIL for most of it,
+# so threads only pay off for detectors that release it (see bench_detectors.py).
+DEFAULT_PARALLEL_MIN_CHARS = 0
+DEFAULT_WORKERS = 4
+
+
+class Detector:
+    """
+    Finds one kind of PII in a text and returns it as `RedactionSpan`s.
+
+    Subclasses set `name`, which is reported as the source of their spans and as
+    the `hybrid.<name>` metrics stage, and implement `detect`. Expensive detectors
+    run after the cheap ones and are skipped when no letter is left outside the
+    spans the cheap ones found. `version` must change whenever the detector could
+    find something else in the same text, since cached plans are keyed on it.
+    """
+
+    name = ''
+    expensive = False
+
+    @property
+    def version(self) -> str:
+        return self.name
+
+    def prepare(self):
+        """Called in the calling thread before the detector runs on a worker thread."""
+
+    def detect(self, text: str) -> list:
+        raise NotImplementedError
+
+    def detect_many(self, texts: list, batch_size: int = 64, n_process: int = 1) -> list:
+        """Returns the spans of each text, or the exception raised for it."""
+        results = []
+        for text in texts:
+            try:
+                results.append(self.detect(text))
+            except Exception as error:
+                results.append(error)
+        return results
+
+
+class RegexDetector(Detector):
+    """The email and phone number rules of `PII_REDACTOR`, matched in one pass."""
+
+    name = 'regex'
+
+    @property
+    def version(self) -> str:
+        return f'regex:{PATTERN_VERSION}'
+
+    def detect(self, text: str) -> list:
+        return PII_REDACTOR.spans(text)
+
+
+class DictionaryDetector(Detector):
+    """The names, emails and phone numbers of known patients, see `PatientDictionary`."""
+
+    name = 'dictionary'
+
+    def __init__(self, dictionary):
+        self.dictionary = dictionary
+
+    @property
+    def version(self) -> str:
+        return f'dictionary:{self.dictionary.version}'
+
+    def prepare(self):
+        # Loading needs the app context, which worker threads don't have.
+        self.dictionary.ensure_loaded()
+
+    def detect(self, text: str) -> list:
+        return self.dictionary.spans(text)
+
+
+class NerDetector(Detector):
+    """The named entities found by the spaCy pipelines of a `ModelPool`."""
+
+    name = 'ner'
+    expensive = True
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    @property
+    def version(self) -> str:
+        return f'ner:{self.pool.version}'
+
+    def detect(self, text: str) -> list:
+        with self.pool.acquire() as nlp:
+            doc = nlp(text)
+        return entity_spans(doc)
+
+    def detect_many(self, texts: list, batch_size: int = 64, n_process: int = 1) -> list:
+        """Streams the texts through `nlp.pipe` instead of calling the pipeline once per text."""
+        results = []
+        with self.pool.acquire() as nlp:
+            try:
+                for doc in nlp.pipe(texts, batch_size=batch_size, n_process=n_process):
+                    results.append(entity_spans(doc))
+            except Exception as error:
+                # The pipe stops at the first failure, so finish the rest one by one
+                # to find out which inputs are actually broken.
+                logger.error(f"Batch NER failed after {len(results)} documents, falling back per item: {error}")
+                for text in texts[len(results):]:
+                    try:
+                        results.append(entity_spans(nlp(text)))
+                    except Exception as item_error:
+                        results.append(item_error)
+        return results
+
+
+class PatternDetector(Detector):
+    """
+    A single regular expression. When it has a `value` group only that group is
+    redacted, so "MRN: 1234567" keeps its "MRN: " context, which the span reports as
+    its `context_start`. `validate` can reject a match, e.g. by its check digit.
+    """
+
+    def __init__(self, name: str, label: str, pattern: str, replacement: str, flags: int = 0,
+                 validate: Optional[Callable[[str], bool]] = None):
+        self.name = name
+        self.label = label
+        self.pattern = re.compile(pattern, flags)
+        self.replacement = replacement
+        self.validate = validate
+        self._group = 'value' if 'value' in self.pattern.groupindex else 0
+        digest = hashlib.sha256(f"{pattern}\0{flags}\0{replacement}".encode("utf-8")).hexdigest()[:12]
+        self._version = f'{name}:{digest}'
+
+    @property
+    def version(self) -> str:
+        return self._version
+
+    def detect(self, text: str) -> list:
+        spans = []
+        for match in self.pattern.finditer(text):
+            if self.validate is not None and not self.validate(match.group(self._group)):
+                continue
+            start, end = match.span(self._group)
+            context = match.start() if match.start() < start else None
+            spans.append(RedactionSpan(start, end, self.name, self.label, self.replacement, context))
+        return spans
+
+
+def luhn_valid(value: str) -> bool:
+    """Whether the digits of `value` pass the Luhn check, as Canadian SINs do."""
+    total = 0
+    for position, digit in enumerate(reversed(re.sub(r'\D', '', value))):
+        doubled = int(digit) * (2 if position % 2 else 1)
+        total += doubled - 9 if doubled > 9 else doubled
+    return total % 10 == 0
+
+
+_MONTH = r"(?:Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)[a-z]*\.?"
+_DATE = (rf"(?:\d{{4}}-\d{{1,2}}-\d{{1,2}}|\d{{1,2}}[/.-]\d{{1,2}}[/.-]\d{{2,4}}"
+         rf"|{_MONTH} \d{{1,2}},? \d{{4}}|\d{{1,2}} {_MONTH},? \d{{4}})")
+
+# Ontario health card: 10 digits grouped 4-3-3, optionally followed by a two letter version code.
+HEALTH_CARD_DETECTOR = PatternDetector(
+    'health_card', 'HEALTH_CARD', r"(?<![\w-])\d{4}([ -]?)\d{3}\1\d{3}(?:[ -]?[A-Z]{2})?(?![\w-])",
+    '[REDACTED HEALTH CARD]')
+# Canadian social insurance number: 9 digits, optionally grouped 3-3-3, with a valid check digit.
+SIN_DETECTOR = PatternDetector(
+    'sin', 'SIN', r"(?<![\w-])\d{3}([ -]?)\d{3}\1\d{3}(?![\w-])", '[REDACTED SIN]', validate=luhn_valid)
+# US social security number, grouped 3-2-4, without the never issued 000, 666 and 9xx areas.
+SSN_DETECTOR = PatternDetector(
+    'ssn', 'SSN', r"(?<![\w-])(?!000|666|9\d\d)\d{3}([ -])(?!00)\d{2}\1(?!0000)\d{4}(?![\w-])", '[REDACTED SSN]')
+# Canadian postal codes (A1A 1A1) and US ZIP+4 codes. Plain five digit ZIP codes are too ambiguous.
+POSTAL_CODE_DETECTOR = PatternDetector(
+    'postal_code', 'POSTAL_CODE',
+    r"\b(?:[ABCEGHJ-NPRSTVXY]\d[ABCEGHJ-NPRSTV-Z][ -]?\d[ABCEGHJ-NPRSTV-Z]\d|\d{5}-\d{4})\b",
+    '[REDACTED POSTAL CODE]')
+# Dates of birth, recognised by the words in front of the date.
+DOB_DETECTOR = PatternDetector(
+    'dob', 'DOB', rf"\b(?:DOB|D\.O\.B\.?|date of birth|birth ?date|born(?: on)?)\s*[:-]?\s*(?P<value>{_DATE})(?!\w)",
+    '[REDACTED DOB]', flags=re.IGNORECASE)
+# Medical record numbers, recognised by the words in front of the number.
+MRN_DETECTOR = PatternDetector(
+    'mrn', 'MRN', r"\b(?:MRN|medical record (?:number|no\.?|#))\s*[:#]?\s*(?P<value>[A-Z]{0,3}-?\d{5,10})\b",
+    '[REDACTED MRN]', flags=re.IGNORECASE)
+
+# Every built-in detector, in the order they run. Where two detectors find the
+# same span, the one listed first keeps it (a bare 10 digit number is a phone).
+DETECTOR_NAMES = ('regex', 'dictionary', 'health_card', 'sin', 'ssn', 'postal_code', 'dob', 'mrn', 'ner')
+PATTERN_DETECTORS = (HEALTH_CARD_DETECTOR, SIN_DETECTOR, SSN_DETECTOR, POSTAL_CODE_DETECTOR, DOB_DETECTOR, MRN_DETECTOR)
+
+
+def has_letters_outside(text: str, spans) -> bool:
+    """Whether any letter of the text lies outside the given spans."""
+    last = 0
+    for span in merge_spans(spans):
+        if _LETTER.search(text, last, span.start):
+            return True
+        last = span.end
+    return _LETTER.search(text, last) is not None
+
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor(workers: int) -> ThreadPoolExecutor:
+    """Returns the process-wide detector threads, started on first use (and again after a fork)."""
+    global _executor, _executor_pid
+    if _executor is None or _executor_pid != os.getpid():
+        with _executor_lock:
+            if _executor is None or _executor_pid != os.getpid():
+                _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='redaction-detector')
+                _executor_pid = os.getpid()
+    return _executor
+
+
+class DetectorRegistry:
+    """
+    Runs a set of detectors over a text and merges what they find into one plan.
+
+    Cheap detectors run first. Expensive ones (NER) only run when `short_circuit`
+    is off or some letter is left outside the cheap detectors' spans: text made of
+    digits, whitespace and punctuation, or covered by emails and numbers already
+    found, has nothing for them. From `parallel_min_chars` characters on (never when
+    0), the detectors run on a shared thread pool instead of one after another,
+    and the whole text decides the short circuit. Every detector is timed as the
+    `hybrid.<name>` metrics stage when `timing` is set.
+    """
+
+    def __init__(self, detectors: Iterable[Detector], parallel_min_chars: int = DEFAULT_PARALLEL_MIN_CHARS,
+                 workers: int = DEFAULT_WORKERS, timing: bool = True, short_circuit: bool = True):
+        self.detectors = list(detectors)
+        self.cheap = [detector for detector in self.detectors if not detector.expensive]
+        self.expensive = [detector for detector in self.detectors if detector.expensive]
+        self.parallel_min_chars = parallel_min_chars
+        self.workers = workers
+        self.timing = timing
+        self.short_circuit = short_circuit
+        self._stages = {detector.name: f'hybrid.{detector.name}' for detector in self.detectors}
+
+    @property
+    def names(self) -> tuple:
+        return tuple(detector.name for detector in self.detectors)
+
+    @property
+    def version(self) -> str:
+        """Identifies the enabled detectors and their patterns, models and dictionaries."""
+        versions = [detector.version for detector in self.detectors]
+        return ';'.join(versions + ['short-circuit'] if self.short_circuit else versions)
+
+    def get(self, name: str) -> Optional[Detector]:
+        return next((detector for detector in self.detectors if detector.name == name), None)
+
+    def _run(self, detector: Detector, text: str) -> list:
+        if not self.timing:
+            return detector.detect(text)
+        metrics = get_metrics()
+        started = metrics.start()
+        spans = detector.detect(text)
+        if started is not None:
+            metrics.record(self._stages[detector.name], started)
+        return spans
+
+    def _needs_expensive(self, text: str, spans) -> bool:
+        return not self.short_circuit or has_letters_outside(text, spans)
+
+    def detect(self, text: str) -> list:
+        """Returns the merged, ordered spans all enabled detectors find in the text."""
+        if not isinstance(text, str):
+            raise TypeError("Input must be a string.")
+        if self.workers > 1 and len(self.detectors) > 1 and 0 < self.parallel_min_chars <= len(text):
+            return self._detect_parallel(text)
+        spans = []
+        for detector in self.cheap:
+            spans += self._run(detector, text)
+        if self.expensive and self._needs_expensive(text, spans):
+            for detector in self.expensive:
+                spans += self._run(detector, text)
+        return merge_spans(spans)
+
+    def _detect_parallel(self, text: str) -> list:
+        detectors = self.cheap + self.expensive if self._needs_expensive(text, ()) else self.cheap
+        for detector in detectors[1:]:
+            detector.prepare()
+        executor = _get_executor(self.workers)
+        # The slow detectors are queued first; the first cheap one runs in this thread meanwhile.
+        futures = {detector.name: executor.submit(self._run, detector, text)
+                   for detector in sorted(detectors[1:], key=lambda detector: not detector.expensive)}
+        spans = self._run(detectors[0], text)
+        for detector in detectors[1:]:
+            # Collected in registry order, which decides ties when the spans are merged.
+            spans += futures[detector.name].result()
+        return merge_spans(spans)
+
+    def detect_many(self, texts: list, batch_size: int = 64, n_process: int = 1) -> list:
+        """
+        Returns the plan of each text, or the exception raised for it, letting every
+        detector work through the whole batch (NER with `nlp.pipe`).
+        """
+        spans = [[] for _ in texts]
+        errors = {index: TypeError("Input must be a string.")
+                  for index, text in enumerate(texts) if not isinstance(text, str)}
+
+        def run(detectors, indexes):
+            for detector in detectors:
+                found = detector.detect_many([texts[index] for index in indexes], batch_size, n_process)
+                for index, result in zip(indexes, found):
+                    if isinstance(result, Exception):
+                        errors[index] = result
+                    else:
+                        spans[index] += result
+                indexes = [index for index in indexes if index not in errors]
+
+        run(self.cheap, [index for index in range(len(texts)) if index not in errors])
+        if self.expensive:
+            run(self.expensive, [index for index in range(len(texts))
+                                 if index not in errors and self._needs_expensive(texts[index], spans[index])])
+        return [errors[index] if index in errors else merge_spans(spans[index]) for index in range(len(texts))]
+
+
+_config = dict(enabled=None, parallel_min_chars=DEFAULT_PARALLEL_MIN_CHARS, workers=DEFAULT_WORKERS,
+               timing=True, short_circuit=True)
+
+
+def get_config() -> dict:
+    """Returns the detector settings, e.g. to hand them to worker processes."""
+    return dict(_config)
+
+
+def configure(enabled: Optional[Iterable[str]] = None, parallel_min_chars: int = DEFAULT_PARALLEL_MIN_CHARS,
+              workers: int = DEFAULT_WORKERS, timing: bool = True, short_circuit: bool = True):
+    """Sets the detectors `build_registry` enables (all when `enabled` is None) and how they run."""
+    global _config
+    if enabled is not None:
+        enabled = tuple(enabled)
+        unknown = set(enabled) - set(DETECTOR_NAMES)
+        if unknown:
+            raise ValueError(f"Unknown redaction detectors {', '.join(sorted(unknown))}, "
+                             f"expected some of {', '.join(DETECTOR_NAMES)}.")
+    _config = dict(enabled=enabled, parallel_min_chars=parallel_min_chars, workers=workers,
+                   timing=timing, short_circuit=short_circuit)
+
+
+def build_registry(pool, dictionary=None) -> DetectorRegistry:
+    """
+    Returns a registry of the configured detectors, with NER on `pool`. The
+    dictionary detector is only included when a dictionary is given.
+    """
+    available = {detector.name: detector for detector in PATTERN_DETECTORS}
+    available.update(regex=RegexDetector(), ner=NerDetector(pool))
+    if dictionary is not None:
+        available['dictionary'] = DictionaryDetector(dictionary)
+    enabled = DETECTOR_NAMES if _config['enabled'] is None else _config['enabled']
+    return DetectorRegistry(
+        [available[name] for name in DETECTOR_NAMES if name in enabled and name in available],
+        parallel_min_chars=_config['parallel_min_chars'], workers=_config['workers'],
+        timing=_config['timing'], short_circuit=_config['short_circuit'],
+    )
+
+
+def init_app(application):
+    """Reads which detectors are enabled and how they run from the app config."""
+    enabled = application.config.get("REDACTION_DETECTORS")
+    if isinstance(enabled, str):
+        enabled = [name.strip() for name in enabled.split(",") if name.strip()]
+    configure(
+        enabled=enabled,
+        parallel_min_chars=int(application.config.get("REDACTION_PARALLEL_MIN_CHARS", DEFAULT_PARALLEL_MIN_CHARS)),
+        workers=int(application.config.get("REDACTION_DETECTOR_WORKERS", DEFAULT_WORKERS)),
+        timing=bool(application.config.get("REDACTION_DETECTOR_TIMING", True)),
+        short_circuit=bool(application.config.get("REDACTION_SKIP_NER_WITHOUT_LETTERS", True)),
+    )
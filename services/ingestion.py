@@ -0,0 +1,421 @@
+import logging
+import queue
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import nullcontext
+from datetime import datetime, timezone
+from typing import Iterable, NamedTuple, Optional
+
+from flask import has_app_context
+from sqlalchemy import or_, select, update
+
+logger = logging.getLogger(__name__)
+
+# Delivery statuses only move forward, a late 'delivered' never replaces 'read'.
+STATUS_RANK = {'sent': 1, 'delivered': 2, 'read': 3, 'failed': 4}
+TWILIO_STATUSES = {'sent': 'sent', 'delivered': 'delivered', 'read': 'read', 'failed': 'failed',
+                   'undelivered': 'failed'}
+
+
+class IncomingMessage(NamedTuple):
+    """A message from a patient, as parsed from a provider's webhook payload."""
+    wa_id: str
+    phone: str
+    content: Optional[str]
+    timestamp: datetime
+    messenger: str
+    media_type: Optional[str] = None
+    metadata: Optional[dict] = None
+
+
+class StatusUpdate(NamedTuple):
+    """A delivery status reported for a message sent earlier."""
+    wa_id: str
+    status: str
+
+
+class IngestionQueueFull(Exception):
+    """Raised when the ingestion queue already holds its maximum number of unwritten items."""
+
+
+def _utc(timestamp) -> datetime:
+    try:
+        return datetime.fromtimestamp(int(timestamp), timezone.utc).replace(tzinfo=None)
+    except (TypeError, ValueError):
+        return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def _dicts(items) -> list:
+    """The dict items of a payload list; anything else in it is ignored."""
+    return [item for item in items if isinstance(item, dict)] if isinstance(items, list) else []
+
+
+def _text(value) -> bool:
+    return isinstance(value, str) and bool(value)
+
+
+def parse_whatsapp(payload: dict):
+    """
+    Reads the messages and status updates out of a WhatsApp Cloud API webhook payload.
+
+    Only the text (or a media caption) is kept as content. The metadata stored
+    with a message holds the message type and media id, never the provider's
+    full payload, which repeats the text and the contact's profile name. Items of
+    an unexpected shape are skipped rather than failing the whole delivery.
+
+    Returns:
+        A list of `IncomingMessage` and a list of `StatusUpdate`.
+    """
+    messages, statuses = [], []
+    for entry in _dicts(payload.get('entry')):
+        for change in _dicts(entry.get('changes')):
+            value = change.get('value')
+            if not isinstance(value, dict):
+                continue
+            for message in _dicts(value.get('messages')):
+                kind = message.get('type', 'text')
+                if not isinstance(kind, str):
+                    continue
+                body = message.get(kind)
+                media = body if kind != 'text' and isinstance(body, dict) else None
+                if kind == 'text':
+                    content = body.get('body') if isinstance(body, dict) else None
+                else:
+                    content = (media or {}).get('caption')
+                messages.append(IncomingMessage(
+                    wa_id=message.get('id'),
+                    phone=message.get('from'),
+                    content=content,
+                    timestamp=_utc(message.get('timestamp')),
+                    messenger='WhatsApp',
+                    media_type=None if kind == 'text' else kind,
+                    metadata={'provider': 'whatsapp', 'type': kind,
+                              **({'media_id': media['id']} if media and media.get('id') else {})},
+                ))
+            for status in _dicts(value.get('statuses')):
+                if isinstance(status.get('status'), str) and status['status'] in STATUS_RANK:
+                    statuses.append(StatusUpdate(status.get('id'), status['status']))
+    return ([message for message in messages if _text(message.wa_id) and _text(message.phone)
+             and (message.content is None or isinstance(message.content, str))],
+            [status for status in statuses if _text(status.wa_id)])
+
+
+def parse_twilio(form) -> tuple:
+    """
+    Reads an incoming SMS or a status callback out of a Twilio webhook form.
+
+    Returns:
+        A list of `IncomingMessage` and a list of `StatusUpdate`, each with at most one item.
+    """
+    sid = form.get('MessageSid') or form.get('SmsSid')
+    if not sid:
+        return [], []
+    status = form.get('MessageStatus') or form.get('SmsStatus')
+    if status in TWILIO_STATUSES:
+        return [], [StatusUpdate(sid, TWILIO_STATUSES[status])]
+    if form.get('From') is None or form.get('Body') is None:
+        return [], []
+    media = int(form.get('NumMedia') or 0)
+    return [IncomingMessage(
+        wa_id=sid,
+        phone=form.get('From'),
+        content=form.get('Body'),
+        timestamp=_utc(None),
+        messenger='SMS',
+        media_type=((form.get('MediaContentType0') or '').split('/')[0] or None) if media else None,
+        metadata={'provider': 'twilio', 'num_media': media},
+    )], []
+
+
+def _phone_candidates(phone: str) -> set:
+    digits = ''.join(character for character in phone if character.isdigit())
+    return {phone, digits, f'+{digits}'}
+
+
+class MessageIngestor:
+    """
+    Redacts and stores incoming messages in micro-batches.
+
+    Webhook requests only enqueue what they received. A background thread writes
+    a batch when `batch_size` items are waiting or `max_delay` seconds after the
+    first of them arrived, whichever comes first. Each batch:
+
+    * drops messages whose `wa_id` was seen recently or is already stored
+      (providers redeliver webhooks they consider unanswered),
+    * redacts the contents with one `hybrid_redact_many` call, or tokenizes them
+      into the vault when a `vault` is given,
+    * inserts the messages with `Message.bulk_insert`, and
+    * sets delivery statuses with one UPDATE of the `status` column per status value.
+
+    A message whose content could not be redacted, or whose sender is not a known
+    patient, is not stored. Its `wa_id` is forgotten, so a redelivery of it is
+    tried again rather than dropped as a duplicate. With `background=False` every `submit` is written
+    before it returns, which is what tests use.
+    """
+
+    def __init__(self, app, batch_size: int = 100, max_delay: float = 0.5, max_pending: int = 10000,
+                 dedupe_size: int = 100000, service=None, redaction_batch_size: int = 64,
+                 background: bool = True, vault=None, clock=time.monotonic):
+        self.app = app
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.dedupe_size = dedupe_size
+        self.service = service
+        self.vault = vault
+        self.redaction_batch_size = redaction_batch_size
+        self.background = background
+        self._clock = clock
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._seen = OrderedDict()
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+        self.latencies = deque(maxlen=10000)
+        self.counts = dict(received=0, duplicates=0, stored=0, unmatched=0, failed=0, statuses=0, batches=0)
+
+    def _count(self, **increments):
+        with self._lock:
+            for name, value in increments.items():
+                self.counts[name] += value
+
+    def _mark_seen(self, wa_id: str) -> bool:
+        """Remembers a message id; returns False when it was already seen."""
+        with self._lock:
+            if wa_id in self._seen:
+                self._seen.move_to_end(wa_id)
+                return False
+            self._seen[wa_id] = None
+            while len(self._seen) > self.dedupe_size:
+                self._seen.popitem(last=False)
+            return True
+
+    def _forget(self, wa_ids: Iterable[str]):
+        with self._lock:
+            for wa_id in wa_ids:
+                self._seen.pop(wa_id, None)
+
+    def submit(self, messages: Iterable[IncomingMessage] = (), statuses: Iterable[StatusUpdate] = ()) -> int:
+        """
+        Queues messages and status updates for the next batch.
+
+        Returns:
+            The number of messages accepted, i.e. not already seen.
+
+        Raises:
+            IngestionQueueFull: The queue is full; the provider should retry later.
+        """
+        messages, statuses = list(messages), list(statuses)
+        if self._queue.maxsize and self._queue.qsize() + len(messages) + len(statuses) > self._queue.maxsize:
+            # Reject the whole delivery up front, so its redelivery isn't half dropped as duplicates.
+            raise IngestionQueueFull()
+        now = self._clock()
+        accepted = 0
+        for message in messages:
+            self._count(received=1)
+            if not self._mark_seen(message.wa_id):
+                self._count(duplicates=1)
+                continue
+            try:
+                self._queue.put_nowait((message, now))
+            except queue.Full:
+                self._forget([message.wa_id])
+                raise IngestionQueueFull() from None
+            accepted += 1
+        for status in statuses:
+            try:
+                self._queue.put_nowait((status, now))
+            except queue.Full:
+                raise IngestionQueueFull() from None
+        if not self.background:
+            self.flush()
+        elif self._thread is None:
+            self.start()
+        return accepted
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='message-ingestion', daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None):
+        """Stops the background thread after it wrote what is queued."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        self.flush()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                first = self._queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            batch = [first]
+            deadline = first[1] + self.max_delay
+            while len(batch) < self.batch_size:
+                remaining = deadline - self._clock()
+                try:
+                    # Past the deadline, items that are already waiting still join the batch.
+                    batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._write_safely(batch)
+
+    def flush(self):
+        """Writes everything queued so far, in batches of `batch_size`, from the calling thread."""
+        while True:
+            batch = []
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if not batch:
+                return
+            self._write_safely(batch)
+
+    def _write_safely(self, batch):
+        try:
+            # A synchronous submit writes with the session of the request (or test) it runs in.
+            with self._write_lock, nullcontext() if has_app_context() else self.app.app_context():
+                self._write(batch)
+        except Exception as error:
+            messages = [item for item, _ in batch if isinstance(item, IncomingMessage)]
+            # Let the provider's redelivery through instead of dropping it as a duplicate.
+            self._forget(message.wa_id for message in messages)
+            self._count(failed=len(messages))
+            logger.error(f"Writing an ingestion batch of {len(batch)} items failed: {error}", exc_info=True)
+
+    def _write(self, batch):
+        from extensions.database import db
+        from models.message import Message
+
+        messages = [(item, queued_at) for item, queued_at in batch if isinstance(item, IncomingMessage)]
+        statuses = [item for item, _ in batch if isinstance(item, StatusUpdate)]
+        if messages:
+            self._store(db, Message, messages)
+        if statuses:
+            self._apply_statuses(db, Message, statuses)
+            self._count(statuses=len(statuses))
+        db.session.commit()
+        self._count(batches=1)
+
+    def _store(self, db, Message, messages):
+        from models.patient import Patient
+        from services.redaction import ReductionService
+
+        wa_ids = [message.wa_id for message, _ in messages]
+        stored = set(db.session.scalars(select(Message.wa_id).where(Message.wa_id.in_(wa_ids))))
+        duplicates = [message.wa_id for message, _ in messages if message.wa_id in stored]
+        messages = [(message, queued_at) for message, queued_at in messages if message.wa_id not in stored]
+
+        candidates = {message.phone: _phone_candidates(message.phone) for message, _ in messages}
+        wanted = set().union(*candidates.values()) if candidates else set()
+        patients = dict(db.session.execute(select(Patient.phone, Patient.id).where(Patient.phone.in_(wanted))).all())
+        patient_ids = {
+            phone: next((patients[candidate] for candidate in variants if candidate in patients), None)
+            for phone, variants in candidates.items()
+        }
+        unmatched = [message for message, _ in messages if patient_ids[message.phone] is None]
+        messages = [(message, queued_at) for message, queued_at in messages if patient_ids[message.phone] is not None]
+
+        service = self.service or ReductionService()
+        texts = [message.content for message, _ in messages if message.content]
+        if not texts:
+            redacted = iter([])
+        elif self.vault is not None:
+            redacted = iter(self.vault.tokenize_texts(texts, service, batch_size=self.redaction_batch_size))
+        else:
+            redacted = iter(service.hybrid_redact_many(texts, batch_size=self.redaction_batch_size))
+        rows, queued_times, failed = [], [], []
+        for message, queued_at in messages:
+            content = None
+            if message.content:
+                result = next(redacted)
+                if not result['success']:
+                    # Never store text that could not be redacted.
+                    failed.append(message.wa_id)
+                    continue
+                content = result['final_reduct_text']
+            rows.append(dict(
+                wa_id=message.wa_id, phone=message.phone, patient_id=patient_ids[message.phone], sender='patient',
+                content=content, timestamp=message.timestamp, messenger=message.messenger,
+                media_type=message.media_type, msg_metadata=message.metadata, is_read_by_admin=False,
+            ))
+            queued_times.append(queued_at)
+
+        result = Message.bulk_insert(rows, commit=False)
+        now = self._clock()
+        written = set(range(len(rows))) - {failure.index for failure in result.failures}
+        self.latencies.extend(now - queued_times[index] for index in written)
+        failed += [rows[failure.index]['wa_id'] for failure in result.failures]
+        # The webhook already answered 200, so a dropped message only comes back if its redelivery is let through.
+        self._forget([message.wa_id for message in unmatched] + failed)
+        self._count(stored=result.written, duplicates=len(duplicates), unmatched=len(unmatched),
+                    failed=len(failed))
+        if unmatched:
+            logger.warning(f"Skipped {len(unmatched)} message(s) from senders that are not registered patients.")
+
+    def _apply_statuses(self, db, Message, statuses):
+        # Only the newest status per message matters within a batch.
+        latest = {}
+        for status in statuses:
+            current = latest.get(status.wa_id)
+            if current is None or STATUS_RANK[status.status] > STATUS_RANK[current]:
+                latest[status.wa_id] = status.status
+        by_status = {}
+        for wa_id, status in latest.items():
+            by_status.setdefault(status, []).append(wa_id)
+        for status, wa_ids in by_status.items():
+            not_after = [name for name, rank in STATUS_RANK.items() if rank >= STATUS_RANK[status]]
+            db.session.execute(
+                update(Message)
+                .where(Message.wa_id.in_(wa_ids), or_(Message.status.is_(None), Message.status.notin_(not_after)))
+                .values(status=status)
+                .execution_options(synchronize_session=False)
+            )
+
+    def stats(self) -> dict:
+        """Counters since startup and end-to-end latency percentiles of the recent stored messages."""
+        with self._lock:
+            stats = dict(self.counts, pending=self._queue.qsize())
+        latencies = sorted(self.latencies)
+        if latencies:
+            for name, fraction in (('p50', 0.5), ('p95', 0.95), ('p99', 0.99)):
+                stats[f'latency_{name}'] = round(latencies[min(len(latencies) - 1, int(fraction * len(latencies)))], 6)
+        return stats
+
+
+_ingestor = None
+
+
+def get_ingestor() -> MessageIngestor:
+    """Returns the process-wide ingestor set up by `init_app`."""
+    if _ingestor is None:
+        raise RuntimeError("Message ingestion is not initialised; call services.ingestion.init_app(app).")
+    return _ingestor
+
+
+def init_app(application):
+    """Creates the process-wide ingestor from the app config. Its thread starts with the first webhook."""
+    global _ingestor
+    from services.vault import get_vault
+    if application.config.get("INGESTION_TOKENIZE") and get_vault() is None:
+        raise RuntimeError("INGESTION_TOKENIZE needs the tokenization vault; set VAULT_KEY.")
+    _ingestor = MessageIngestor(
+        application,
+        batch_size=int(application.config.get("INGESTION_BATCH_SIZE", 100)),
+        max_delay=float(application.config.get("INGESTION_MAX_DELAY", 0.5)),
+        max_pending=int(application.config.get("INGESTION_MAX_PENDING", 10000)),
+        dedupe_size=int(application.config.get("INGESTION_DEDUPE_SIZE", 100000)),
+        redaction_batch_size=int(application.config.get("REDACTION_BATCH_SIZE", 64)),
+        background=bool(application.config.get("INGESTION_BACKGROUND", True)),
+        vault=get_vault() if application.config.get("INGESTION_TOKENIZE") else None,
+    )
+    return _ingestor
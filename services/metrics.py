@@ -0,0 +1,183 @@
+import itertools
+import threading
+import time
+from bisect import bisect_left
+from typing import Iterable, Optional, Tuple
+
+# Upper bounds of the histogram buckets, in the unit of each histogram.
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (16, 64, 256, 1024, 4096, 16384, 65536, 262144, 1048576)
+ENTITY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 500)
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names: Iterable[str], values: Iterable[str], **extra) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs += [f'{name}="{_escape(value)}"' for name, value in extra.items()]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    """
+    A labelled histogram with fixed buckets, kept in process memory.
+
+    Each label combination keeps one count per bucket plus the sum of the observed
+    values, so an observation is a bisect and two additions. Quantiles are estimated
+    from the buckets the same way Prometheus' `histogram_quantile` does.
+    """
+
+    def __init__(self, name: str, documentation: str, buckets: Tuple[float, ...], label_names: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets)
+        self.label_names = tuple(label_names)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, labels: Tuple[str, ...] = ()):
+        series = self._series.get(labels)
+        if series is None:
+            with self._lock:
+                series = self._series.setdefault(labels, [[0] * (len(self.buckets) + 1), 0.0])
+        # No lock around the additions: it would cost more than the rest of the
+        # call, and a lost update under heavy thread contention is acceptable here.
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def count(self, labels: Tuple[str, ...] = ()) -> int:
+        series = self._series.get(labels)
+        return sum(series[0]) if series else 0
+
+    def quantile(self, q: float, labels: Tuple[str, ...] = ()) -> Optional[float]:
+        """Estimates the q-quantile by interpolating inside the bucket it falls in; None without observations."""
+        with self._lock:
+            series = self._series.get(labels)
+            counts = list(series[0]) if series else []
+        total = sum(counts)
+        if not total:
+            return None
+        rank = q * total
+        cumulative = 0
+        for index, count in enumerate(counts):
+            if cumulative + count >= rank and count:
+                if index == len(self.buckets):
+                    # Past the last finite bucket all we know is the lower bound.
+                    return float(self.buckets[-1])
+                lower = self.buckets[index - 1] if index else 0.0
+                upper = self.buckets[index]
+                return lower + (upper - lower) * (rank - cumulative) / count
+            cumulative += count
+        return float(self.buckets[-1])
+
+    def render(self) -> list:
+        """Returns the Prometheus text exposition lines of the histogram and its quantile estimates."""
+        with self._lock:
+            series = {labels: (list(counts), total) for labels, (counts, total) in self._series.items()}
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        for labels, (counts, total) in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                le = bound if bound == '+Inf' else _number(bound)
+                lines.append(f'{self.name}_bucket{_labels(self.label_names, labels, le=le)} {cumulative}')
+            lines.append(f'{self.name}_sum{_labels(self.label_names, labels)} {_number(total)}')
+            lines.append(f'{self.name}_count{_labels(self.label_names, labels)} {cumulative}')
+        if series:
+            name = f'{self.name}_quantile'
+            lines += [f'# HELP {name} {self.documentation} (estimated from the buckets)', f'# TYPE {name} gauge']
+            for labels in sorted(series):
+                for q in QUANTILES:
+                    value = self.quantile(q, labels)
+                    lines.append(f'{name}{_labels(self.label_names, labels, quantile=q)} {_number(value)}')
+        return lines
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+
+class Metrics:
+    """
+    Latency, input size and entity count histograms of the auth and redaction stages.
+
+    Instrumented code calls `start()` before a stage and, when it returned a start
+    time, `record()` after it. A disabled instance returns None without reading the
+    clock, and with `sample_every` above 1 only every n-th call of the process is
+    timed, so the hot path pays one method call when a call is not measured.
+    """
+
+    def __init__(self, enabled: bool = True, sample_every: int = 1):
+        self.enabled = enabled
+        self.sample_every = max(1, int(sample_every))
+        self._calls = itertools.count()
+        self.stage_seconds = Histogram(
+            'telemed_stage_duration_seconds', 'Time spent in each stage of authentication and redaction.',
+            LATENCY_BUCKETS, ('stage',))
+        self.input_chars = Histogram(
+            'telemed_redaction_input_chars', 'Length of the texts given to each redaction method.',
+            SIZE_BUCKETS, ('method',))
+        self.entities = Histogram(
+            'telemed_redaction_entities', 'Spans found per text, by redaction method and detector.',
+            ENTITY_BUCKETS, ('method', 'source'))
+
+    def start(self) -> Optional[float]:
+        """Returns the start time of a measured call, or None when this call is not measured."""
+        if not self.enabled or (self.sample_every > 1 and next(self._calls) % self.sample_every):
+            return None
+        return time.perf_counter()
+
+    def record(self, stage: str, started: float):
+        """Records the time since `started` under `stage`."""
+        self.stage_seconds.observe(time.perf_counter() - started, (stage,))
+
+    def observe_redaction(self, method: str, text: str, spans: Optional[Iterable] = None,
+                          sources: Tuple[str, ...] = ('regex', 'ner')):
+        """Records the input length and, when the spans are known, how many each of `sources` found."""
+        if not isinstance(text, str):
+            return
+        self.input_chars.observe(len(text), (method,))
+        if spans is None:
+            return
+        by_source = dict.fromkeys(sources, 0)
+        for span in spans:
+            by_source[span.source] = by_source.get(span.source, 0) + 1
+        for source, count in by_source.items():
+            self.entities.observe(count, (method, source))
+
+    def render(self) -> str:
+        """Returns all histograms in the Prometheus text exposition format."""
+        lines = []
+        for histogram in (self.stage_seconds, self.input_chars, self.entities):
+            lines += histogram.render()
+        return '\n'.join(lines) + '\n'
+
+    def clear(self):
+        for histogram in (self.stage_seconds, self.input_chars, self.entities):
+            histogram.clear()
+
+
+_metrics = Metrics()
+
+
+def get_metrics() -> Metrics:
+    """Returns the process-wide metrics."""
+    return _metrics
+
+
+def init_app(application):
+    """Turns the process-wide metrics on or off and sets their sampling from the app config."""
+    global _metrics
+    rate = float(application.config.get("METRICS_SAMPLE_RATE", 1.0))
+    _metrics = Metrics(
+        enabled=bool(application.config.get("METRICS_ENABLED", True)) and rate > 0,
+        sample_every=round(1 / rate) if rate > 0 else 1,
+    )
+    return _metrics
@@ -0,0 +1,134 @@
+import logging
+import queue
+import threading
+from contextlib import contextmanager
+from typing import Iterable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL = "en_core_web_sm"
+# Only the entity recognizer is consumed by the redaction service, so the
+# remaining components are excluded from the loaded pipeline by default.
+DEFAULT_EXCLUDE = ("tagger", "parser", "attribute_ruler", "lemmatizer")
+
+
+class ModelPool:
+    """A fixed-size pool of loaded spaCy pipelines shared by every request in the process.
+
+    Each pipeline is handed out to one thread at a time, so the pool can be used
+    safely from a threaded Flask server. A pool of size 1 serializes NER calls,
+    larger pools trade memory for concurrency.
+    """
+
+    def __init__(self, name: str = DEFAULT_MODEL, size: int = 1, exclude: Iterable[str] = DEFAULT_EXCLUDE, nlp=None):
+        if size < 1:
+            raise ValueError("Pool size must be at least 1.")
+        if nlp is not None:
+            # A pre-built pipeline (e.g. a blank pipeline in tests) is shared as-is.
+            name, size = nlp.meta.get("name", name), 1
+        self.name = name
+        self.size = size
+        self.exclude = tuple(exclude)
+        self._models = queue.Queue(maxsize=size)
+        if nlp is not None:
+            self._models.put(nlp)
+        else:
+            for _ in range(size):
+                nlp = self._load()
+                self._models.put(nlp)
+        # Identifies what the pipelines detect, e.g. for keying cached results.
+        self.version = f"{nlp.meta.get('name')}-{nlp.meta.get('version')}:{','.join(nlp.pipe_names)}"
+        logger.info(f"Loaded {self.size} instance(s) of spaCy model '{self.name}'.")
+
+    def _load(self):
+        # spaCy takes most of a second to import, so it is only imported once a model
+        # is actually loaded, not when the app (or a test) imports this module.
+        import spacy
+
+        # Excluded components are never deserialized, which saves both load time and memory.
+        return spacy.load(self.name, exclude=list(self.exclude))
+
+    @contextmanager
+    def acquire(self, timeout: Optional[float] = None):
+        """Borrows a pipeline from the pool and returns it when the block exits."""
+        nlp = self._models.get(timeout=timeout)
+        try:
+            yield nlp
+        finally:
+            self._models.put(nlp)
+
+
+_pools = {}
+_lock = threading.Lock()
+_warm_lock = threading.Lock()
+_default_key: Tuple[str, int, Tuple[str, ...]] = (DEFAULT_MODEL, 1, DEFAULT_EXCLUDE)
+
+
+def get_model_pool(name: Optional[str] = None, size: Optional[int] = None, exclude: Optional[Iterable[str]] = None) -> ModelPool:
+    """Returns the process-wide pool for the given model settings, loading it on first use.
+
+    Called without arguments it returns the pool configured by `configure()`.
+    """
+    default_name, default_size, default_exclude = _default_key
+    key = (
+        name or default_name,
+        size or default_size,
+        tuple(exclude) if exclude is not None else default_exclude,
+    )
+    pool = _pools.get(key)
+    if pool is None:
+        with _lock:
+            pool = _pools.get(key)
+            if pool is None:
+                pool = ModelPool(*key)
+                _pools[key] = pool
+    return pool
+
+
+def configure(name: str = DEFAULT_MODEL, size: int = 1, exclude: Iterable[str] = DEFAULT_EXCLUDE):
+    """Sets the model settings used by `get_model_pool()` when called without arguments."""
+    global _default_key
+    _default_key = (name, size, tuple(exclude))
+
+
+def warm_up():
+    """Loads the configured pool and runs one document through it, so lazy allocations happen now."""
+    pool = get_model_pool()
+    with pool.acquire() as nlp:
+        nlp("Warm up the pipeline.")
+
+
+def init_app(application):
+    """
+    Configures the shared model pool from the app config and, with SPACY_WARMUP,
+    loads it when the first request arrives.
+
+    Nothing is loaded while the app is created, so CLI commands such as
+    `flask db upgrade` or `flask create-vault` and scripts like seed.py don't need
+    the model. A model that fails to load is logged once; /redact reports the
+    error itself and every other route keeps working.
+    """
+    exclude = application.config.get("SPACY_EXCLUDE", DEFAULT_EXCLUDE)
+    if isinstance(exclude, str):
+        exclude = [pipe.strip() for pipe in exclude.split(",") if pipe.strip()]
+    configure(
+        name=application.config.get("SPACY_MODEL", DEFAULT_MODEL),
+        size=int(application.config.get("SPACY_POOL_SIZE", 1)),
+        exclude=exclude,
+    )
+    if not application.config.get("SPACY_WARMUP", True):
+        return
+    warmed = threading.Event()
+
+    @application.before_request
+    def warm_up_once():
+        if warmed.is_set():
+            return
+        with _warm_lock:
+            if warmed.is_set():
+                return
+            try:
+                warm_up()
+            except Exception as error:
+                logger.error(f"Could not load spaCy model '{_default_key[0]}': {error}")
+            warmed.set()
@@ -0,0 +1,71 @@
+import base64
+import json
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import tuple_
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 200
+
+
+class CursorError(ValueError):
+    """Raised for a cursor that was not produced by `encode_cursor`."""
+
+
+def encode_cursor(*values) -> str:
+    """Packs the sort key of the last row on a page into an opaque, URL-safe string."""
+    payload = [value.isoformat() if isinstance(value, datetime) else value for value in values]
+    return base64.urlsafe_b64encode(json.dumps(payload, separators=(',', ':')).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str, types: tuple) -> tuple:
+    """Unpacks a cursor into values of the given types (`datetime` values are ISO strings inside)."""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if not isinstance(values, list) or len(values) != len(types):
+            raise ValueError('wrong number of values')
+        return tuple(
+            datetime.fromisoformat(value) if kind is datetime else kind(value)
+            for value, kind in zip(values, types)
+        )
+    except (ValueError, TypeError) as error:
+        raise CursorError(f'Invalid cursor: {error}') from None
+
+
+def parse_limit(value: Optional[str]) -> int:
+    """Reads a `limit` query argument, clamped to 1..MAX_LIMIT."""
+    if value in (None, ''):
+        return DEFAULT_LIMIT
+    try:
+        return max(1, min(int(value), MAX_LIMIT))
+    except ValueError:
+        raise CursorError(f'Invalid limit: {value}') from None
+
+
+def keyset_page(session, statement, key_columns, cursor: Optional[str], limit: int, descending: bool = True):
+    """
+    Runs one page of a keyset-paginated SELECT.
+
+    Rows are ordered by `key_columns`, which must identify a row uniquely (e.g.
+    `(Message.timestamp, Message.id)`). Instead of an OFFSET, the page starts right
+    after the row the cursor points at, so every page costs the same index range
+    scan however deep it is.
+
+    Returns:
+        The page's rows and the cursor of the next page, or None on the last page.
+    """
+    key = tuple_(*key_columns)
+    if cursor:
+        types = tuple(column.type.python_type for column in key_columns)
+        after = decode_cursor(cursor, types)
+        statement = statement.where(key < after if descending else key > after)
+    order = [column.desc() if descending else column.asc() for column in key_columns]
+    rows = session.execute(statement.order_by(*order).limit(limit + 1)).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]._mapping
+        next_cursor = encode_cursor(*(last[column] for column in key_columns))
+    return rows, next_cursor
@@ -0,0 +1,255 @@
+import logging
+import re
+import threading
+from typing import Optional
+
+from flask import has_app_context
+
+from services.redaction import EMAIL_BODY, EMAIL_RULE, NER_REPLACEMENT, PHONE_RULE, RedactionSpan
+
+logger = logging.getLogger(__name__)
+
+_WORD = re.compile(r"\w+")
+_EMAIL = re.compile(EMAIL_BODY)
+# A run of digits and the separators phone numbers are written with. It may hold several numbers.
+_PHONE = re.compile(r"\+?\d[\d\s().-]{5,}\d")
+_DIGITS = re.compile(r"\d+")
+_NON_DIGIT = re.compile(r"\D")
+MAX_PHONE_DIGITS = 15  # The longest E.164 number.
+_END = None  # Key of the reference count in a trie node that ends a name.
+
+REPLACEMENTS = {'PERSON': NER_REPLACEMENT, 'EMAIL': EMAIL_RULE.replacement, 'PHONE': PHONE_RULE.replacement}
+LOAD_CHUNK_SIZE = 10000
+IDENTIFYING_FIELDS = ('first_name', 'last_name', 'email', 'phone')
+
+
+def _phone_key(value: str) -> Optional[str]:
+    """The last ten digits of a phone number, so +1 (555) 123-4567 and 555.123.4567 are the same key."""
+    digits = _NON_DIGIT.sub('', value)
+    return digits[-10:] if len(digits) >= 7 else None
+
+
+class PatientDictionary:
+    """
+    Finds the names, emails and phone numbers of known patients in a text.
+
+    Names are kept in a trie of lower-cased words, so one pass over the words of a
+    text finds every known name, however many there are, with the longest match
+    winning ("Jane Smith" over "Jane"). Emails and phone numbers are looked up in
+    dicts, phones by their last ten digits. Every term is reference counted per
+    patient, so adding, changing or removing one patient only touches that
+    patient's terms and never rebuilds the whole dictionary.
+
+    Each process keeps its own copy: changes made through `CRUDMixin` in this
+    process apply right away, other processes see them after `load()`.
+    """
+
+    def __init__(self, min_length: int = 3, match_lowercase_names: bool = False):
+        self.min_length = min_length
+        self.match_lowercase_names = match_lowercase_names
+        self._names = {}
+        self._emails = {}
+        self._phones = {}
+        self._patients = {}
+        self._lock = threading.RLock()
+        self.loaded = False
+        self.version = 0
+
+    def __len__(self):
+        return sum(len(terms) for _, terms in self._patients.values())
+
+    def _terms(self, fields: dict) -> frozenset:
+        terms = set()
+        first, last = (fields.get('first_name') or '').strip(), (fields.get('last_name') or '').strip()
+        for name in (first, last, f'{first} {last}'.strip()):
+            words = tuple(word.lower() for word in _WORD.findall(name))
+            if words and len(''.join(words)) >= self.min_length:
+                terms.add(('PERSON', words))
+        email = (fields.get('email') or '').strip().lower()
+        if email:
+            terms.add(('EMAIL', email))
+        phone = _phone_key(fields.get('phone') or '')
+        if phone:
+            terms.add(('PHONE', phone))
+        return frozenset(terms)
+
+    def _add(self, label, key):
+        if label == 'PERSON':
+            node = self._names
+            for word in key:
+                node = node.setdefault(word, {})
+            node[_END] = node.get(_END, 0) + 1
+        else:
+            entries = self._emails if label == 'EMAIL' else self._phones
+            entries[key] = entries.get(key, 0) + 1
+
+    def _remove(self, label, key):
+        if label != 'PERSON':
+            entries = self._emails if label == 'EMAIL' else self._phones
+            entries[key] -= 1
+            if not entries[key]:
+                del entries[key]
+            return
+        path = [self._names]
+        for word in key:
+            path.append(path[-1][word])
+        path[-1][_END] -= 1
+        if not path[-1][_END]:
+            del path[-1][_END]
+        # Prune the nodes no other name goes through.
+        for word, node, parent in zip(reversed(key), reversed(path[1:]), reversed(path[:-1])):
+            if node:
+                break
+            del parent[word]
+
+    @staticmethod
+    def _identifying(fields) -> dict:
+        return {key: fields.get(key) for key in IDENTIFYING_FIELDS}
+
+    def set_patient(self, patient_id, fields: dict):
+        """Replaces the terms of one patient with those of `fields` (first_name, last_name, email, phone)."""
+        fields = self._identifying(fields)
+        terms = self._terms(fields)
+        with self._lock:
+            old = self._patients.get(patient_id, (None, frozenset()))[1]
+            if terms:
+                self._patients[patient_id] = (fields, terms)
+            else:
+                self._patients.pop(patient_id, None)
+            if old == terms:
+                return
+            for term in old - terms:
+                self._remove(*term)
+            for term in terms - old:
+                self._add(*term)
+            self.version += 1
+
+    def remove_patient(self, patient_id):
+        self.set_patient(patient_id, {})
+
+    def update_patients(self, rows):
+        """
+        Applies bulk written rows, merging partial rows by id. Rows without an id (an
+        upsert matched on another column) can't be placed, so they trigger a full `load()`.
+        """
+        with self._lock:
+            if any(row.get('id') is None for row in rows):
+                self.load()
+                return
+            for row in rows:
+                known = self._patients.get(row['id'], ({}, None))[0]
+                self.set_patient(row['id'], {**known, **{key: row[key] for key in IDENTIFYING_FIELDS if key in row}})
+
+    def load(self, session=None):
+        """Builds the dictionary from the `patients` table, streaming the rows in chunks."""
+        from sqlalchemy import select
+        from extensions.database import db
+        from models.patient import Patient
+
+        session = session or db.session
+        statement = select(Patient.id, Patient.first_name, Patient.last_name, Patient.email, Patient.phone)
+        # Built aside and swapped in at once, so concurrent lookups never see a half loaded dictionary.
+        fresh = PatientDictionary(self.min_length, self.match_lowercase_names)
+        with self._lock:
+            for row in session.execute(statement.execution_options(yield_per=LOAD_CHUNK_SIZE)):
+                fresh.set_patient(row.id, row._mapping)
+            self._names, self._emails, self._phones = fresh._names, fresh._emails, fresh._phones
+            self._patients = fresh._patients
+            self.loaded = True
+            self.version += 1
+        logger.info(f"Loaded {len(self)} identifiers of {len(self._patients)} patients into the redaction dictionary.")
+        return self
+
+    def ensure_loaded(self) -> bool:
+        """Loads the dictionary on first use, when there is an app context to query the database from."""
+        if not self.loaded and has_app_context():
+            with self._lock:
+                if not self.loaded:
+                    self.load()
+        return self.loaded
+
+    def _known_phones(self, text: str, run) -> list:
+        """
+        Returns the (start, end) offsets of the known phone numbers in a `_PHONE` match.
+
+        A run such as "5551234567 5559876543" holds more than one number, so each
+        sequence of consecutive digit groups of up to MAX_PHONE_DIGITS digits is
+        looked up, the longest known one from each starting group winning.
+        """
+        groups = [(run.start() + group.start(), run.start() + group.end(), group.group())
+                  for group in _DIGITS.finditer(run.group())]
+        found, index = [], 0
+        while index < len(groups):
+            digits, last = '', None
+            for position in range(index, len(groups)):
+                digits += groups[position][2]
+                if len(digits) > MAX_PHONE_DIGITS:
+                    break
+                if _phone_key(digits) in self._phones:
+                    last = position
+            if last is None:
+                index += 1
+                continue
+            start = groups[index][0]
+            if start and text[start - 1] in '+(':
+                start -= 1
+            found.append((start, groups[last][1]))
+            index = last + 1
+        return found
+
+    def spans(self, text: str) -> list:
+        """Returns the spans of the known names, emails and phone numbers in the text."""
+        if not isinstance(text, str):
+            raise TypeError("Input must be a string.")
+        self.ensure_loaded()
+        spans = []
+        names = self._names
+        if names:
+            words = [(match.start(), match.end(), match.group()) for match in _WORD.finditer(text)]
+            index, count = 0, len(words)
+            while index < count:
+                start, _, word = words[index]
+                node = names.get(word.lower())
+                if node is None or not (self.match_lowercase_names or word[0].isupper()):
+                    index += 1
+                    continue
+                last, position = None, index
+                while node is not None:
+                    if _END in node:
+                        last = position
+                    position += 1
+                    if position == count:
+                        break
+                    node = node.get(words[position][2].lower())
+                if last is None:
+                    index += 1
+                    continue
+                spans.append(RedactionSpan(start, words[last][1], 'dictionary', 'PERSON', REPLACEMENTS['PERSON']))
+                index = last + 1
+        if self._emails and '@' in text:
+            spans += [RedactionSpan(match.start(), match.end(), 'dictionary', 'EMAIL', REPLACEMENTS['EMAIL'])
+                      for match in _EMAIL.finditer(text) if match.group().lower() in self._emails]
+        if self._phones:
+            spans += [RedactionSpan(start, end, 'dictionary', 'PHONE', REPLACEMENTS['PHONE'])
+                      for match in _PHONE.finditer(text) for start, end in self._known_phones(text, match)]
+        return spans
+
+
+_dictionary = None
+
+
+def get_dictionary() -> Optional[PatientDictionary]:
+    """Returns the process-wide dictionary set up by `init_app`, or None when it is turned off."""
+    return _dictionary
+
+
+def init_app(application):
+    """Creates the process-wide dictionary when REDACTION_DICTIONARY is set. It loads on first use."""
+    global _dictionary
+    _dictionary = None
+    if application.config.get("REDACTION_DICTIONARY", False):
+        _dictionary = PatientDictionary(
+            min_length=int(application.config.get("REDACTION_DICTIONARY_MIN_LENGTH", 3)),
+            match_lowercase_names=bool(application.config.get("REDACTION_DICTIONARY_LOWERCASE_NAMES", False)),
+        )
+    return _dictionary
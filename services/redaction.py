@@ -1,37 +1,525 @@
 import re
+import codecs
+import hashlib
 import logging
-import spacy
+from typing import NamedTuple, Optional
+
+from services import redaction_cache
+from services.metrics import get_metrics
+from services.nlp_pool import ModelPool, get_model_pool
 
 logger = logging.getLogger(__name__)
 
+NER_REPLACEMENT = '[Redacted PII]'
+
+
 class ReductionService:
-    def __init__(self):
-        # Load the model once when the service is created for efficiency
-        self.nlp = spacy.load("en_core_web_sm")
+    def __init__(self, nlp=None, pool: ModelPool = None, cache: redaction_cache.RedactionCache = None,
+                 dictionary=None, detectors=None):
+        # Imported here because the dictionary and detectors build their spans with this module's types.
+        from services.detectors import build_registry
+        from services.patient_dictionary import get_dictionary
+
+        # The spaCy model is loaded once per process and shared through the pool,
+        # so creating a service per request is cheap. An explicit `nlp` pipeline
+        # takes precedence, which is mostly useful for tests.
+        if nlp is not None:
+            pool = ModelPool(nlp=nlp)
+        self.pool = pool or get_model_pool()
+        # Hybrid redaction plans are cached process-wide when REDACTION_CACHE_SIZE is set.
+        self.cache = cache if cache is not None else redaction_cache.get_cache()
+        # Known patient identifiers, matched next to the regexes when REDACTION_DICTIONARY is set.
+        self.dictionary = dictionary if dictionary is not None else get_dictionary()
+        # The detectors hybrid redaction runs, enabled and scheduled from the REDACTION_DETECTORS settings.
+        self.detectors = detectors if detectors is not None else build_registry(self.pool, self.dictionary)
+
+    @property
+    def version(self) -> str:
+        """Identifies the detectors in use; cached plans are only reused for the same version."""
+        return self.detectors.version
 
     def redact_with_regex(self, text: str):
-        text = redact_email(text)
-        text = redact_phone_number(text)
-        return text
-    
+        metrics = get_metrics()
+        started = metrics.start()
+        redacted = redact_pii(text)
+        if started is not None:
+            metrics.record('regex', started)
+            metrics.observe_redaction('regex', text)
+        return redacted
+
+    def regex_spans(self, text: str) -> list:
+        """Returns the email and phone number spans found in the text."""
+        if not isinstance(text, str):
+            raise TypeError("Input must be a string.")
+        return PII_REDACTOR.spans(text)
+
+    def dictionary_spans(self, text: str) -> list:
+        """Returns the spans of known patient names, emails and phone numbers, if a dictionary is in use."""
+        if self.dictionary is None:
+            return []
+        return self.dictionary.spans(text)
+
+    def nlp_spans(self, text: str) -> list:
+        """Returns the named entity spans spaCy finds in the text."""
+        with self.pool.acquire() as nlp:
+            doc = nlp(text)
+        return entity_spans(doc)
+
     def redact_with_nlp(self, text: str):
-        doc = self.nlp(text)
-        reversed_ents = doc.ents[::-1]
-        redacted_sub = '[Redacted PII]'
-        for ent in reversed_ents:
-            text = text[:ent.start_char] + redacted_sub + text[ent.end_char:]
-        return text
-    
+        metrics = get_metrics()
+        started = metrics.start()
+        spans = self.nlp_spans(text)
+        if started is not None:
+            metrics.record('ner', started)
+            metrics.observe_redaction('ner', text, spans, sources=('ner',))
+        return apply_spans(text, spans)
+
+    def hybrid_plan(self, text: str) -> list:
+        """
+        Returns the redaction plan `hybrid_redact` applies: the merged, ordered spans
+        of the original text, each tagged with the detector that found it.
+
+        Every enabled detector (regex, dictionary, identifier patterns, NER) runs over
+        the original text, so spaCy never spends time on (or tags) the regex
+        placeholders. Where spans overlap, the widest one wins.
+
+        Callers that need to know what was redacted (audit logging, tokenization)
+        can reuse the plan with `apply_spans` instead of running detection again.
+        """
+        if self.cache is not None and isinstance(text, str):
+            plan = self.cache.get(text, self.version)
+            if plan is not None:
+                return plan
+        plan = self._detect(text)
+        if self.cache is not None:
+            # Only span positions and placeholders are stored, never the text itself.
+            self.cache.set(text, self.version, plan)
+        return plan
+
+    def _detect(self, text: str) -> list:
+        return self.detectors.detect(text)
+
     def hybrid_redact(self, text: str):
-        logging.info("Hybrid redaction has been initiated") 
-        regex_redact_text = self.redact_with_regex(text)
-        final_redact_text = self.redact_with_nlp(regex_redact_text)
-        occurrences  = final_redact_text.count('[Redacted')
-        logging.info(f"The hybrid redacted {occurrences} many instances.")
+        logger.debug("Hybrid redaction has been initiated")
+        metrics = get_metrics()
+        started = metrics.start()
+        plan = self.hybrid_plan(text)
+        final_redact_text = apply_spans(text, plan)
+        if started is not None:
+            metrics.record('hybrid', started)
+            metrics.observe_redaction('hybrid', text, plan, sources=self.detectors.names)
+        logger.debug(f"The hybrid redacted {len(plan)} many instances.")
         return final_redact_text
 
-# Configure basic logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    def hybrid_redact_stream(self, source, chunk_size: int = 100_000, overlap: int = 1_000):
+        """
+        Redacts a long text piece by piece, yielding the redacted output as it goes.
+
+        The text is detected in windows of about `chunk_size + overlap` characters. Only
+        the part of a window that ends at least `overlap` characters before the window's
+        end is emitted, cut at a line, sentence or word boundary and never inside a
+        detected span; the rest is carried into the next window. An entity or phone
+        number shorter than `overlap` on a chunk edge is therefore seen whole. Memory
+        stays bounded by the window size whatever the input length.
+
+        Args:
+            source: A string, a file-like object with `read()`, or an iterable of
+                string (or UTF-8 bytes) pieces.
+            chunk_size: Characters emitted per window, at most.
+            overlap: Characters of right context kept after each cut.
+
+        Yields:
+            Consecutive pieces of the redacted text.
+        """
+        if chunk_size < 1 or overlap < 0:
+            raise ValueError("chunk_size must be positive and overlap non-negative.")
+        logger.debug("Streaming hybrid redaction has been initiated")
+        window = ''
+        redacted = 0
+        for piece in iter_text(source, chunk_size):
+            window += piece
+            while len(window) >= chunk_size + overlap:
+                cut, plan = self._window_cut(window, chunk_size)
+                redacted += len(plan)
+                yield apply_spans(window[:cut], plan)
+                window = window[cut:]
+        if window:
+            plan = self._detect(window)
+            redacted += len(plan)
+            yield apply_spans(window, plan)
+        logger.debug(f"The streaming hybrid redacted {redacted} many instances.")
+
+    def _window_cut(self, window: str, limit: int):
+        """Returns where to cut the window, at or before `limit`, and the spans before the cut."""
+        plan = self._detect(window)
+        cut = boundary_before(window, limit)
+        kept = len(plan)
+        # Walk back from the last span (ends grow with position) and move the cut before
+        # any span it would split, or before the context a span was recognised by, so
+        # "DOB: " and its date always land in the same window.
+        for index in range(len(plan) - 1, -1, -1):
+            span = plan[index]
+            if span.end <= cut:
+                break
+            kept = index
+            cut = min(cut, span.start if span.context_start is None else span.context_start)
+        if cut == 0:
+            # A span reaching back to the start of the window is emitted whole instead.
+            cut = plan[kept].end
+            kept += 1
+        return cut, plan[:kept]
+
+    def hybrid_redact_many(self, texts, batch_size: int = 64, n_process: int = 1) -> list:
+        """
+        Redacts many texts at once, streaming them through `nlp.pipe` instead of
+        calling the pipeline once per document.
+
+        Args:
+            texts: An iterable of strings to process.
+            batch_size: Number of documents spaCy buffers per batch.
+            n_process: Number of processes spaCy uses for NER.
+
+        Returns:
+            One result dict per input, in input order: `{'success': True,
+            'final_reduct_text': ...}` or `{'success': False, 'error': ...}` for an
+            input that could not be redacted. One bad input never fails the batch.
+        """
+        texts = list(texts)
+        logger.debug(f"Batch redaction of {len(texts)} texts has been initiated")
+        return [
+            {'success': False, 'error': str(plan)} if isinstance(plan, Exception)
+            else {'success': True, 'final_reduct_text': apply_spans(text, plan)}
+            for text, plan in zip(texts, self.hybrid_plan_many(texts, batch_size, n_process))
+        ]
+
+    def hybrid_plan_many(self, texts, batch_size: int = 64, n_process: int = 1) -> list:
+        """
+        Returns the `hybrid_plan` of many texts, each detector working through the
+        whole batch (NER with `nlp.pipe`).
+
+        Returns:
+            One plan per input, in input order, or the exception raised for an input
+            that could not be processed.
+        """
+        texts = list(texts)
+        plans = [None] * len(texts)
+
+        version = self.version
+        pending = []
+        for index, text in enumerate(texts):
+            plan = self.cache.get(text, version) if self.cache is not None and isinstance(text, str) else None
+            if plan is not None:
+                plans[index] = plan
+            else:
+                pending.append(index)
+
+        detected = self.detectors.detect_many([texts[index] for index in pending], batch_size, n_process)
+        for index, plan in zip(pending, detected):
+            plans[index] = plan
+            if self.cache is not None and not isinstance(plan, Exception):
+                self.cache.set(texts[index], version, plan)
+        return plans
+
+
+class RegexRule(NamedTuple):
+    """
+    One regex detector used by `RegexRedactor`.
+
+    Attributes:
+        name: Group name reported for a match.
+        label: The kind of PII the rule finds, reported on its spans.
+        lead: The assertion that must hold right before a match, r'\\b' or r'(?<!\\w)'.
+        body: The pattern itself.
+        replacement: The placeholder that replaces a match.
+        first: A character class of every character a match can start with.
+        key: A literal every match contains, with only `first` characters before it.
+            Rules without a key must only start after a non-word character.
+        guard: An optional assertion checked right after a match.
+    """
+    name: str
+    label: str
+    lead: str
+    body: str
+    replacement: str
+    first: str
+    key: str = ''
+    guard: str = ''
+
+
+class RedactionSpan(NamedTuple):
+    """
+    A region of the original text to redact, tagged with the detector that found it.
+
+    `context_start` is set when the detector only recognised the region by the text
+    in front of it, e.g. the "DOB: " of a date of birth; that text is kept, but it
+    must be seen together with the region for the region to be found again.
+    """
+    start: int
+    end: int
+    source: str  # The name of the detector, e.g. 'regex', 'dictionary', 'sin' or 'ner'
+    label: str  # 'EMAIL', 'PHONE', 'SIN', ... or the spaCy entity label
+    replacement: str
+    context_start: Optional[int] = None
+
+
+def merge_spans(spans) -> list:
+    """
+    Merges overlapping spans in one pass over the spans sorted by position.
+
+    A group of overlapping spans becomes one span covering all of them, which keeps
+    the source, label and replacement of the widest span in the group (the first one
+    on ties). Spans that only touch are kept apart.
+    """
+    merged = []
+    widest = None
+    for span in sorted(spans, key=lambda span: (span.start, -span.end)):
+        if merged and span.start < merged[-1].end:
+            if span.end - span.start > widest.end - widest.start:
+                widest = span
+            end = max(merged[-1].end, span.end)
+            merged[-1] = widest._replace(start=merged[-1].start, end=end,
+                                         context_start=_earliest_context(merged[-1], span))
+        else:
+            widest = span
+            merged.append(span)
+    return merged
+
+
+def _earliest_context(first: RedactionSpan, second: RedactionSpan) -> Optional[int]:
+    if first.context_start is None or second.context_start is None:
+        return second.context_start if first.context_start is None else first.context_start
+    return min(first.context_start, second.context_start)
+
+
+def entity_spans(doc) -> list:
+    """Returns the named entities of a spaCy doc as spans."""
+    return [
+        RedactionSpan(ent.start_char, ent.end_char, 'ner', ent.label_, NER_REPLACEMENT)
+        for ent in doc.ents
+    ]
+
+
+def apply_spans(text: str, spans) -> str:
+    """Replaces the given ordered, non-overlapping spans, assembling the output with one join."""
+    if not spans:
+        return text
+    parts = []
+    last = 0
+    for span in spans:
+        parts.append(text[last:span.start])
+        parts.append(span.replacement)
+        last = span.end
+    parts.append(text[last:])
+    return "".join(parts)
+
+
+# Preferred places to cut a long text, best first: a line break, a sentence end, any whitespace.
+_BOUNDARIES = [re.compile(r'\n'), re.compile(r'[.!?]\s'), re.compile(r'\s')]
+
+
+def boundary_before(text: str, limit: int) -> int:
+    """
+    Returns a cut position at or before `limit`, just after the last line break,
+    sentence end or whitespace in the second half of `text[:limit]`. Falls back to
+    `limit` itself when that stretch has no whitespace at all.
+    """
+    floor = limit // 2
+    for boundary in _BOUNDARIES:
+        last = None
+        for last in boundary.finditer(text, floor, limit):
+            pass
+        if last is not None:
+            return last.end()
+    return limit
+
+
+def iter_text(source, size: int = 65536):
+    """Yields a text source as string pieces: a string, a file-like object or an iterable of pieces."""
+    if isinstance(source, str):
+        for start in range(0, len(source), size):
+            yield source[start:start + size]
+        return
+    if hasattr(source, 'read'):
+        # Not `iter(read, read(0))`: a WSGI input stream treats a zero-byte read as a client disconnect.
+        pieces = iter(lambda: source.read(size) or None, None)
+    else:
+        pieces = iter(source)
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    for piece in pieces:
+        if isinstance(piece, bytes):
+            piece = decoder.decode(piece)
+        elif not isinstance(piece, str):
+            raise TypeError("Input must be a string.")
+        if piece:
+            yield piece
+    tail = decoder.decode(b'', final=True)
+    if tail:
+        yield tail
+
+
+_is_word_char = re.compile(r'\w').match
+
+
+class RegexRedactor:
+    """
+    Redacts several regex rules in a single left-to-right pass.
+
+    The rules are listed in the order the old implementation applied them as separate
+    `re.sub` passes, and the output is the same as running those passes one after
+    another. A match from an earlier pass is replaced by a placeholder ending in ']',
+    which changes the look-behind context seen by later passes. Each rule therefore
+    gets a second "right after a match" variant of the combined pattern, where the
+    lead assertions of later rules are evaluated as if the previous character were ']'.
+
+    Trying the combined pattern at every position is slow in Python's backtracking
+    engine, so it is only tried where a rule can start: next to the characters in a
+    rule's `first` class (found with a character-class search, which runs in C), and
+    in the run of characters before a rule's `key`.
+    """
+
+    # How a lead assertion evaluates when the previous character is a placeholder's ']'.
+    _AFTER_PLACEHOLDER = {r'\b': r'(?=\w)', r'(?<!\w)': ''}
+
+    def __init__(self, rules):
+        self.rules = list(rules)
+        self.replacements = {rule.name: rule.replacement for rule in self.rules}
+        self.labels = {rule.name: rule.label for rule in self.rules}
+        self._pattern = self._compile(lambda index: False)
+        self._after = {
+            rule.name: self._compile(lambda index, after=position: index > after)
+            for position, rule in enumerate(self.rules)
+        }
+        anchored = "".join(rule.first[1:-1] for rule in self.rules if not rule.key)
+        # The trailing \w* skips the rest of a word, where no rule can start.
+        self._anchor = re.compile(f"[{anchored}]\\w*") if anchored else None
+        self._keys = [(rule.key, re.compile(rule.first).match) for rule in self.rules if rule.key]
+
+    def _compile(self, after_placeholder):
+        alternatives = []
+        for index, rule in enumerate(self.rules):
+            lead = self._AFTER_PLACEHOLDER[rule.lead] if after_placeholder(index) else rule.lead
+            alternatives.append(f"(?P<{rule.name}>{lead}{rule.body}{rule.guard})")
+        return re.compile("|".join(alternatives))
+
+    def _key_runs(self, text: str):
+        """Returns the sorted (start, end) ranges of characters that precede a rule's key."""
+        runs = []
+        for key, is_run_char in self._keys:
+            at = text.find(key)
+            while at != -1:
+                start = at
+                while start > 0 and is_run_char(text[start - 1]):
+                    start -= 1
+                if start < at:
+                    runs.append((start, at))
+                at = text.find(key, at + 1)
+        runs.sort()
+        return runs
+
+    def _candidates(self, text: str):
+        """Yields, in increasing order, every position where a match could start."""
+        runs = self._key_runs(text)
+        run_index = 0
+        anchors = self._anchor.finditer(text) if self._anchor is not None else ()
+        for anchor in anchors:
+            start = anchor.start()
+            while run_index < len(runs) and runs[run_index][0] <= start:
+                yield from range(*runs[run_index])
+                run_index += 1
+            if start == 0 or not _is_word_char(text[start - 1]):
+                yield start
+            if anchor.end() > start + 1 and not _is_word_char(text[start]):
+                yield start + 1
+        for run in runs[run_index:]:
+            yield from range(*run)
+
+    def finditer(self, text: str):
+        """Yields the non-overlapping matches of all rules, left to right."""
+        candidates = self._candidates(text)
+        pattern_match = self._pattern.match
+        pos = 0
+        after = None
+        while True:
+            match = after.match(text, pos) if after is not None else None
+            if match is None:
+                start = pos + 1 if after is not None else pos
+                for candidate in candidates:
+                    if candidate >= start:
+                        match = pattern_match(text, candidate)
+                        if match is not None:
+                            break
+                else:
+                    return
+            yield match
+            after = self._after[match.lastgroup]
+            pos = match.end()
+
+    def spans(self, text: str) -> list:
+        """Returns the matches of all rules as ordered, non-overlapping spans."""
+        return [
+            RedactionSpan(match.start(), match.end(), 'regex', self.labels[match.lastgroup],
+                          self.replacements[match.lastgroup])
+            for match in self.finditer(text)
+        ]
+
+    def redact(self, text: str) -> str:
+        """Returns the text with every match replaced, assembling the output once."""
+        return apply_spans(text, self.spans(text))
+
+
+# Pattern for common email formats, including those with '+' aliases.
+EMAIL_BODY = r"[A-Za-z0-9._%=+-]+@(?:[A-Za-z0-9-]+\.)+[A-Z|a-z]+\b"
+# A complex pattern for various phone formats with separators.
+# Handles formats like (xxx) xxx-xxxx, xxx-xxx-xx-xx, etc.
+PHONE_BODY = r'(?:\+?1[\s.-]*)?(?:(?:\(\d{3}\))|\d{3})[\s.-]?(?:\d{3}[\s.-]?(?:\d{4}|\d{2}[\s-]\d{2}))\b'
+# A simpler, stricter pattern for purely numeric strings (10 or 11 digits).
+# The \b word boundaries are crucial to prevent matching parts of longer numbers.
+NUMERIC_PHONE_BODY = r"1?\d{10}\b"
+
+EMAIL_RULE = RegexRule('email', 'EMAIL', r'\b', EMAIL_BODY, '[REDACTED EMAIL]', first=r'[A-Za-z0-9._%=+-]', key='@')
+PHONE_RULE = RegexRule('phone', 'PHONE', r'(?<!\w)', PHONE_BODY, '[REDACTED PHONE]', first=r'[+(\d]')
+NUMERIC_PHONE_RULE = RegexRule('numeric_phone', 'PHONE', r'\b', NUMERIC_PHONE_BODY, '[REDACTED PHONE]', first=r'[\d]')
+
+EMAIL_REDACTOR = RegexRedactor([EMAIL_RULE])
+PHONE_REDACTOR = RegexRedactor([PHONE_RULE, NUMERIC_PHONE_RULE])
+# Emails are redacted before phone numbers, so a phone number that runs into the
+# local part of an email (e.g. "123-456-7890.x@y.com") belongs to the email.
+PII_REDACTOR = RegexRedactor([
+    EMAIL_RULE,
+    PHONE_RULE._replace(guard=r"(?![A-Za-z0-9._%=+-]*@(?:[A-Za-z0-9-]+\.)+[A-Z|a-z]+\b)"),
+    NUMERIC_PHONE_RULE,
+])
+
+# Changes whenever a rule changes, which invalidates cached redaction plans.
+PATTERN_VERSION = hashlib.sha256(
+    "\0".join(repr(rule) for rule in PII_REDACTOR.rules).encode("utf-8")).hexdigest()[:12]
+
+
+def redact_pii(text: str) -> str:
+    """
+    Redacts email addresses and phone numbers in a single pass over the text.
+
+    Args:
+        text: The input string to process.
+
+    Returns:
+        A new string with emails replaced by '[REDACTED EMAIL]' and phone numbers
+        replaced by '[REDACTED PHONE]', the same as `redact_phone_number(redact_email(text))`.
+
+    Raises:
+        TypeError: If the input is not a string.
+    """
+    if not isinstance(text, str):
+        raise TypeError("Input must be a string.")
+    try:
+        redacted_text = PII_REDACTOR.redact(text)
+        if redacted_text is not text:
+            logger.debug("Successfully redacted email(s) and phone number(s) from text.")
+        return redacted_text
+    except Exception as e:
+        logger.error(f"An unexpected error occurred during regex redaction: {e}")
+        raise
+
 
 def redact_email(text: str) -> str:
     """
@@ -50,17 +538,16 @@ def redact_email(text: str) -> str:
         # Raise an error as the function expects a string.
         raise TypeError("Input must be a string.")
     try:
-        # Pattern for common email formats, including those with '+' aliases.
-        email_pattern = re.compile(r"\b[A-Za-z0-9._%=+-]+@([A-Za-z0-9-]+\.)+[A-Z|a-z]+\b")
-        redacted_text = re.sub(email_pattern, '[REDACTED EMAIL]', text)
-        if redacted_text != text:
-            logging.info("Successfully redacted email(s) from text.")
+        redacted_text = EMAIL_REDACTOR.redact(text)
+        if redacted_text is not text:
+            logger.debug("Successfully redacted email(s) from text.")
         return redacted_text
     except Exception as e:
         # Log any unexpected errors during the regex operation and re-raise.
-        logging.error(f"An unexpected error occurred during email redaction: {e}")
+        logger.error(f"An unexpected error occurred during email redaction: {e}")
         raise
 
+
 def redact_phone_number(text: str) -> str:
     """
     Redacts North American phone numbers from the given text using a two-pattern approach.
@@ -77,24 +564,11 @@ def redact_phone_number(text: str) -> str:
     if not isinstance(text, str):
         raise TypeError("Input must be a string.")
     try:
-        # Pattern 1: A complex pattern for various formats with separators.
-        # Handles formats like (xxx) xxx-xxxx, xxx-xxx-xx-xx, etc.
-        phone_pattern = re.compile(r'(?<!\w)(?:\+?1[\s.-]*)?(?:(?:\(\d{3}\))|\d{3})[\s.-]?(?:\d{3}[\s.-]?(?:\d{4}|\d{2}[\s-]\d{2}))\b')
-        
-        # Pattern 2: A simpler, stricter pattern for purely numeric strings (10 or 11 digits).
-        # The \b word boundaries are crucial to prevent matching parts of longer numbers.
-        numeric_pattern = r"\b(1?)(\d{10})\b"
-        
-        # First pass: Handle the complex, formatted numbers.
-        redacted_text = re.sub(phone_pattern, '[REDACTED PHONE]', text)
-        
-        # Second pass: Handle the simple, numeric-only strings on the already processed text.
-        redacted_text = re.sub(numeric_pattern, '[REDACTED PHONE]', redacted_text)
-
-        if redacted_text != text:
-            logging.info("Successfully redacted phone number(s) from text.")
+        # Formatted and purely numeric numbers are matched in the same pass.
+        redacted_text = PHONE_REDACTOR.redact(text)
+        if redacted_text is not text:
+            logger.debug("Successfully redacted phone number(s) from text.")
         return redacted_text
     except Exception as e:
-        logging.error(f"An unexpected error occurred during phone redaction: {e}")
+        logger.error(f"An unexpected error occurred during phone redaction: {e}")
         raise
-
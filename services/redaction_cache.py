@@ -0,0 +1,118 @@
+import hashlib
+import hmac
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+class RedactionCache:
+    """
+    A bounded LRU cache with a TTL for redaction results.
+
+    Entries are keyed by an HMAC of the input text and the detector version, so the
+    raw text is never stored, and a key cannot be recomputed from a guessed input
+    without the secret. When the version changes (a different spaCy model or new
+    regex patterns) the whole cache is dropped.
+    """
+
+    def __init__(self, max_entries: int = 10000, ttl: float = 3600, secret: Optional[bytes] = None,
+                 clock=time.monotonic):
+        if max_entries < 1:
+            raise ValueError("Cache size must be at least 1.")
+        self.max_entries = max_entries
+        self.ttl = ttl
+        # A per-process random secret unless one is configured.
+        self._secret = secret or os.urandom(32)
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._version = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def key(self, text: str, version: str) -> str:
+        """Returns the cache key for a text redacted by the given detector version."""
+        message = version.encode("utf-8") + b"\0" + text.encode("utf-8")
+        return hmac.new(self._secret, message, hashlib.sha256).hexdigest()
+
+    def _check_version(self, version: str):
+        if version != self._version:
+            if self._entries:
+                logger.info(f"Redaction detectors changed to {version}, dropping {len(self._entries)} cached results.")
+            self._entries.clear()
+            self._version = version
+
+    def get(self, text: str, version: str):
+        """Returns the cached value, or None on a miss."""
+        key = self.key(text, version)
+        with self._lock:
+            self._check_version(version)
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, value = entry
+            if expires_at <= self._clock():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, text: str, version: str, value):
+        """Stores a value, evicting the least recently used entry when full."""
+        key = self.key(text, version)
+        with self._lock:
+            self._check_version(version)
+            self._entries[key] = (self._clock() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+
+_cache: Optional[RedactionCache] = None
+
+
+def get_cache() -> Optional[RedactionCache]:
+    """Returns the process-wide cache, or None when caching is disabled."""
+    return _cache
+
+
+def init_app(application):
+    """Creates the process-wide cache from the app config. A size of 0 disables it."""
+    global _cache
+    size = int(application.config.get("REDACTION_CACHE_SIZE", 0))
+    if size <= 0:
+        _cache = None
+        return
+    secret = application.config.get("REDACTION_CACHE_KEY")
+    _cache = RedactionCache(
+        max_entries=size,
+        ttl=float(application.config.get("REDACTION_CACHE_TTL", 3600)),
+        secret=secret.encode("utf-8") if isinstance(secret, str) else secret,
+    )
@@ -0,0 +1,270 @@
+import logging
+import multiprocessing
+import threading
+import time
+import uuid
+from concurrent.futures import CancelledError, ProcessPoolExecutor
+from logging.handlers import QueueHandler, QueueListener
+from typing import Iterable, Optional
+
+from services import detectors, patient_dictionary
+from services.nlp_pool import DEFAULT_EXCLUDE, DEFAULT_MODEL
+
+logger = logging.getLogger(__name__)
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+TIMED_OUT = 'timed_out'
+
+
+class QueueFullError(Exception):
+    """Raised when the job queue already holds its maximum number of unfinished jobs."""
+
+
+# Per worker process state, set up once by `_init_worker`.
+_worker_service = None
+_worker_app = None
+# The web process's dictionary version, shared with the workers, and the one this worker last loaded at.
+_dictionary_version = None
+_loaded_version = None
+
+
+def _worker_dictionary(database_url: str, min_length: int, match_lowercase_names: bool):
+    """Returns an empty dictionary and sets up the app its worker loads patients from."""
+    global _worker_app
+    from flask import Flask
+    import models.message  # noqa: F401 (Patient.messages refers to it)
+    from extensions.database import setup_db
+    from services.patient_dictionary import PatientDictionary
+
+    _worker_app = Flask(__name__)
+    _worker_app.config["DB_CREATE_ALL"] = "false"
+    setup_db(_worker_app, database_url)
+    return PatientDictionary(min_length=min_length, match_lowercase_names=match_lowercase_names)
+
+
+def _init_worker(model: str, exclude: tuple, detector_config: Optional[dict] = None, log_queue=None,
+                 log_level: int = logging.INFO, dictionary_config: Optional[dict] = None, dictionary_version=None):
+    """Sends the worker's log records to the web process, then loads the spaCy model once."""
+    global _worker_service, _dictionary_version
+    from services import detectors, nlp_pool
+    from services.redaction import ReductionService
+
+    # A handler copied from the web process (such as the log pipeline's queue handler) has no
+    # writer in this process, so everything it received would be lost.
+    root = logging.getLogger()
+    root.handlers.clear()
+    root.setLevel(log_level)
+    if log_queue is not None:
+        root.addHandler(QueueHandler(log_queue))
+
+    nlp_pool.configure(name=model, size=1, exclude=exclude)
+    if detector_config:
+        detectors.configure(**detector_config)
+    # The dictionary is loaded by the first job, so a database outage fails jobs rather than the pool.
+    dictionary = _worker_dictionary(**dictionary_config) if dictionary_config else None
+    _dictionary_version = dictionary_version
+    _worker_service = ReductionService(pool=nlp_pool.get_model_pool(), dictionary=dictionary)
+
+
+def _refresh_dictionary():
+    """Reloads the worker's dictionary when the web process's copy changed since the last load."""
+    global _loaded_version
+    if _worker_service.dictionary is None:
+        return
+    version = _dictionary_version.value
+    if version != _loaded_version:
+        with _worker_app.app_context():
+            _worker_service.dictionary.load()
+        _loaded_version = version
+
+
+def _redact_in_worker(text: str) -> str:
+    _refresh_dictionary()
+    return _worker_service.hybrid_redact(text)
+
+
+class _ForwardHandler(logging.Handler):
+    """Hands records from worker processes to the logger of the same name in the web process."""
+
+    def emit(self, record: logging.LogRecord):
+        record_logger = logging.getLogger(record.name)
+        if record_logger.isEnabledFor(record.levelno):
+            record_logger.handle(record)
+
+
+class RedactionJob:
+    """The state of one submitted document, as seen by the web process."""
+
+    def __init__(self, owner, future, submitted_at: float):
+        self.id = uuid.uuid4().hex
+        self.owner = owner
+        self.future = future
+        self.submitted_at = submitted_at
+        self.finished_at = None
+        self.timed_out = False
+
+    @property
+    def status(self) -> str:
+        if self.timed_out:
+            return TIMED_OUT
+        if not self.future.done():
+            return RUNNING if self.future.running() else QUEUED
+        if self.future.cancelled() or self.future.exception() is not None:
+            return FAILED
+        return DONE
+
+    def to_dict(self) -> dict:
+        data = {'job_id': self.id, 'status': self.status}
+        if data['status'] == DONE:
+            data['final_reduct_text'] = self.future.result()
+        elif data['status'] == FAILED:
+            data['error'] = 'An internal error occurred during redaction.'
+        elif data['status'] == TIMED_OUT:
+            data['error'] = 'Redaction did not finish in time.'
+        return data
+
+
+class RedactionJobQueue:
+    """
+    Runs redaction jobs on a local process pool so long documents don't block request threads.
+
+    Each worker process loads the spaCy model once in its initializer. At most
+    `max_pending` jobs may be queued or running at a time; beyond that `submit`
+    raises `QueueFullError`. A job still unfinished `timeout` seconds after it was
+    submitted is reported as timed out and its result is discarded (a task that
+    is already running can't be interrupted, so it keeps its slot until it ends).
+    Finished jobs are forgotten `result_ttl` seconds after they complete.
+
+    Workers are started with `start_method` ("spawn" by default) rather than forked,
+    so they don't inherit the web process's threads, locks or database connections.
+    Their log records are passed back over a queue and written by the web process's
+    own handlers.
+
+    With `dictionary_config` (the database URL and dictionary settings) each worker
+    loads its own patient dictionary. It reloads it when the version of the web
+    process's dictionary has changed by the time a job is submitted, so workers see
+    the patients the web process sees.
+    """
+
+    def __init__(self, workers: int = 2, max_pending: int = 100, timeout: float = 120, result_ttl: float = 600,
+                 model: str = DEFAULT_MODEL, exclude: Iterable[str] = DEFAULT_EXCLUDE,
+                 detector_config: Optional[dict] = None, dictionary_config: Optional[dict] = None,
+                 start_method: str = 'spawn', task=_redact_in_worker, clock=time.monotonic):
+        if max_pending < 1:
+            raise ValueError("The queue must allow at least one pending job.")
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.result_ttl = result_ttl
+        self._task = task
+        self._clock = clock
+        self._jobs = {}
+        self._lock = threading.Lock()
+        context = multiprocessing.get_context(start_method)
+        self._log_queue = context.Queue()
+        self._log_listener = QueueListener(self._log_queue, _ForwardHandler())
+        self._log_listener.start()
+        self._dictionary_version = context.Value('q', 0) if dictionary_config else None
+        # Worker processes are started on the first submission, not here.
+        self._executor = ProcessPoolExecutor(
+            max_workers=workers, mp_context=context, initializer=_init_worker,
+            initargs=(model, tuple(exclude), detector_config, self._log_queue, logging.getLogger().getEffectiveLevel(),
+                      dictionary_config, self._dictionary_version))
+
+    def _unfinished(self) -> int:
+        return sum(1 for job in self._jobs.values() if not job.future.done())
+
+    def _sweep(self):
+        """Marks overdue jobs as timed out and drops expired results. Called with the lock held."""
+        now = self._clock()
+        for job_id, job in list(self._jobs.items()):
+            if not job.timed_out and not job.future.done() and now - job.submitted_at >= self.timeout:
+                job.timed_out = True
+                # Jobs that haven't started yet never reach a worker.
+                job.future.cancel()
+                logger.error(f"Redaction job {job_id} timed out after {self.timeout} seconds.")
+            if job.finished_at is not None and now - job.finished_at >= self.result_ttl:
+                del self._jobs[job_id]
+
+    def submit(self, text: str, owner=None) -> RedactionJob:
+        """Queues a text for redaction and returns its job."""
+        if not isinstance(text, str):
+            raise TypeError("Input must be a string.")
+        if self._dictionary_version is not None:
+            dictionary = patient_dictionary.get_dictionary()
+            if dictionary is not None and dictionary.ensure_loaded():
+                self._dictionary_version.value = dictionary.version
+        with self._lock:
+            self._sweep()
+            if self._unfinished() >= self.max_pending:
+                raise QueueFullError(f"{self.max_pending} redaction jobs are already pending.")
+            job = RedactionJob(owner, self._executor.submit(self._task, text), self._clock())
+            self._jobs[job.id] = job
+        job.future.add_done_callback(lambda future: setattr(job, 'finished_at', self._clock()))
+        logger.info(f"Queued redaction job {job.id} ({len(text)} characters).")
+        return job
+
+    def get(self, job_id: str, owner=None) -> Optional[RedactionJob]:
+        """Returns the job, or None if it is unknown, expired or belongs to someone else."""
+        with self._lock:
+            self._sweep()
+            job = self._jobs.get(job_id)
+        if job is None or job.owner != owner:
+            return None
+        return job
+
+    def wait(self, job_id: str, owner=None, timeout: Optional[float] = None) -> Optional[RedactionJob]:
+        """Blocks until the job finishes or `timeout` elapses, then returns it."""
+        job = self.get(job_id, owner)
+        if job is not None:
+            try:
+                job.future.exception(timeout=timeout)
+            except CancelledError:
+                pass
+        return job
+
+    def shutdown(self, wait: bool = True):
+        self._executor.shutdown(wait=wait, cancel_futures=True)
+        self._log_listener.stop()
+
+
+_queue: Optional[RedactionJobQueue] = None
+_config = {}
+_queue_lock = threading.Lock()
+
+
+def get_job_queue() -> RedactionJobQueue:
+    """Returns the process-wide job queue, creating it from the settings given to `init_app`."""
+    global _queue
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                _queue = RedactionJobQueue(**_config)
+    return _queue
+
+
+def init_app(application):
+    """Reads the job queue settings from the app config. The pool itself is created on first use."""
+    global _config
+    exclude = application.config.get("SPACY_EXCLUDE", DEFAULT_EXCLUDE)
+    if isinstance(exclude, str):
+        exclude = [pipe.strip() for pipe in exclude.split(",") if pipe.strip()]
+    dictionary = patient_dictionary.get_dictionary()
+    dictionary_config = None
+    if dictionary is not None:
+        dictionary_config = dict(database_url=application.config["SQLALCHEMY_DATABASE_URI"],
+                                 min_length=dictionary.min_length,
+                                 match_lowercase_names=dictionary.match_lowercase_names)
+    _config = dict(
+        workers=int(application.config.get("REDACTION_JOB_WORKERS", 2)),
+        max_pending=int(application.config.get("REDACTION_JOB_MAX_PENDING", 100)),
+        timeout=float(application.config.get("REDACTION_JOB_TIMEOUT", 120)),
+        result_ttl=float(application.config.get("REDACTION_JOB_RESULT_TTL", 600)),
+        model=application.config.get("SPACY_MODEL", DEFAULT_MODEL),
+        exclude=tuple(exclude),
+        detector_config=detectors.get_config(),
+        dictionary_config=dictionary_config,
+        start_method=application.config.get("REDACTION_JOB_START_METHOD", "spawn"),
+    )
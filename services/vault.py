@@ -0,0 +1,197 @@
+import hashlib
+import hmac
+import logging
+import re
+import threading
+from collections import OrderedDict
+from typing import Iterable, Optional
+
+import click
+from sqlalchemy import select
+
+from services.redaction import apply_spans
+
+logger = logging.getLogger(__name__)
+
+# How a token appears in stored text, e.g. [[PERSON:3f0c...]].
+TOKEN_PATTERN = re.compile(r'\[\[([A-Z_]+):([0-9a-f]{32})\]\]')
+LOOKUP_CHUNK_SIZE = 500
+
+
+class VaultError(Exception):
+    """Raised when tokens could not be stored, so text that refers to them must not be stored either."""
+
+
+def render_token(label: str, token: str) -> str:
+    return f'[[{label}:{token}]]'
+
+
+class TokenVault:
+    """
+    Replaces detected values with tokens and keeps the values in the vault table.
+
+    Tokens are an HMAC of the entity label and the value, so a value that appears
+    in many messages is stored once and always gets the same token, and the token
+    reveals nothing without the key. All the new values of a batch of texts are
+    written with one upsert, and detokenizing a batch looks up all its tokens with
+    one query per `LOOKUP_CHUNK_SIZE` tokens. Recently used tokens are kept in an
+    in-memory LRU so hot values skip the database entirely.
+    """
+
+    def __init__(self, secret: bytes, cache_size: int = 10000):
+        if not secret:
+            raise ValueError("The vault needs a secret key.")
+        self._secret = secret
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def token_for(self, label: str, value: str) -> str:
+        message = label.encode('utf-8') + b'\0' + value.encode('utf-8')
+        return hmac.new(self._secret, message, hashlib.sha256).hexdigest()[:32]
+
+    def _remember(self, values: dict):
+        with self._lock:
+            for token, value in values.items():
+                self._cache[token] = value
+                self._cache.move_to_end(token)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def _cached(self, tokens: Iterable[str]) -> dict:
+        found = {}
+        with self._lock:
+            for token in tokens:
+                value = self._cache.get(token)
+                if value is not None:
+                    self._cache.move_to_end(token)
+                    found[token] = value
+        return found
+
+    def tokenize_many(self, texts, plans) -> list:
+        """
+        Replaces every span of each text's redaction plan with a token and stores the new values.
+
+        Args:
+            texts: The original texts.
+            plans: One list of `RedactionSpan` per text, e.g. from `ReductionService.hybrid_plan_many`.
+
+        Returns:
+            The tokenized texts, in input order.
+
+        Raises:
+            VaultError: The values could not be stored.
+        """
+        from models.vault import VaultEntry
+
+        entries, tokenized = {}, []
+        for text, plan in zip(texts, plans):
+            spans = []
+            for span in plan:
+                value = text[span.start:span.end]
+                token = self.token_for(span.label, value)
+                entries[token] = (span.label, value)
+                spans.append(span._replace(replacement=render_token(span.label, token)))
+            tokenized.append(apply_spans(text, spans))
+
+        known = self._cached(entries)
+        new = {token: entry for token, entry in entries.items() if token not in known}
+        if new:
+            result = VaultEntry.bulk_upsert(
+                [{'token': token, 'label': label, 'value': value} for token, (label, value) in new.items()],
+                index_elements=['token'])
+            if result.failures:
+                raise VaultError(f"{len(result.failures)} of {len(new)} vault entries could not be stored: "
+                                 f"{result.failures[0].error}")
+            self._remember({token: value for token, (_, value) in new.items()})
+        return tokenized
+
+    def tokenize_texts(self, texts, service, batch_size: int = 64, n_process: int = 1) -> list:
+        """
+        Detects and tokenizes many texts. A drop-in for `ReductionService.hybrid_redact_many`:
+        returns the same result dicts, with tokens in place of the fixed placeholders.
+        """
+        texts = list(texts)
+        plans = service.hybrid_plan_many(texts, batch_size=batch_size, n_process=n_process)
+        ok = [index for index, plan in enumerate(plans) if not isinstance(plan, Exception)]
+        tokenized = dict(zip(ok, self.tokenize_many([texts[index] for index in ok], [plans[index] for index in ok])))
+        return [
+            {'success': True, 'final_reduct_text': tokenized[index]} if index in tokenized
+            else {'success': False, 'error': str(plans[index])}
+            for index in range(len(texts))
+        ]
+
+    def lookup(self, tokens: Iterable[str]) -> dict:
+        """Returns the stored value of each known token, from the LRU or with batched queries."""
+        from extensions.database import db
+        from models.vault import VaultEntry
+
+        tokens = set(tokens)
+        values = self._cached(tokens)
+        missing = sorted(tokens - values.keys())
+        with self._lock:
+            self.hits += len(values)
+            self.misses += len(missing)
+        found = {}
+        for start in range(0, len(missing), LOOKUP_CHUNK_SIZE):
+            chunk = missing[start:start + LOOKUP_CHUNK_SIZE]
+            found.update(db.session.execute(
+                select(VaultEntry.token, VaultEntry.value).where(VaultEntry.token.in_(chunk))).all())
+        self._remember(found)
+        values.update(found)
+        return values
+
+    def detokenize_many(self, texts) -> list:
+        """Puts the original values back into many texts at once. Unknown tokens are left as they are."""
+        texts = list(texts)
+        tokens = {match.group(2) for text in texts if text for match in TOKEN_PATTERN.finditer(text)}
+        if not tokens:
+            return texts
+        values = self.lookup(tokens)
+        return [
+            TOKEN_PATTERN.sub(lambda match: values.get(match.group(2), match.group(0)), text) if text else text
+            for text in texts
+        ]
+
+    def detokenize(self, text: str) -> str:
+        return self.detokenize_many([text])[0]
+
+
+_vault = None
+
+
+def get_vault() -> Optional[TokenVault]:
+    """Returns the process-wide vault set up by `init_app`, or None when VAULT_KEY is not set."""
+    return _vault
+
+
+@click.command('create-vault')
+def create_vault_command():
+    """Creates the vault table in the 'vault' bind (it is not managed by the Alembic migrations)."""
+    from extensions.database import db
+    import models.vault  # noqa: F401 (registers the table)
+
+    db.create_all(bind_key='vault')
+    click.echo('Created the vault table.')
+
+
+def init_app(application):
+    """
+    Creates the process-wide vault from the app config and registers `flask create-vault`.
+
+    Tokens are HMACs of the values, so anyone who knows the key can test guesses
+    against stored tokens. The vault is therefore only set up with an explicit
+    VAULT_KEY, never one derived from a setting with a default.
+    """
+    global _vault
+    _vault = None
+    application.cli.add_command(create_vault_command)
+    secret = application.config.get("VAULT_KEY")
+    if not secret:
+        logger.warning("VAULT_KEY is not set, the tokenization vault is disabled.")
+        return _vault
+    _vault = TokenVault(secret.encode() if isinstance(secret, str) else secret,
+                        cache_size=int(application.config.get("VAULT_CACHE_SIZE", 10000)))
+    return _vault
@@ -0,0 +1,69 @@
+import pytest
+import spacy
+
+
+@pytest.fixture
+def ruler_nlp():
+    """A small rule-based NER pipeline, so tests don't depend on a downloaded model."""
+    nlp = spacy.blank("en")
+    ruler = nlp.add_pipe("entity_ruler")
+    ruler.add_patterns([
+        {"label": "PERSON", "pattern": "John"},
+        {"label": "PERSON", "pattern": [{"LOWER": "jane"}, {"LOWER": "smith"}]},
+        {"label": "PERSON", "pattern": "Tonia"},
+        {"label": "GPE", "pattern": "Berlin"},
+        {"label": "GPE", "pattern": "Zurich"},
+    ])
+    return nlp
+
+
+@pytest.fixture
+def app():
+    """A Flask app on an in-memory SQLite database, without the Postgres setup of `create_app`."""
+    from flask import Flask
+    from extensions.database import db, enable_sqlite_foreign_keys, enable_sqlite_savepoints
+    import models.language, models.message, models.patient, models.user, models.vault  # noqa: F401 (register the tables)
+
+    application = Flask(__name__)
+    application.config.update(SQLALCHEMY_DATABASE_URI="sqlite://", SQLALCHEMY_BINDS={"vault": "sqlite://"},
+                              TESTING=True)
+    db.init_app(application)
+    with application.app_context():
+        for engine in db.engines.values():
+            enable_sqlite_savepoints(engine)
+            enable_sqlite_foreign_keys(engine)
+        db.create_all()
+        yield application
+        db.session.remove()
+
+
+@pytest.fixture
+def auth_headers(app, monkeypatch):
+    """Returns a function that creates a user with the given permissions and a bearer token for them."""
+    from datetime import datetime, timedelta, timezone
+    import jwt
+    from extensions.auth.token import get_token_cache
+    from models.user import User
+
+    monkeypatch.setenv('SECRET_KEY', 'test-secret')
+    get_token_cache().clear()
+
+    def make(permissions, username='staff'):
+        user = User(username=username, role='admin', permissions=permissions)
+        user.set_password('secret')
+        user.insert()
+        claims = {'username': username, 'role': 'admin', 'permissions': permissions,
+                  'exp': datetime.now(timezone.utc) + timedelta(hours=1)}
+        return {'Authorization': 'Bearer ' + jwt.encode(claims, 'test-secret', algorithm='HS256')}
+    return make
+
+
+@pytest.fixture
+def client(app):
+    """A test client for the app with the project's blueprints registered."""
+    from routes.api_routes import api
+    from routes.home_routes import home
+
+    app.register_blueprint(home)
+    app.register_blueprint(api)
+    return app.test_client()
@@ -0,0 +1,53 @@
+from benchmarks.bench_suite import compare, percentile, run_target
+from benchmarks.corpus import generate_corpus
+from services.redaction import ReductionService
+
+
+class TestCorpus:
+    def test_same_seed_same_corpus(self):
+        assert generate_corpus(20, seed=5) == generate_corpus(20, seed=5)
+        assert generate_corpus(20, seed=5) != generate_corpus(20, seed=6)
+
+    def test_lengths_and_entity_offsets(self):
+        notes = generate_corpus(50, seed=1, min_chars=300, max_chars=600)
+        labels = set()
+        for note in notes:
+            assert 300 <= len(note.text) < 600 + 120
+            for start, end, label in note.entities:
+                value = note.text[start:end]
+                assert value and value == value.strip()
+                labels.add(label)
+        assert labels == {'PERSON', 'GPE', 'EMAIL', 'PHONE'}
+
+    def test_densities(self):
+        notes = generate_corpus(20, seed=2, densities={'EMAIL': 1.0})
+        assert all(note.entities and {label for _, _, label in note.entities} == {'EMAIL'} for note in notes)
+        assert not any(note.entities for note in generate_corpus(20, seed=2, densities={}))
+
+    def test_regex_finds_every_generated_email_and_phone(self, ruler_nlp):
+        service = ReductionService(nlp=ruler_nlp, cache=None)
+        for note in generate_corpus(50, seed=3):
+            found = {(span.start, span.end) for span in service.regex_spans(note.text)}
+            expected = {(start, end) for start, end, label in note.entities if label in ('EMAIL', 'PHONE')}
+            assert expected <= found
+
+
+class TestSuite:
+    def test_run_target_summary(self):
+        summary = run_target('hybrid', dict(docs=30, seed=0, max_chars=500), blank=True, warmup=5, rounds=2)
+        assert summary['docs'] == 30
+        assert summary['docs_per_sec'] > 0 and summary['peak_rss_mb'] > 0
+        assert summary['latency_p50_ms'] <= summary['latency_p95_ms'] <= summary['latency_p99_ms']
+
+    def test_percentile(self):
+        samples = list(range(1, 101))
+        assert (percentile(samples, 0.5), percentile(samples, 0.95), percentile(samples, 1.0)) == (50, 95, 100)
+
+    def test_regressions_beyond_the_threshold_are_reported(self):
+        baseline = {'results': {'regex': {'docs_per_sec': 1000, 'chars_per_sec': 1e6, 'latency_p95_ms': 1.0}}}
+        within = {'results': {'regex': {'docs_per_sec': 950, 'chars_per_sec': 1.2e6, 'latency_p95_ms': 1.05},
+                              'route': {'docs_per_sec': 1}}}
+        assert compare(within, baseline, 0.1) == []
+        slower = {'results': {'regex': {'docs_per_sec': 800, 'chars_per_sec': 1e6, 'latency_p95_ms': 1.5}}}
+        assert [line.split(':')[0] for line in compare(slower, baseline, 0.1)] == \
+            ['regex docs_per_sec', 'regex latency_p95_ms']
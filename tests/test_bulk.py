@@ -0,0 +1,77 @@
+from datetime import datetime
+
+import pytest
+
+from extensions.auth.token import get_token_cache
+from extensions.database import db
+from models.language import Language
+from models.message import Message
+from models.patient import Patient
+from models.user import User
+
+
+@pytest.fixture
+def patient(app):
+    return Patient(email='patient@example.com').insert()
+
+
+def message_rows(patient_id, count):
+    return [{'phone': '+100', 'patient_id': patient_id, 'sender': 'patient', 'content': f'Message {number}',
+             'timestamp': datetime(2024, 1, 1, 0, 0, number % 60)} for number in range(count)]
+
+
+class TestBulkOperations:
+
+    def test_bulk_insert_in_chunks(self, app, patient):
+        result = Message.bulk_insert(message_rows(patient.id, 25), chunk_size=10)
+        assert result == (25, [])
+        assert Message.query.count() == 25
+        # Column defaults apply as they do for insert().
+        assert {message.messenger for message in Message.query} == {'WhatsApp'}
+
+    def test_bulk_insert_isolates_failing_rows(self, app, patient):
+        rows = message_rows(patient.id, 12)
+        rows[3]['phone'] = None
+        rows[8]['phone'] = None
+        result = Message.bulk_insert(rows, chunk_size=5)
+        assert result.written == 10
+        assert [failure.index for failure in result.failures] == [3, 8]
+        assert 'NOT NULL' in result.failures[0].error
+        assert Message.query.count() == 10
+
+    def test_bulk_insert_accepts_instances_and_joins_the_callers_transaction(self, app, patient):
+        rows = [Language(name='English'), Language(name='German')]
+        assert Language.bulk_insert(rows, commit=False).written == 2
+        db.session.rollback()
+        assert Language.query.count() == 0
+
+    def test_bulk_upsert(self, app):
+        Language.bulk_insert([{'id': 1, 'name': 'English'}, {'id': 2, 'name': 'German'}])
+        result = Language.bulk_upsert([{'id': 2, 'name': 'Deutsch'}, {'id': 3, 'name': 'French'}])
+        assert result == (2, [])
+        assert [language.name for language in Language.query.order_by(Language.id)] == ['English', 'Deutsch', 'French']
+
+        result = Language.bulk_upsert([{'id': 9, 'name': 'English'}, {'id': 10, 'name': 'Italian'}],
+                                      index_elements=['name'])
+        db.session.expunge_all()
+        assert result.written == 2
+        assert [language.id for language in Language.query.order_by(Language.id)] == [2, 3, 9, 10]
+
+    def test_bulk_update_by_primary_key(self, app, patient):
+        Message.bulk_insert(message_rows(patient.id, 4))
+        ids = [message.id for message in Message.query.order_by(Message.id)]
+        result = Message.bulk_update([{'id': id_, 'is_read_by_admin': True} for id_ in ids[:3]] + [{'status': 'read'}])
+        db.session.expunge_all()
+        assert result.written == 3
+        assert [failure.index for failure in result.failures] == [3]
+        assert [message.is_read_by_admin for message in Message.query.order_by(Message.id)] == [True, True, True, False]
+        assert Message.query.get(ids[0]).content == 'Message 0'
+
+    def test_bulk_update_invalidates_cached_users(self, app):
+        user = User(username='staff', role='admin', password_hash='x', permissions='get:patients')
+        user.insert()
+        cache = get_token_cache()
+        cache.clear()
+        cache.user('staff', lambda name: User.query.filter_by(username=name).first())
+        User.bulk_update([{'id': user.id, 'is_active': False}])
+        assert cache.user('staff', lambda name: User.query.filter_by(username=name).first()).is_active is False
@@ -0,0 +1,114 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import select, text
+
+from extensions.database import db
+from models.message import Message
+from models.patient import Patient
+from tests.test_pagination import fetch_all
+
+
+@pytest.fixture
+def conversation(app):
+    patients = [Patient(email=f'patient{number}@example.com') for number in range(2)]
+    db.session.add_all(patients)
+    db.session.flush()
+    start = datetime(2025, 1, 1)
+    Message.bulk_insert([
+        {'phone': '+1', 'patient_id': patients[number % 2].id, 'content': f'message {number}',
+         'timestamp': start + timedelta(minutes=number // 4), 'is_read_by_admin': number < 10}
+        for number in range(30)
+    ])
+    return patients
+
+
+def conversation_order(patient_id, **filters):
+    messages = Message.query.filter_by(patient_id=patient_id, **filters).all()
+    return [message.id for message in sorted(messages, key=lambda m: (m.timestamp, m.id), reverse=True)]
+
+
+class TestConversation:
+
+    def test_conversation_is_paged_newest_first(self, client, auth_headers, conversation):
+        headers = auth_headers('get:messages')
+        patient_id = conversation[0].id
+        items, pages = fetch_all(client, headers, f'/patients/{patient_id}/messages?limit=4', 'messages',
+                                 param='before')
+        assert pages == 4
+        assert [item['id'] for item in items] == conversation_order(patient_id)
+        assert set(items[0]) == {'id', 'sender', 'content', 'timestamp', 'messenger', 'media_type', 'status',
+                                 'is_read_by_admin'}
+
+    def test_before_cursor_and_unread_filter(self, client, auth_headers, conversation):
+        headers = auth_headers('get:messages')
+        patient_id = conversation[1].id
+        first = client.get(f'/patients/{patient_id}/messages?limit=3', headers=headers).get_json()
+        second = client.get(f'/patients/{patient_id}/messages?limit=3&before={first["next_cursor"]}',
+                            headers=headers).get_json()
+        assert [item['id'] for item in first['messages'] + second['messages']] == conversation_order(patient_id)[:6]
+
+        unread, _ = fetch_all(client, headers, f'/patients/{patient_id}/messages?unread=true&limit=5', 'messages',
+                              param='before')
+        assert [item['id'] for item in unread] == conversation_order(patient_id, is_read_by_admin=False)
+
+    def test_errors(self, client, auth_headers, conversation):
+        headers = auth_headers('get:messages')
+        assert client.get('/patients/999/messages', headers=headers).status_code == 404
+        assert client.get(f'/patients/{conversation[0].id}/messages?before=junk', headers=headers).status_code == 400
+
+    def test_unread_view(self, client, auth_headers, conversation):
+        items, _ = fetch_all(client, auth_headers('get:messages'), '/messages/unread?limit=7', 'messages')
+        assert len(items) == 20
+        assert not any(item['is_read_by_admin'] for item in items)
+        assert [item['timestamp'] for item in items] == sorted((item['timestamp'] for item in items), reverse=True)
+
+    @pytest.mark.parametrize('condition, index', [
+        (Message.is_read_by_admin == False, 'ix_message_unread_timestamp_id'),  # noqa: E712
+        (Message.patient_id == 1, 'ix_message_patient_timestamp'),
+    ])
+    def test_queries_use_their_indexes(self, app, conversation, condition, index):
+        statement = select(Message.id).where(condition, Message.timestamp.isnot(None)) \
+            .order_by(Message.timestamp.desc(), Message.id.desc()).limit(10)
+        compiled = statement.compile(db.engine, compile_kwargs={'literal_binds': True})
+        plan = ' '.join(str(row[-1]) for row in db.session.execute(text(f'EXPLAIN QUERY PLAN {compiled}')))
+        assert index in plan and 'TEMP B-TREE' not in plan
+
+    def test_mark_read_in_one_statement(self, client, auth_headers, conversation):
+        headers = auth_headers('patch:messages')
+        patient_id = conversation[0].id
+        unread = conversation_order(patient_id, is_read_by_admin=False)
+        # Everything up to the fourth newest unread message.
+        response = client.post(f'/patients/{patient_id}/messages/read', json={'through_id': unread[3]},
+                               headers=headers)
+        assert response.get_json() == {'success': True, 'updated': len(unread) - 3}
+        db.session.expire_all()
+        assert conversation_order(patient_id, is_read_by_admin=False) == unread[:3]
+
+        response = client.post(f'/patients/{patient_id}/messages/read', json={'ids': unread[:1]}, headers=headers)
+        assert response.get_json()['updated'] == 1
+        response = client.post(f'/patients/{patient_id}/messages/read', headers=headers)
+        assert response.get_json()['updated'] == 2
+        # The other patient's messages are untouched.
+        assert Message.query.filter_by(patient_id=conversation[1].id, is_read_by_admin=False).count() == 10
+
+    def test_mark_read_validation(self, client, auth_headers, conversation):
+        headers = auth_headers('patch:messages')
+        assert client.post(f'/patients/{conversation[0].id}/messages/read', json={'ids': 'all'},
+                           headers=headers).status_code == 400
+        assert client.post('/patients/999/messages/read', headers=headers).status_code == 404
+        assert client.post(f'/patients/{conversation[0].id}/messages/read',
+                           headers=auth_headers('get:messages', username='reader')).status_code == 403
+
+    def test_messages_relationship_is_never_loaded_whole(self, app, conversation):
+        patient = db.session.get(Patient, conversation[0].id)
+        newest = db.session.scalars(
+            patient.messages.select().order_by(Message.timestamp.desc(), Message.id.desc()).limit(1)).one()
+        assert newest.id == conversation_order(patient.id)[0]
+
+    def test_deleting_a_patient_deletes_their_messages(self, app, conversation):
+        patient = db.session.get(Patient, conversation[0].id)
+        # passive_deletes leaves the messages to the ON DELETE CASCADE of the foreign key.
+        assert patient.delete()
+        assert Message.query.filter_by(patient_id=conversation[0].id).count() == 0
+        assert Message.query.filter_by(patient_id=conversation[1].id).count() == 15
@@ -0,0 +1,117 @@
+import threading
+
+import pytest
+
+from services import detectors as detectors_module
+from services import metrics as metrics_module
+from services.detectors import Detector, DetectorRegistry, NerDetector, PATTERN_DETECTORS, RegexDetector
+from services.metrics import Metrics
+from services.nlp_pool import ModelPool
+from services.redaction import ReductionService, apply_spans
+
+
+class CountingDetector(Detector):
+    """An expensive detector that records the texts and threads it ran on."""
+
+    name = 'counting'
+    expensive = True
+
+    def __init__(self):
+        self.texts = []
+        self.threads = set()
+
+    def detect(self, text):
+        self.texts.append(text)
+        self.threads.add(threading.current_thread().name)
+        return []
+
+
+@pytest.fixture
+def config(monkeypatch):
+    """Restores the process-wide detector settings after a test changes them."""
+    monkeypatch.setattr(detectors_module, '_config', detectors_module.get_config())
+    return detectors_module
+
+
+class TestPatternDetectors:
+    @pytest.mark.parametrize('text, expected', [
+        ("SIN 046 454 286 on file", "SIN [REDACTED SIN] on file"),
+        ("SIN 046 454 287 on file", "SIN 046 454 287 on file"),  # Wrong check digit
+        ("SSN: 123-45-6789.", "SSN: [REDACTED SSN]."),
+        ("SSN: 666-45-6789.", "SSN: 666-45-6789."),
+        ("Card 1234-567-890-AB expires", "Card [REDACTED HEALTH CARD] expires"),
+        ("Lives near K1A 0B1, Ottawa", "Lives near [REDACTED POSTAL CODE], Ottawa"),
+        ("Mail to 90210-1234 please", "Mail to [REDACTED POSTAL CODE] please"),
+        ("DOB: 1980-04-12, admitted", "DOB: [REDACTED DOB], admitted"),
+        ("born on March 3, 1975 in", "born on [REDACTED DOB] in"),
+        ("MRN #A1234567 was merged", "MRN #[REDACTED MRN] was merged"),
+        ("The dose was 12.5 mg at 10:30", "The dose was 12.5 mg at 10:30"),
+    ])
+    def test_identifiers(self, text, expected):
+        registry = DetectorRegistry(PATTERN_DETECTORS)
+        assert apply_spans(text, registry.detect(text)) == expected
+
+    def test_hybrid_redaction_runs_every_enabled_detector(self, ruler_nlp, config):
+        text = "John (SIN 046 454 286, MRN 00123456) can be called at 555-123-4567"
+        assert ReductionService(nlp=ruler_nlp, cache=None).hybrid_redact(text) == \
+            "[Redacted PII] (SIN [REDACTED SIN], MRN [REDACTED MRN]) can be called at [REDACTED PHONE]"
+
+        config.configure(enabled=['regex', 'ner'])
+        service = ReductionService(nlp=ruler_nlp, cache=None)
+        assert service.detectors.names == ('regex', 'ner')
+        assert service.hybrid_redact(text) == \
+            "[Redacted PII] (SIN 046 454 286, MRN 00123456) can be called at [REDACTED PHONE]"
+        with pytest.raises(ValueError, match="typo"):
+            config.configure(enabled=['regex', 'typo'])
+
+
+class TestScheduling:
+    def test_expensive_detectors_skip_texts_without_letters(self):
+        counting = CountingDetector()
+        registry = DetectorRegistry([RegexDetector(), counting])
+        for text in ("555-123-4567  42\n", "   ", "a@example.com, 555-123-4567", "call 555-123-4567"):
+            registry.detect(text)
+        # Only the last text has letters outside the spans of the cheap detectors.
+        assert counting.texts == ["call 555-123-4567"]
+
+        registry.short_circuit = False
+        registry.detect("   ")
+        assert counting.texts[-1] == "   "
+
+    def test_large_inputs_run_on_worker_threads(self, ruler_nlp):
+        text = "Contact John in Berlin at john.doe@example.com, SIN 046 454 286. " * 50
+        pool = ModelPool(nlp=ruler_nlp)
+        sequential = DetectorRegistry([RegexDetector(), *PATTERN_DETECTORS, NerDetector(pool)])
+        counting = CountingDetector()
+        parallel = DetectorRegistry([RegexDetector(), *PATTERN_DETECTORS, NerDetector(pool), counting],
+                                    parallel_min_chars=1000, workers=3)
+
+        assert parallel.detect(text) == sequential.detect(text)
+        assert all(thread.startswith('redaction-detector') for thread in counting.threads)
+        parallel.detect("Short texts stay in the calling thread.")
+        assert threading.current_thread().name in counting.threads
+
+    def test_detect_many_matches_detect(self, ruler_nlp):
+        counting = CountingDetector()
+        registry = DetectorRegistry([RegexDetector(), *PATTERN_DETECTORS, NerDetector(ModelPool(nlp=ruler_nlp)),
+                                     counting])
+        texts = ["John's MRN: 00123456", None, "555-123-4567", "Tonia moved to Zurich"]
+        plans = registry.detect_many(texts, batch_size=2)
+
+        assert str(plans[1]) == "Input must be a string."
+        assert [plans[index] for index in (0, 2, 3)] == [registry.detect(texts[index]) for index in (0, 2, 3)]
+        assert counting.texts.count("555-123-4567") == 0
+
+    def test_each_detector_is_timed(self, ruler_nlp, monkeypatch):
+        metrics = Metrics()
+        monkeypatch.setattr(metrics_module, '_metrics', metrics)
+        service = ReductionService(nlp=ruler_nlp, cache=None)
+        service.hybrid_redact("John, SSN 123-45-6789")
+        for name in service.detectors.names:
+            assert metrics.stage_seconds.count((f'hybrid.{name}',)) == 1, name
+        assert 'telemed_redaction_entities_sum{method="hybrid",source="ssn"} 1.0' in metrics.render()
+
+        service.detectors.timing = False
+        service.hybrid_redact("John, SSN 123-45-6789")
+        assert metrics.stage_seconds.count(('hybrid.ner',)) == 1
+        assert metrics.stage_seconds.count(('hybrid',)) == 2
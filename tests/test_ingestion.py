@@ -0,0 +1,185 @@
+import base64
+import hashlib
+import hmac
+import json
+import time
+
+import pytest
+
+from extensions.database import db
+from models.message import Message
+from models.patient import Patient
+from services import ingestion
+from services.ingestion import IncomingMessage, MessageIngestor, StatusUpdate
+from services.redaction import ReductionService
+
+
+def whatsapp_payload(messages=(), statuses=()):
+    return {'object': 'whatsapp_business_account', 'entry': [{'changes': [{'value': {
+        'messaging_product': 'whatsapp',
+        'contacts': [{'wa_id': '15551234567', 'profile': {'name': 'John'}}],
+        'messages': [{'from': phone, 'id': wa_id, 'timestamp': '1714560000', 'type': 'text', 'text': {'body': body}}
+                     for wa_id, phone, body in messages],
+        'statuses': [{'id': wa_id, 'status': status, 'timestamp': '1714560001'} for wa_id, status in statuses],
+    }}]}]}
+
+
+@pytest.fixture
+def ingestor(app, ruler_nlp, monkeypatch):
+    Patient(email='john@example.com', phone='+15551234567').insert()
+    instance = MessageIngestor(app, batch_size=10, service=ReductionService(nlp=ruler_nlp, cache=None),
+                               background=False)
+    monkeypatch.setattr(ingestion, '_ingestor', instance)
+    return instance
+
+
+@pytest.fixture
+def webhook_client(app, ingestor):
+    from routes.webhook_routes import webhooks
+    app.register_blueprint(webhooks)
+    return app.test_client()
+
+
+class TestIngestion:
+
+    def test_parse_whatsapp_keeps_only_what_is_stored(self):
+        payload = whatsapp_payload([('wamid.1', '15551234567', 'Hi')], [('wamid.0', 'read'), ('wamid.0', 'deleted')])
+        payload['entry'][0]['changes'][0]['value']['messages'].append(
+            {'from': '15551234567', 'id': 'wamid.2', 'timestamp': '1714560000', 'type': 'image',
+             'image': {'id': 'media-1', 'caption': 'Rash on my arm'}})
+        messages, statuses = ingestion.parse_whatsapp(payload)
+        assert [message.content for message in messages] == ['Hi', 'Rash on my arm']
+        assert messages[1].media_type == 'image'
+        assert messages[1].metadata == {'provider': 'whatsapp', 'type': 'image', 'media_id': 'media-1'}
+        assert statuses == [StatusUpdate('wamid.0', 'read')]
+
+    def test_parse_whatsapp_skips_malformed_items(self):
+        payload = whatsapp_payload([('wamid.1', '15551234567', 'Hi')], [('wamid.0', 'read')])
+        value = payload['entry'][0]['changes'][0]['value']
+        value['messages'] += ['wamid.2', {'from': '15551234567', 'id': ['wamid.3'], 'type': 'text'},
+                              {'from': '15551234567', 'id': 'wamid.4', 'type': 'text', 'text': 'Not a dict'}]
+        value['statuses'] += [None, {'id': 'wamid.5', 'status': ['read']}]
+        payload['entry'][0]['changes'] += ['change', {'value': 'value'}, {'value': {'messages': 'Hi'}}]
+        payload['entry'] += [42, {'changes': {'value': {}}}]
+
+        messages, statuses = ingestion.parse_whatsapp(payload)
+        assert [(message.wa_id, message.content) for message in messages] == [('wamid.1', 'Hi'), ('wamid.4', None)]
+        assert statuses == [StatusUpdate('wamid.0', 'read')]
+        assert ingestion.parse_whatsapp({'entry': 'everything'}) == ([], [])
+
+    def test_messages_are_redacted_and_stored(self, app, ingestor):
+        accepted = ingestor.submit(ingestion.parse_whatsapp(whatsapp_payload([
+            ('wamid.1', '15551234567', 'John here, email me at john@example.com'),
+            ('wamid.2', '15551234567', 'See you in Berlin'),
+            ('wamid.3', '15559999999', 'Unknown sender'),
+        ]))[0])
+        assert accepted == 3
+        stored = Message.query.order_by(Message.id).all()
+        assert [message.content for message in stored] == [
+            '[Redacted PII] here, email me at [REDACTED EMAIL]', 'See you in [Redacted PII]']
+        assert {message.patient_id for message in stored} == {1}
+        assert stored[0].sender == 'patient' and stored[0].messenger == 'WhatsApp'
+        assert ingestor.stats()['unmatched'] == 1
+
+        # A skipped message isn't remembered, so its redelivery is stored once the sender is registered.
+        Patient(email='new@example.com', phone='+15559999999').insert()
+        assert ingestor.submit(ingestion.parse_whatsapp(whatsapp_payload([
+            ('wamid.3', '15559999999', 'Unknown sender')]))[0]) == 1
+        assert Message.query.filter_by(wa_id='wamid.3').one().content == 'Unknown sender'
+
+    def test_redeliveries_are_dropped(self, app, ingestor):
+        message = IncomingMessage('wamid.1', '15551234567', 'Hello', ingestion._utc(0), 'WhatsApp')
+        assert ingestor.submit([message, message]) == 1
+        # A new process has no memory of the id, the stored row still deduplicates it.
+        ingestor._seen.clear()
+        assert ingestor.submit([message]) == 1
+        assert Message.query.count() == 1
+        assert ingestor.stats()['duplicates'] == 2
+
+    def test_unredactable_content_is_not_stored(self, app, ingestor, monkeypatch):
+        message = IncomingMessage('wamid.1', '15551234567', 'John', ingestion._utc(0), 'WhatsApp')
+        with monkeypatch.context() as patch:
+            patch.setattr(ingestor.service, 'hybrid_redact_many',
+                          lambda texts, batch_size: [{'success': False, 'error': 'boom'} for _ in texts])
+            ingestor.submit([message])
+        assert Message.query.count() == 0
+        assert ingestor.stats()['failed'] == 1
+
+        # The provider's redelivery is redacted again instead of being dropped as a duplicate.
+        assert ingestor.submit([message]) == 1
+        assert Message.query.one().content == '[Redacted PII]'
+
+    def test_status_updates_only_touch_the_status_column(self, app, ingestor):
+        ingestor.submit([IncomingMessage('wamid.1', '15551234567', 'Hello', ingestion._utc(0), 'WhatsApp')])
+        statements = []
+        from sqlalchemy import event
+        event.listen(db.engine, 'before_cursor_execute', lambda *args: statements.append(args[2]))
+        ingestor.submit(statuses=[StatusUpdate('wamid.1', 'delivered'), StatusUpdate('wamid.1', 'read')])
+        ingestor.submit(statuses=[StatusUpdate('wamid.1', 'delivered')])
+        updates = [statement for statement in statements if statement.startswith('UPDATE')]
+        assert updates and all(statement.startswith('UPDATE messages SET status=') for statement in updates)
+        db.session.expire_all()
+        # The late 'delivered' does not replace 'read'.
+        assert Message.query.one().status == 'read'
+
+    def test_background_batches_flush_on_time(self, app, ingestor):
+        ingestor.background, ingestor.max_delay = True, 0.05
+        # The in-memory database has one connection; the writer thread needs it free.
+        db.session.rollback()
+        ingestor.submit([IncomingMessage(f'wamid.{n}', '15551234567', 'Hi', ingestion._utc(0), 'WhatsApp')
+                         for n in range(3)])
+        deadline = time.monotonic() + 5
+        while ingestor.stats()['stored'] < 3 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        ingestor.stop(timeout=5)
+        assert ingestor.stats()['stored'] == 3
+        assert ingestor.stats()['batches'] == 1
+        assert 'latency_p50' in ingestor.stats()
+
+    def test_whatsapp_webhook(self, app, webhook_client):
+        app.config.update(WHATSAPP_APP_SECRET='app-secret', WHATSAPP_VERIFY_TOKEN='verify-me')
+        body = json.dumps(whatsapp_payload([('wamid.1', '15551234567', 'Hello')])).encode()
+        signature = 'sha256=' + hmac.new(b'app-secret', body, hashlib.sha256).hexdigest()
+        response = webhook_client.post('/webhooks/whatsapp', data=body, content_type='application/json',
+                                       headers={'X-Hub-Signature-256': signature})
+        assert response.status_code == 200 and response.get_json()['accepted'] == 1
+        assert webhook_client.post('/webhooks/whatsapp', data=body, content_type='application/json',
+                                   headers={'X-Hub-Signature-256': 'sha256=0'}).status_code == 401
+        challenge = webhook_client.get('/webhooks/whatsapp?hub.mode=subscribe&hub.verify_token=verify-me'
+                                       '&hub.challenge=42')
+        assert challenge.status_code == 200 and challenge.data == b'42'
+        assert Message.query.count() == 1
+
+    def test_sms_webhook(self, app, webhook_client):
+        app.config.update(TWILIO_AUTH_TOKEN='twilio-token')
+
+        def post(form):
+            signed = 'http://localhost/webhooks/sms' + ''.join(f'{key}{form[key]}' for key in sorted(form))
+            signature = base64.b64encode(hmac.new(b'twilio-token', signed.encode(), hashlib.sha1).digest()).decode()
+            return webhook_client.post('/webhooks/sms', data=form, headers={'X-Twilio-Signature': signature})
+
+        assert post({'MessageSid': 'SM1', 'From': '+15551234567', 'Body': 'Call me', 'SmsStatus': 'received'}
+                    ).status_code == 200
+        assert post({'MessageSid': 'SM1', 'MessageStatus': 'undelivered'}).status_code == 200
+        message = Message.query.one()
+        assert (message.messenger, message.content, message.status) == ('SMS', 'Call me', 'failed')
+        assert webhook_client.post('/webhooks/sms', data={'MessageSid': 'SM2'}).status_code == 401
+
+    def test_webhooks_without_a_secret_are_refused(self, app, webhook_client):
+        body = whatsapp_payload([('wamid.1', '15551234567', 'Forged')])
+        assert webhook_client.post('/webhooks/whatsapp', json=body).status_code == 503
+        assert webhook_client.post('/webhooks/sms', data={'MessageSid': 'SM1', 'From': '+15551234567',
+                                                         'Body': 'Forged'}).status_code == 503
+        assert Message.query.count() == 0
+
+        app.config.update(WEBHOOK_ALLOW_UNSIGNED=True)
+        assert webhook_client.post('/webhooks/whatsapp', json=body).status_code == 200
+        assert Message.query.count() == 1
+
+    def test_full_queue_asks_the_provider_to_retry(self, app, webhook_client, ingestor, monkeypatch):
+        app.config.update(WEBHOOK_ALLOW_UNSIGNED=True)
+        def full(*args, **kwargs):
+            raise ingestion.IngestionQueueFull()
+        monkeypatch.setattr(ingestor, 'submit', full)
+        response = webhook_client.post('/webhooks/whatsapp', json=whatsapp_payload())
+        assert response.status_code == 503 and response.headers['Retry-After'] == '5'
@@ -0,0 +1,147 @@
+import base64
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+import rsa
+from jose import jwt
+
+from extensions.auth.jwks import JWKSCache, verify_token
+
+AUDIENCE = 'telemed-api'
+ISSUER = 'https://tenant.example.com/'
+
+
+def b64(number):
+    data = number.to_bytes((number.bit_length() + 7) // 8, 'big')
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode()
+
+
+def make_key(kid):
+    public, private = rsa.newkeys(1024)
+    jwk = {'kty': 'RSA', 'kid': kid, 'use': 'sig', 'alg': 'RS256', 'n': b64(public.n), 'e': b64(public.e)}
+    return jwk, private.save_pkcs1().decode()
+
+
+def make_token(kid, private_pem):
+    claims = {'sub': 'auth0|1', 'aud': AUDIENCE, 'iss': ISSUER, 'permissions': ['get:redaction']}
+    return jwt.encode(claims, private_pem, algorithm='RS256', headers={'kid': kid})
+
+
+@pytest.fixture
+def jwks_server():
+    """A stand-in identity provider serving `server.jwks` and counting requests."""
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            server.requests += 1
+            body = json.dumps(server.jwks).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(('127.0.0.1', 0), Handler)
+    server.requests = 0
+    server.jwks = {'keys': []}
+    server.url = f'http://127.0.0.1:{server.server_port}/.well-known/jwks.json'
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+class TestJWKSCache:
+    def test_keys_are_fetched_once(self, jwks_server):
+        jwk, private_pem = make_key('k1')
+        jwks_server.jwks = {'keys': [jwk]}
+        cache = JWKSCache(jwks_server.url)
+        token = make_token('k1', private_pem)
+
+        for _ in range(1000):
+            claims = verify_token(token, cache, algorithms=['RS256'], audience=AUDIENCE, issuer=ISSUER)
+        assert claims['sub'] == 'auth0|1'
+        assert jwks_server.requests == 1
+
+    def test_unknown_kid_forces_one_refetch(self, jwks_server):
+        old_jwk, _ = make_key('k1')
+        new_jwk, new_private_pem = make_key('k2')
+        jwks_server.jwks = {'keys': [old_jwk]}
+        cache = JWKSCache(jwks_server.url, min_refetch_interval=0)
+        assert cache.get_key('k1') is not None
+
+        # The provider rotates its keys.
+        jwks_server.jwks = {'keys': [new_jwk]}
+        token = make_token('k2', new_private_pem)
+        assert verify_token(token, cache, algorithms=['RS256'], audience=AUDIENCE, issuer=ISSUER)['sub'] == 'auth0|1'
+        assert verify_token(token, cache, algorithms=['RS256'], audience=AUDIENCE, issuer=ISSUER)['sub'] == 'auth0|1'
+        assert jwks_server.requests == 2
+
+    def test_unknown_kid_refetch_is_rate_limited(self, jwks_server):
+        jwk, _ = make_key('k1')
+        jwks_server.jwks = {'keys': [jwk]}
+        cache = JWKSCache(jwks_server.url, min_refetch_interval=60)
+
+        for _ in range(100):
+            assert cache.get_key('made-up') is None
+        assert jwks_server.requests == 1
+
+    def test_expired_keys_are_refetched(self, jwks_server):
+        now = [0.0]
+        jwk, _ = make_key('k1')
+        jwks_server.jwks = {'keys': [jwk]}
+        cache = JWKSCache(jwks_server.url, ttl=600, clock=lambda: now[0])
+
+        cache.get_key('k1')
+        now[0] = 599
+        cache.get_key('k1')
+        assert jwks_server.requests == 1
+        now[0] = 600
+        cache.get_key('k1')
+        assert jwks_server.requests == 2
+
+    def test_background_refresh(self, jwks_server):
+        jwk, _ = make_key('k1')
+        jwks_server.jwks = {'keys': [jwk]}
+        cache = JWKSCache(jwks_server.url)
+        cache.start(interval=0.05)
+        try:
+            for _ in range(100):
+                if jwks_server.requests >= 2:
+                    break
+                threading.Event().wait(0.05)
+        finally:
+            cache.stop()
+        assert jwks_server.requests >= 2
+        assert cache.get_key('k1') is not None
+
+    def test_background_refresh_survives_failed_fetches(self, jwks_server):
+        jwk, _ = make_key('k1')
+        jwks_server.jwks = {'keys': [jwk]}
+        cache = JWKSCache(jwks_server.url)
+        fetch, calls = cache._fetch, []
+
+        def flaky_fetch():
+            # The provider is unreachable for the first fetches, before any key is cached.
+            calls.append(None)
+            if len(calls) <= 2:
+                raise ConnectionRefusedError("Connection refused")
+            return fetch()
+
+        cache._fetch = flaky_fetch
+        cache.start(interval=0.05)
+        try:
+            for _ in range(100):
+                if jwks_server.requests >= 1:
+                    break
+                threading.Event().wait(0.05)
+            assert cache._thread.is_alive()
+        finally:
+            cache.stop()
+        assert len(calls) >= 3 and jwks_server.requests >= 1
+        assert cache.get_key('k1') is not None
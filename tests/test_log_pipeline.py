@@ -0,0 +1,140 @@
+import json
+import logging
+import queue
+
+import pytest
+
+from extensions.log_pipeline import LogPipeline, NonBlockingQueueHandler, RateLimitFilter, scrub_text
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def record(name='services.redaction', level=logging.INFO, msg='hello'):
+    return logging.LogRecord(name, level, __file__, 1, msg, None, None)
+
+
+@pytest.fixture
+def pipeline(tmp_path):
+    """A pipeline writing to a temporary file, attached to its own logger instead of the root logger."""
+    logger = logging.getLogger('tests.log_pipeline')
+    logger.propagate = False
+    pipelines = []
+
+    def make(**options):
+        options.setdefault('path', str(tmp_path / 'app.log'))
+        options.setdefault('console', False)
+        started = LogPipeline(**options).start(logger)
+        pipelines.append(started)
+        return started, logger
+    yield make
+    for started in pipelines:
+        started.stop()
+
+
+def read_lines(path):
+    return [json.loads(line) for line in path.read_text().splitlines()]
+
+
+class TestScrubbing:
+    def test_credentials_and_pii_are_masked(self):
+        assert scrub_text("User json {'username': 'bob', 'password': 'hunter2'}") == \
+            "User json {'username': 'bob', 'password': ***}"
+        assert 'hunter 2' not in scrub_text("ImmutableMultiDict([('username', 'bob'), ('password', 'hunter 2')])")
+        assert scrub_text('Authorization: Bearer eyJ.abc.def') == 'Authorization: *** ***'
+        assert scrub_text('Mail bob@example.com or 555-123-4567') == \
+            'Mail [REDACTED EMAIL] or [REDACTED PHONE]'
+        assert scrub_text('Token decoding error: Signature has expired') == \
+            'Token decoding error: Signature has expired'
+
+    def test_records_are_scrubbed_before_formatting(self, pipeline, tmp_path):
+        started, logger = pipeline()
+        logger.info('Login %s', {'username': 'bob', 'password': 'hunter2'},
+                    extra={'api_key': 'abc', 'payload': {'token': 'xyz', 'to': 'bob@example.com'}})
+        try:
+            raise ValueError('bad value for alice@example.com')
+        except ValueError:
+            logger.exception('Failed')
+        assert started.flush()
+
+        login, failure = read_lines(tmp_path / 'app.log')
+        assert 'hunter2' not in login['message']
+        assert login['api_key'] == '***'
+        assert login['payload'] == {'token': '***', 'to': '[REDACTED EMAIL]'}
+        assert 'alice@example.com' not in failure['exc_info'] and 'ValueError' in failure['exc_info']
+
+
+class TestRateLimit:
+    def test_token_bucket_per_logger(self):
+        clock = FakeClock()
+        limit = RateLimitFilter(rate=2, burst=3, clock=clock)
+        assert [limit.filter(record()) for _ in range(4)] == [True, True, True, False]
+        assert limit.filter(record('other'))
+        assert limit.filter(record(level=logging.WARNING))
+        clock.now = 1.0
+        assert [limit.filter(record()) for _ in range(3)] == [True, True, False]
+        assert limit.dropped == {'services.redaction': 2}
+
+    def test_sampling_only_applies_to_listed_loggers(self):
+        draws = iter([0.1, 0.9, 0.3, 0.7])
+        limit = RateLimitFilter(sample_rate=0.5, sampled=['services.redaction'], rng=lambda: next(draws))
+        kept = [limit.filter(record('services.redaction.jobs')) for _ in range(4)]
+        assert kept == [True, False, True, False]
+        assert limit.filter(record('routes'))
+        assert limit.filter(record('services.redaction', level=logging.ERROR))
+
+
+class TestPipeline:
+    def test_full_queue_drops_without_blocking(self):
+        handler = NonBlockingQueueHandler(queue.Queue(maxsize=1))
+        for number in range(5):
+            handler.handle(record(msg=f'message {number}'))
+        assert handler.queue.get_nowait().msg == 'message 0'
+        assert handler.dropped == 4
+
+    def test_file_is_rotated_by_size(self, pipeline, tmp_path):
+        started, logger = pipeline(max_bytes=2000, backup_count=2)
+        for number in range(100):
+            logger.info(f'message number {number}')
+        assert started.flush()
+        assert (tmp_path / 'app.log.1').exists() and (tmp_path / 'app.log.2').exists()
+        assert not (tmp_path / 'app.log.3').exists()
+        assert read_lines(tmp_path / 'app.log')[-1]['message'] == 'message number 99'
+
+    def test_level_filters_before_the_queue(self, pipeline, tmp_path):
+        started, logger = pipeline(level='INFO')
+        logger.debug('hidden')
+        logger.info('shown')
+        assert started.flush()
+        assert [line['message'] for line in read_lines(tmp_path / 'app.log')] == ['shown']
+
+    def test_stop_detaches_and_writes_pending_records(self, pipeline, tmp_path):
+        started, logger = pipeline()
+        logger.info('last words')
+        started.stop()
+        assert started.handler not in logger.handlers
+        assert read_lines(tmp_path / 'app.log')[0]['message'] == 'last words'
+
+
+class TestLoginLogging:
+    def test_login_never_logs_the_password(self, app, client, pipeline, tmp_path, monkeypatch):
+        from models.user import User
+        started, logger = pipeline()
+        # Route logging goes to the root logger; send it through the test pipeline instead.
+        monkeypatch.setattr(logging, 'root', logger)
+        monkeypatch.setenv('SECRET_KEY', 'test-secret')
+        user = User(username='bob', role='admin', permissions='get:redaction')
+        user.set_password('hunter2')
+        user.insert()
+
+        assert client.post('/login', json={'username': 'bob', 'password': 'hunter2'}).status_code == 200
+        client.post('/login', data={'username': 'bob', 'password': 'wrong-one'})
+        assert started.flush()
+        text = (tmp_path / 'app.log').read_text()
+        assert 'bob attempting to log in' in text
+        assert 'hunter2' not in text and 'wrong-one' not in text
@@ -0,0 +1,142 @@
+import json
+import re
+import threading
+import time
+from urllib.parse import unquote
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from extensions.auth.management import ManagementClient, make_session
+
+
+@pytest.fixture
+def auth0_server():
+    """A stand-in for the Auth0 token endpoint and the users part of the Management API."""
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'  # keep-alive
+
+        def reply(self, status, body=None):
+            data = json.dumps(body).encode() if body is not None else b''
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def handle_api(self, method):
+            with server.lock:
+                server.connections.add(self.client_address)
+                server.active += 1
+                server.max_active = max(server.max_active, server.active)
+            try:
+                length = int(self.headers.get('Content-Length') or 0)
+                self.rfile.read(length)
+                if self.path == '/oauth/token':
+                    server.oauth_requests += 1
+                    if server.token_failures:
+                        server.token_failures -= 1
+                        return self.reply(503, {'error': 'unavailable'})
+                    server.token_requests += 1
+                    return self.reply(200, {'access_token': f'token-{server.token_requests}', 'expires_in': 86400})
+                if server.failures:
+                    server.failures -= 1
+                    return self.reply(503, {'error': 'unavailable'})
+                if self.headers['authorization'] not in server.valid_tokens():
+                    return self.reply(401, {'error': 'invalid token'})
+                time.sleep(server.delay)
+                user = re.match(r'/api/v2/users/([^/]+)(/roles)?$', self.path)
+                if method == 'GET':
+                    return self.reply(200, {'user_id': unquote(user.group(1))})
+                return self.reply(204)
+            finally:
+                with server.lock:
+                    server.active -= 1
+
+        def do_GET(self):
+            self.handle_api('GET')
+
+        def do_POST(self):
+            self.handle_api('POST')
+
+        def do_DELETE(self):
+            self.handle_api('DELETE')
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.lock = threading.Lock()
+    server.connections = set()
+    server.active = server.max_active = 0
+    server.token_requests = server.oauth_requests = 0
+    server.failures = server.token_failures = 0
+    server.delay = 0
+    server.valid_tokens = lambda: {f'Bearer token-{server.token_requests}'}
+    server.url = f'http://127.0.0.1:{server.server_port}'
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def make_client(server, **kwargs):
+    kwargs.setdefault('session', make_session(backoff=0))
+    return ManagementClient('tenant.example.com', 'client-id', 'client-secret', base_url=server.url, **kwargs)
+
+
+class TestManagementClient:
+    def test_token_and_connection_are_reused(self, auth0_server):
+        client = make_client(auth0_server)
+        for number in range(20):
+            assert client.get_user(f'auth0|{number}') == {'user_id': f'auth0|{number}'}
+        assert auth0_server.token_requests == 1
+        assert len(auth0_server.connections) == 1
+
+    def test_token_is_renewed_before_it_expires(self, auth0_server):
+        now = [0.0]
+        client = make_client(auth0_server, expiry_margin=60, clock=lambda: now[0])
+        client.get_user('auth0|1')
+        now[0] = 86400 - 61
+        client.get_user('auth0|1')
+        assert auth0_server.token_requests == 1
+        now[0] = 86400 - 60
+        client.get_user('auth0|1')
+        assert auth0_server.token_requests == 2
+
+    def test_revoked_token_is_replaced(self, auth0_server):
+        client = make_client(auth0_server)
+        client.get_user('auth0|1')
+        auth0_server.valid_tokens = lambda: {'Bearer token-2'}
+        assert client.get_user('auth0|1') == {'user_id': 'auth0|1'}
+        assert auth0_server.token_requests == 2
+
+    def test_transient_errors_are_retried(self, auth0_server):
+        client = make_client(auth0_server)
+        auth0_server.failures = 2
+        assert client.delete_user('auth0|1').status_code == 204
+
+    def test_code_exchange_is_never_retried(self, auth0_server):
+        client = make_client(auth0_server)
+        auth0_server.token_failures = 1
+        # Resending a single-use code would only get invalid_grant back and hide this response.
+        assert client.exchange_code('code-1', 'https://app.example.com/callback') == {'error': 'unavailable'}
+        assert auth0_server.oauth_requests == 1
+
+        # The client-credentials token request is still retried.
+        auth0_server.token_failures = 1
+        assert client.get_user('auth0|1') == {'user_id': 'auth0|1'}
+        assert auth0_server.oauth_requests == 3
+
+    def test_bulk_calls_are_bounded(self, auth0_server):
+        client = make_client(auth0_server)
+        auth0_server.delay = 0.01
+        user_ids = [f'auth0|{number}' for number in range(40)]
+
+        users = client.get_users(user_ids, max_workers=4)
+        assert list(users) == user_ids
+        assert users['auth0|7'] == {'user_id': 'auth0|7'}
+        assert client.add_roles(user_ids, 'rol_patient', max_workers=4) == {user_id: 204 for user_id in user_ids}
+        assert auth0_server.max_active <= 4
+        assert auth0_server.token_requests == 1
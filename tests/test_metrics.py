@@ -0,0 +1,84 @@
+import pytest
+
+from services import metrics as metrics_module
+from services.metrics import Histogram, Metrics
+from services.redaction import ReductionService
+
+
+@pytest.fixture
+def metrics(monkeypatch):
+    instance = Metrics()
+    monkeypatch.setattr(metrics_module, '_metrics', instance)
+    return instance
+
+
+class TestHistogram:
+    def test_quantiles_are_interpolated_within_buckets(self):
+        histogram = Histogram('latency', 'Latency.', (1, 2, 4))
+        for value in (0.5, 1.5, 1.5, 3, 3, 3, 3, 3, 3, 10):
+            histogram.observe(value)
+        assert histogram.count() == 10
+        assert histogram.quantile(0.1) == pytest.approx(1.0)
+        assert histogram.quantile(0.5) == pytest.approx(2 + 2 * 2 / 6)
+        # The slowest value is past the last bucket, so the estimate stops at its bound.
+        assert histogram.quantile(0.99) == 4.0
+        assert Histogram('empty', 'Empty.', (1,)).quantile(0.5) is None
+
+    def test_prometheus_text_format(self):
+        histogram = Histogram('telemed_stage_duration_seconds', 'Stage time.', (0.1, 1), ('stage',))
+        histogram.observe(0.05, ('auth.token',))
+        histogram.observe(0.5, ('auth.token',))
+        lines = histogram.render()
+        assert lines[:2] == ['# HELP telemed_stage_duration_seconds Stage time.',
+                             '# TYPE telemed_stage_duration_seconds histogram']
+        assert 'telemed_stage_duration_seconds_bucket{stage="auth.token",le="0.1"} 1' in lines
+        assert 'telemed_stage_duration_seconds_bucket{stage="auth.token",le="+Inf"} 2' in lines
+        assert 'telemed_stage_duration_seconds_sum{stage="auth.token"} 0.55' in lines
+        assert 'telemed_stage_duration_seconds_count{stage="auth.token"} 2' in lines
+        assert any(line.startswith('telemed_stage_duration_seconds_quantile{stage="auth.token",quantile="0.95"}')
+                   for line in lines)
+
+
+class TestStageMetrics:
+    def test_hybrid_redaction_records_every_stage(self, ruler_nlp, metrics):
+        service = ReductionService(nlp=ruler_nlp, cache=None)
+        service.hybrid_redact("John moved to Berlin, write to john@example.com")
+        service.redact_with_regex("call 555-123-4567")
+        service.redact_with_nlp("Jane Smith")
+
+        for stage in ('hybrid', 'hybrid.regex', 'hybrid.ner', 'regex', 'ner'):
+            assert metrics.stage_seconds.count((stage,)) == 1, stage
+        assert metrics.input_chars.count(('hybrid',)) == 1
+        text = metrics.render()
+        assert 'telemed_redaction_entities_sum{method="hybrid",source="ner"} 2.0' in text
+        assert 'telemed_redaction_entities_sum{method="hybrid",source="regex"} 1.0' in text
+        assert metrics.entities.count(('ner', 'regex')) == 0
+
+    def test_disabled_and_sampled_metrics(self, ruler_nlp, monkeypatch):
+        service = ReductionService(nlp=ruler_nlp, cache=None)
+        disabled = Metrics(enabled=False)
+        monkeypatch.setattr(metrics_module, '_metrics', disabled)
+        service.hybrid_redact("John")
+        assert '_count' not in disabled.render()
+
+        sampled = Metrics(sample_every=4)
+        monkeypatch.setattr(metrics_module, '_metrics', sampled)
+        for _ in range(8):
+            service.redact_with_regex("call 555-123-4567")
+        assert sampled.stage_seconds.count(('regex',)) == sampled.input_chars.count(('regex',)) == 2
+
+    def test_token_required_stages_and_metrics_route(self, client, auth_headers, metrics):
+        headers = auth_headers('get:patients')
+        assert client.get('/patients', headers=headers).status_code == 200
+        assert client.get('/patients', headers=headers).status_code == 200
+
+        response = client.get('/metrics')
+        assert response.status_code == 200
+        assert response.mimetype == 'text/plain'
+        assert 'telemed_stage_duration_seconds_count{stage="auth.token"} 2' in response.text
+        assert 'telemed_stage_duration_seconds_count{stage="auth.user"} 2' in response.text
+
+    def test_metrics_token(self, app, client, metrics):
+        app.config['METRICS_TOKEN'] = 'scrape-me'
+        assert client.get('/metrics').status_code == 401
+        assert client.get('/metrics', headers={'Authorization': 'Bearer scrape-me'}).status_code == 200
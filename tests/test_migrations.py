@@ -0,0 +1,47 @@
+import os
+import subprocess
+import sys
+
+import sqlalchemy as sa
+from alembic.autogenerate import compare_metadata
+from alembic.migration import MigrationContext
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def flask(*args, database_url, log_file):
+    """Runs `flask ...` against the given database, the way a deployment would."""
+    env = dict(os.environ, PYTHONPATH=ROOT, DATABASE_URL=database_url, LOG_FILE=str(log_file))
+    env.pop("SECURE_DATABASE_URL", None)
+    env.pop("VAULT_DATABASE_URL", None)
+    result = subprocess.run([sys.executable, "-m", "flask", "--app", "app", *args], cwd=ROOT, env=env,
+                            capture_output=True, text=True, timeout=120)
+    assert result.returncode == 0, result.stderr
+
+
+def flask_db(*args, database_url, log_file):
+    flask("db", *args, database_url=database_url, log_file=log_file)
+
+
+class TestMigrations:
+    def test_upgrade_builds_the_schema_of_the_models_from_scratch(self, tmp_path):
+        from extensions.database import db
+        import models.language, models.message, models.patient, models.user  # noqa: F401 (register the tables)
+
+        url = f"sqlite:///{tmp_path / 'fresh.db'}"
+        flask_db("upgrade", database_url=url, log_file=tmp_path / "app.log")
+
+        engine = sa.create_engine(url)
+        with engine.connect() as connection:
+            context = MigrationContext.configure(connection, opts={"compare_type": True})
+            assert compare_metadata(context, db.metadata) == []
+
+        flask_db("downgrade", "base", database_url=url, log_file=tmp_path / "app.log")
+        assert sa.inspect(engine).get_table_names() == ["alembic_version"]
+
+    def test_autogenerate_leaves_the_vault_table_alone(self, tmp_path):
+        url = f"sqlite:///{tmp_path / 'app.db'}"
+        flask_db("upgrade", database_url=url, log_file=tmp_path / "app.log")
+        # Without VAULT_DATABASE_URL the vault table is created in the main database.
+        flask("create-vault", database_url=url, log_file=tmp_path / "app.log")
+        flask_db("check", database_url=url, log_file=tmp_path / "app.log")
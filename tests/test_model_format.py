@@ -0,0 +1,68 @@
+from datetime import datetime
+
+import pytest
+from sqlalchemy import func, select
+
+from extensions.database import db
+from models.language import Language
+from models.message import Message
+from models.patient import Patient
+from models.user import User
+
+
+@pytest.fixture
+def messages(app):
+    patient = Patient(email='patient@example.com')
+    db.session.add(patient)
+    db.session.flush()
+    db.session.add_all([
+        Message(phone='+100', patient_id=patient.id, sender='patient', content=f'Message {number}',
+                timestamp=datetime(2024, 5, 1, 12, number), msg_metadata={'n': number})
+        for number in range(3)
+    ])
+    db.session.commit()
+    return Message.query.order_by(Message.id).all()
+
+
+class TestCRUDMixinFormat:
+
+    def test_format_serializes_every_column(self, app, messages):
+        row = messages[0].format()
+        assert list(row) == [column.key for column in Message.__table__.columns]
+        assert row['timestamp'] == '2024-05-01T12:00:00'
+        assert row['msg_metadata'] == {'n': 0}
+        assert row['media_type'] is None
+
+    def test_format_does_not_depend_on_loaded_attributes(self, app, messages):
+        message = messages[0]
+        db.session.expire(message)
+        assert message.format()['content'] == 'Message 0'
+        # A loaded relationship is not a column and stays out.
+        message.patient
+        assert 'patient' not in message.format()
+
+    def test_only_and_exclude(self, app, messages):
+        assert messages[1].format(only=['id', 'content']) == {'id': messages[1].id, 'content': 'Message 1'}
+        assert 'msg_metadata' not in messages[1].format(exclude=('msg_metadata',))
+        assert messages[1].format(only='content') == {'content': 'Message 1'}
+
+    def test_format_rows_matches_format_for_column_queries(self, app, messages):
+        rows = db.session.execute(select(Message.id, Message.content, Message.timestamp).order_by(Message.id)).all()
+        expected = [message.format(only=('id', 'content', 'timestamp')) for message in messages]
+        assert Message.format_rows(rows) == expected
+        assert Message.format_rows(rows, exclude='content') == [
+            {'id': row['id'], 'timestamp': row['timestamp']} for row in expected]
+
+    def test_format_rows_handles_labels_and_instances(self, app, messages):
+        rows = db.session.execute(
+            select(Message.patient_id, func.max(Message.timestamp).label('latest')).group_by(Message.patient_id)).all()
+        assert Message.format_rows(rows) == [{'patient_id': messages[0].patient_id, 'latest': '2024-05-01T12:02:00'}]
+        assert Message.format_rows(messages, only=['id']) == [{'id': message.id} for message in messages]
+        assert Message.format_rows([]) == []
+
+    def test_other_models(self, app):
+        Language(name='English').insert()
+        assert Language.query.one().format() == {'id': 1, 'name': 'English'}
+        user = User(username='staff', role='admin', password_hash='x')
+        user.insert()
+        assert user.format(exclude=['password_hash'])['username'] == 'staff'
@@ -0,0 +1,77 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from extensions.database import db
+from models.message import Message
+from models.patient import Patient
+from routes.home_routes import dashboard_counts
+from services.pagination import CursorError, decode_cursor, encode_cursor
+
+
+@pytest.fixture
+def messages(app):
+    patients = [Patient(email=f'patient{number}@example.com', first_name=f'P{number}') for number in range(2)]
+    db.session.add_all(patients)
+    db.session.flush()
+    start = datetime(2025, 1, 1)
+    # Pairs of messages share a timestamp, so the id has to break ties.
+    db.session.add_all(
+        Message(phone='+1', patient_id=patients[number % 2].id, content=f'message {number}',
+                timestamp=start + timedelta(minutes=number // 2))
+        for number in range(25)
+    )
+    db.session.commit()
+    return patients
+
+
+def fetch_all(client, headers, url, key, param='cursor'):
+    items, cursor, pages = [], None, 0
+    while True:
+        response = client.get(url + (f'&{param}={cursor}' if cursor else ''), headers=headers)
+        assert response.status_code == 200
+        data = response.get_json()
+        items += data[key]
+        pages += 1
+        cursor = data['next_cursor']
+        if not cursor:
+            return items, pages
+
+
+class TestPagination:
+    def test_cursor_round_trip(self):
+        stamp = datetime(2025, 1, 1, 12, 30)
+        assert decode_cursor(encode_cursor(stamp, 7), (datetime, int)) == (stamp, 7)
+        with pytest.raises(CursorError):
+            decode_cursor('not-a-cursor', (datetime, int))
+
+    def test_messages_are_paged_newest_first(self, client, auth_headers, messages):
+        headers = auth_headers('get:messages')
+        items, pages = fetch_all(client, headers, '/messages?limit=10', 'messages')
+
+        assert pages == 3
+        expected = sorted(Message.query.all(), key=lambda message: (message.timestamp, message.id), reverse=True)
+        assert [item['id'] for item in items] == [message.id for message in expected]
+        assert set(items[0]) == {'id', 'patient_id', 'sender', 'content', 'timestamp', 'messenger', 'status',
+                                 'is_read_by_admin'}
+
+    def test_messages_of_one_patient(self, client, auth_headers, messages):
+        headers = auth_headers('get:messages')
+        items, _ = fetch_all(client, headers, f'/messages?limit=4&patient_id={messages[1].id}', 'messages')
+
+        assert len(items) == 12
+        assert {item['patient_id'] for item in items} == {messages[1].id}
+
+    def test_patients_are_paged_by_id(self, client, auth_headers, messages):
+        items, pages = fetch_all(client, auth_headers('get:patients'), '/patients?limit=1', 'patients')
+        assert [item['id'] for item in items] == [patient.id for patient in messages]
+        assert 'email' not in items[0]
+
+    def test_bad_cursor_and_permission(self, client, auth_headers, messages):
+        headers = auth_headers('get:messages')
+        assert client.get('/messages?cursor=bogus', headers=headers).status_code == 400
+        assert client.get('/patients', headers=headers).status_code == 403
+
+    def test_dashboard_counts(self, client, messages):
+        assert tuple(dashboard_counts()) == (2, 0, 25)
+        assert client.get('/').status_code == 200
@@ -0,0 +1,114 @@
+import pytest
+import spacy
+
+from models.patient import Patient
+from services import patient_dictionary as dictionary_module
+from services.patient_dictionary import PatientDictionary
+from services.redaction import ReductionService
+
+
+def found(dictionary, text):
+    return [(text[span.start:span.end], span.label) for span in sorted(dictionary.spans(text))]
+
+
+@pytest.fixture
+def dictionary():
+    instance = PatientDictionary()
+    instance.loaded = True
+    instance.set_patient(1, {'first_name': 'Tonia', 'last_name': 'Russ', 'email': 'tonia@example.org',
+                             'phone': '+1 (555) 123-4567'})
+    instance.set_patient(2, {'first_name': 'Jane', 'last_name': 'Smith'})
+    return instance
+
+
+@pytest.fixture
+def loaded(app, monkeypatch):
+    """A process-wide dictionary loaded from the test database, as `init_app` sets it up."""
+    instance = PatientDictionary()
+    monkeypatch.setattr(dictionary_module, '_dictionary', instance)
+    return instance
+
+
+class TestMatching:
+    def test_longest_known_name_wins(self, dictionary):
+        assert found(dictionary, "Jane Smith met Jane and Russ's sister, then Tonia Russ.") == [
+            ('Jane Smith', 'PERSON'), ('Jane', 'PERSON'), ('Russ', 'PERSON'), ('Tonia Russ', 'PERSON')]
+
+    def test_names_must_be_capitalized_unless_configured(self, dictionary):
+        assert found(dictionary, "the jane smith file") == []
+        dictionary.match_lowercase_names = True
+        assert found(dictionary, "the jane smith file") == [('jane smith', 'PERSON')]
+
+    def test_emails_and_phones_in_any_format(self, dictionary):
+        text = "Reach tonia@Example.ORG or 555.123.4567, not 555.123.9999 or other@example.org"
+        assert found(dictionary, text) == [('tonia@Example.ORG', 'EMAIL'), ('555.123.4567', 'PHONE')]
+
+    def test_each_phone_in_a_run_of_numbers_is_looked_up(self, dictionary):
+        # Space separated numbers form one run of digits and separators; only the known one is found.
+        assert found(dictionary, "Numbers: 5551234567 5559876543") == [('5551234567', 'PHONE')]
+        assert found(dictionary, "Numbers: 5559876543 5551234567") == [('5551234567', 'PHONE')]
+        assert found(dictionary, "Call +1 (555) 123-4567 or 555 987 6543") == [('+1 (555) 123-4567', 'PHONE')]
+        assert found(dictionary, "Call 555 987 6543 or (555) 123 4567") == [('(555) 123 4567', 'PHONE')]
+
+    def test_short_names_are_skipped(self):
+        instance = PatientDictionary(min_length=3)
+        instance.loaded = True
+        instance.set_patient(1, {'first_name': 'Al', 'last_name': 'Wu'})
+        assert found(instance, "Al Wu and Al") == [('Al Wu', 'PERSON')]
+
+    def test_shared_terms_are_reference_counted(self, dictionary):
+        dictionary.set_patient(3, {'first_name': 'Jane', 'last_name': 'Doe'})
+        dictionary.remove_patient(2)
+        assert found(dictionary, "Jane Smith") == [('Jane', 'PERSON')]
+        dictionary.remove_patient(3)
+        dictionary.remove_patient(1)
+        assert found(dictionary, "Jane Smith and Tonia") == []
+        assert dictionary._names == {} and len(dictionary) == 0
+
+
+class TestPatientHooks:
+    def test_loads_lazily_and_follows_crud_changes(self, loaded):
+        Patient(first_name='Tonia', last_name='Russ', email='tonia@example.org').insert()
+        assert not loaded.loaded
+        assert found(loaded, "Tonia called") == [('Tonia', 'PERSON')]
+
+        patient = Patient(first_name='Olga', last_name='Novak', email='olga@example.org').insert()
+        assert found(loaded, "Olga Novak") == [('Olga Novak', 'PERSON')]
+        patient.dict_update(last_name='Haddad')
+        assert found(loaded, "Olga Novak") == [('Olga', 'PERSON')]
+        assert found(loaded, "Olga Haddad") == [('Olga Haddad', 'PERSON')]
+        patient.delete()
+        assert found(loaded, "Olga Haddad") == []
+
+    def test_bulk_writes(self, loaded):
+        loaded.ensure_loaded()
+        Patient.bulk_insert([{'first_name': 'Priya', 'last_name': 'Patel', 'email': 'priya@example.org'}])
+        assert found(loaded, "Priya Patel") == [('Priya Patel', 'PERSON')]
+        patient = Patient.query.filter_by(email='priya@example.org').one()
+        # Bulk inserted rows are tracked by their real ids, so later changes replace their terms.
+        Patient.bulk_update([{'id': patient.id, 'notes': 'allergic to penicillin'}])
+        assert found(loaded, "Priya Patel") == [('Priya Patel', 'PERSON')]
+        Patient.bulk_update([{'id': patient.id, 'first_name': 'Maria'}])
+        assert found(loaded, "Priya Patel") == [('Patel', 'PERSON')]
+        patient.delete()
+        assert found(loaded, "Maria Patel") == []
+
+        # An upsert matched on email has no ids, so the dictionary reloads.
+        Patient(first_name='Olga', last_name='Novak', email='olga@example.org').insert()
+        Patient.bulk_upsert([{'email': 'olga@example.org', 'last_name': 'Haddad'}], index_elements=['email'])
+        assert found(loaded, "Olga Novak") == [('Olga', 'PERSON')]
+
+
+class TestHybridRedaction:
+    def test_dictionary_catches_names_ner_misses(self, dictionary):
+        service = ReductionService(nlp=spacy.blank("en"), cache=None, dictionary=dictionary)
+        assert service.hybrid_redact("Going to Indian with Tonia, ask Jane Smith at tonia@example.org") == \
+            "Going to Indian with [Redacted PII], ask [Redacted PII] at [REDACTED EMAIL]"
+        assert service.hybrid_redact_many(["Russ called"])[0]['final_reduct_text'] == "[Redacted PII] called"
+
+    def test_cached_plans_expire_when_the_dictionary_changes(self, dictionary):
+        from services.redaction_cache import RedactionCache
+        service = ReductionService(nlp=spacy.blank("en"), cache=RedactionCache(), dictionary=dictionary)
+        assert service.hybrid_redact("Ahmed called") == "Ahmed called"
+        dictionary.set_patient(4, {'first_name': 'Ahmed'})
+        assert service.hybrid_redact("Ahmed called") == "[Redacted PII] called"
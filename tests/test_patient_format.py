@@ -0,0 +1,67 @@
+from datetime import datetime, timezone
+
+import pytest
+from babel.dates import format_datetime
+from sqlalchemy import event, select
+
+from extensions.database import db
+from models.language import Language
+from models.patient import Patient, _long_datetime_formatter
+
+
+@pytest.fixture
+def patients(app):
+    english, german = Language(name='English'), Language(name='German')
+    rows = []
+    for number, tz in enumerate(['UTC', 'Europe/Berlin', 'America/New_York', 'Asia/Kolkata', 'Not/AZone']):
+        patient = Patient(email=f'patient{number}@example.com', tz=tz,
+                          created_at=datetime(2024, 3 + number, 10, 8, 30, tzinfo=timezone.utc))
+        patient.languages = [english, german][:number % 3]
+        rows.append(patient)
+    db.session.add_all(rows)
+    db.session.commit()
+    db.session.expunge_all()
+    return rows
+
+
+def count_queries():
+    statements = []
+    event.listen(db.engine, 'before_cursor_execute',
+                 lambda *args: args[2] != 'BEGIN' and statements.append(args[2]))
+    return statements
+
+
+class TestPatientFormat:
+
+    @pytest.mark.parametrize('locale', ['en_US', 'de_DE', 'fr_FR'])
+    @pytest.mark.parametrize('tz', ['UTC', 'Europe/Zurich', 'America/Los_Angeles', 'Australia/Adelaide'])
+    def test_long_formatter_matches_babel(self, locale, tz):
+        from zoneinfo import ZoneInfo
+        format_long = _long_datetime_formatter(locale)
+        for value in (datetime(2024, 1, 1, 0, 0, 1), datetime(2024, 7, 15, 23, 59, 59)):
+            local = value.replace(tzinfo=timezone.utc).astimezone(ZoneInfo(tz))
+            assert format_long(local) == format_datetime(local, format='long', locale=locale)
+
+    def test_format_many_matches_format(self, app, patients):
+        expected = [patient.format() for patient in Patient.query.order_by(Patient.id)]
+        db.session.expunge_all()
+        assert Patient.format_many(Patient.query.order_by(Patient.id)) == expected
+        db.session.expunge_all()
+        assert Patient.format_many(select(Patient).order_by(Patient.id)) == expected
+        # An unknown timezone falls back to the ISO timestamp.
+        unknown = next(row for row in expected if row['tz'] == 'Not/AZone')
+        assert unknown['created_at'].startswith('2024-07-10T08:30')
+
+    @pytest.mark.parametrize('source', ['query', 'select', 'list'])
+    def test_languages_load_in_one_query(self, app, patients, source):
+        listed = Patient.query.all() if source == 'list' else None
+        statements = count_queries()
+        if source == 'query':
+            rows = Patient.format_many(Patient.query)
+        elif source == 'select':
+            rows = Patient.format_many(select(Patient))
+        else:
+            rows = Patient.format_many(listed)
+        # One query for the patients and one for all their languages, however many patients there are.
+        assert len(statements) == 2
+        assert sorted(len(row['languages']) for row in rows) == [0, 0, 1, 1, 2]
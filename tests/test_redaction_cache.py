@@ -0,0 +1,60 @@
+from services.redaction import ReductionService
+from services.redaction_cache import RedactionCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestRedactionCache:
+    def test_lru_eviction(self):
+        cache = RedactionCache(max_entries=2)
+        cache.set("first", "v1", "a")
+        cache.set("second", "v1", "b")
+        assert cache.get("first", "v1") == "a"  # "second" is now the least recently used
+        cache.set("third", "v1", "c")
+
+        assert cache.get("second", "v1") is None
+        assert cache.get("third", "v1") == "c"
+        assert cache.stats()["evictions"] == 1
+
+    def test_ttl_expiry(self):
+        clock = FakeClock()
+        cache = RedactionCache(ttl=10, clock=clock)
+        cache.set("text", "v1", "value")
+        clock.now = 9.9
+        assert cache.get("text", "v1") == "value"
+        clock.now = 10
+        assert cache.get("text", "v1") is None
+        assert cache.stats()["expirations"] == 1
+
+    def test_version_change_drops_entries(self):
+        cache = RedactionCache()
+        cache.set("text", "model-a", "value")
+        assert cache.get("text", "model-b") is None
+        assert cache.get("text", "model-a") is None
+        assert cache.stats()["entries"] == 0
+
+    def test_keys_do_not_contain_the_text(self):
+        cache = RedactionCache(secret=b"secret")
+        text = "Call John at 9875673452"
+        cache.set(text, "v1", "value")
+
+        key = cache.key(text, "v1")
+        assert "John" not in key and "9875673452" not in key
+        assert key != RedactionCache(secret=b"other").key(text, "v1")
+        assert list(cache._entries) == [key]
+
+    def test_service_reuses_cached_plan(self, ruler_nlp):
+        cache = RedactionCache()
+        service = ReductionService(nlp=ruler_nlp, cache=cache)
+        text = "Contact John at john.doe@example.com"
+
+        first = service.hybrid_redact(text)
+        assert service.hybrid_redact(text) == first == "Contact [Redacted PII] at [REDACTED EMAIL]"
+        assert service.hybrid_redact_many([text])[0]['final_reduct_text'] == first
+        assert (cache.hits, cache.misses) == (2, 1)
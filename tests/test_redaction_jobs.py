@@ -0,0 +1,124 @@
+import logging
+import multiprocessing
+import time
+
+import pytest
+from flask import Flask
+
+from services import patient_dictionary as dictionary_module
+from services.patient_dictionary import PatientDictionary
+from services.redaction_jobs import DONE, TIMED_OUT, QueueFullError, RedactionJobQueue
+
+
+def slow_task(text):
+    time.sleep(float(text))
+    return text
+
+
+def logging_task(text):
+    logging.getLogger('services.redaction_jobs').warning(f"Worker saw {len(text)} characters.")
+    return text
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def model_path(ruler_nlp, tmp_path):
+    # Worker processes load the model by path, as they would a packaged model.
+    ruler_nlp.to_disk(tmp_path / "model")
+    return str(tmp_path / "model")
+
+
+class TestRedactionJobQueue:
+    def test_job_is_redacted_in_a_worker(self, model_path):
+        jobs = RedactionJobQueue(workers=1, model=model_path)
+        try:
+            job = jobs.submit("Contact John at john.doe@example.com", owner=1)
+            jobs.wait(job.id, owner=1, timeout=30)
+
+            assert job.to_dict() == {
+                'job_id': job.id,
+                'status': DONE,
+                'final_reduct_text': 'Contact [Redacted PII] at [REDACTED EMAIL]',
+            }
+            # Jobs are only visible to the user who submitted them.
+            assert jobs.get(job.id, owner=2) is None
+        finally:
+            jobs.shutdown()
+
+    def test_full_queue_rejects_new_jobs(self, model_path):
+        jobs = RedactionJobQueue(workers=1, max_pending=2, model=model_path, task=slow_task)
+        try:
+            jobs.submit("0.5")
+            jobs.submit("0.5")
+            with pytest.raises(QueueFullError):
+                jobs.submit("0")
+        finally:
+            jobs.shutdown()
+
+    def test_timeout_and_result_expiry(self, model_path):
+        clock = FakeClock()
+        jobs = RedactionJobQueue(workers=1, timeout=10, result_ttl=60, model=model_path,
+                                 task=slow_task, clock=clock)
+        try:
+            slow = jobs.submit("0.5")
+            queued = jobs.submit("0")
+            clock.now = 10
+            assert jobs.get(queued.id).status == TIMED_OUT
+
+            jobs.wait(slow.id, timeout=30)
+            assert jobs.get(slow.id).status == TIMED_OUT
+            clock.now = 70
+            assert jobs.get(slow.id) is None
+        finally:
+            jobs.shutdown()
+
+    @pytest.mark.parametrize('start_method', ['spawn', pytest.param('fork', marks=pytest.mark.skipif(
+        'fork' not in multiprocessing.get_all_start_methods(), reason="fork is not available"))])
+    def test_worker_logs_reach_the_web_process(self, model_path, start_method, caplog):
+        caplog.set_level(logging.INFO)
+        jobs = RedactionJobQueue(workers=1, model=model_path, start_method=start_method, task=logging_task)
+        try:
+            job = jobs.submit("hello")
+            jobs.wait(job.id, timeout=30)
+            assert job.status == DONE
+        finally:
+            # Stopping the queue writes out the records the workers sent.
+            jobs.shutdown()
+        # Handlers a forked worker inherits are replaced, so each record is written once, here.
+        assert [record.getMessage() for record in caplog.records if record.name == 'services.redaction_jobs'
+                and record.levelno == logging.WARNING] == ["Worker saw 5 characters."]
+
+    def test_workers_use_the_patient_dictionary(self, model_path, tmp_path, monkeypatch):
+        import models.message  # noqa: F401 (Patient.messages refers to it)
+        from extensions.database import setup_db
+        from models.patient import Patient
+
+        url = f"sqlite:///{tmp_path / 'patients.db'}"
+        application = Flask(__name__)
+        application.config["DB_CREATE_ALL"] = "true"
+        setup_db(application, url)
+        monkeypatch.setattr(dictionary_module, '_dictionary', PatientDictionary())
+        jobs = RedactionJobQueue(workers=1, model=model_path,
+                                 dictionary_config={'database_url': url, 'min_length': 3,
+                                                    'match_lowercase_names': False})
+        try:
+            with application.app_context():
+                Patient(first_name='Priya', last_name='Patel', email='priya@example.org').insert()
+                job = jobs.submit("Priya Patel called")
+                jobs.wait(job.id, timeout=30)
+                assert job.to_dict()['final_reduct_text'] == "[Redacted PII] called"
+
+                # A patient added later is found once the web process's dictionary has changed.
+                Patient(first_name='Olga', last_name='Novak', email='olga@example.org').insert()
+                job = jobs.submit("Olga Novak called")
+                jobs.wait(job.id, timeout=30)
+                assert job.to_dict()['final_reduct_text'] == "[Redacted PII] called"
+        finally:
+            jobs.shutdown()
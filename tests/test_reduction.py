@@ -1,5 +1,22 @@
 # Use an absolute import from the project root
-from services.redaction import ReductionService, redact_email, redact_phone_number
+import io
+
+import pytest
+
+from spacy.language import Language
+
+from services.redaction import (ReductionService, RedactionSpan, apply_spans, merge_spans,
+                                redact_email, redact_phone_number, redact_pii)
+
+# Texts the `record_texts` pipeline component has seen.
+NER_TEXTS = []
+
+
+@Language.component("record_texts")
+def record_texts(doc):
+    NER_TEXTS.append(doc.text)
+    return doc
+
 
 class TestReduction:
     def test_redact_email(self):
@@ -57,6 +74,24 @@ class TestReduction:
             assert redact_phone_number(input_text) == expected_output
     
 
+    def test_redact_pii(self):
+        # The single-pass engine must match redact_phone_number(redact_email(text)),
+        # including where a match changes the context seen by the next pattern.
+        test_cases = [
+            ("Email john.doe@example.com or call (123) 456-7890 / 1234567890",
+             "Email [REDACTED EMAIL] or call [REDACTED PHONE] / [REDACTED PHONE]"),
+            ("+1 123-456-7890@y.com", "+1 [REDACTED EMAIL]"),  # The email wins over the phone
+            ("7x52x.y@z.org+1 4146037907", "[REDACTED EMAIL][REDACTED PHONE]"),
+            ("a@b.co(123) 456-7890", "[REDACTED EMAIL][REDACTED PHONE]"),
+            ("1234567890+1 123 456 7890", "[REDACTED PHONE]+[REDACTED PHONE]"),
+            ("No PII here", "No PII here"),
+        ]
+
+        for input_text, expected_output in test_cases:
+            assert redact_pii(input_text) == expected_output
+            assert redact_phone_number(redact_email(input_text)) == expected_output
+
+
     def test_hybrid_redact(self):
         test_cases = [
             ("Contact Mr. John Doe in Berlin at john.doe@example.com or his assistant Jane Smith.",
@@ -73,4 +108,145 @@ class TestReduction:
         
         for input_text, expected_output in test_cases:
             nlp = ReductionService()
-            assert nlp.hybrid_redact(input_text) == expected_output
\ No newline at end of file
+            assert nlp.hybrid_redact(input_text) == expected_output
+
+    def test_hybrid_redact_many(self, ruler_nlp):
+        texts = [
+            "Contact John in Berlin at john.doe@example.com",
+            None,
+            "Call Jane Smith at (123) 456-7890",
+            "Nothing to hide here",
+        ]
+        results = ReductionService(nlp=ruler_nlp).hybrid_redact_many(texts, batch_size=2)
+
+        assert [result['success'] for result in results] == [True, False, True, True]
+        assert results[0]['final_reduct_text'] == "Contact [Redacted PII] in [Redacted PII] at [REDACTED EMAIL]"
+        assert results[1]['error'] == "Input must be a string."
+        assert results[2]['final_reduct_text'] == "Call [Redacted PII] at [REDACTED PHONE]"
+        assert results[3]['final_reduct_text'] == "Nothing to hide here"
+
+
+
+    def test_merge_spans(self):
+        spans = [
+            RedactionSpan(10, 30, 'regex', 'EMAIL', '[REDACTED EMAIL]'),
+            RedactionSpan(0, 4, 'ner', 'PERSON', '[Redacted PII]'),
+            RedactionSpan(4, 8, 'ner', 'PERSON', '[Redacted PII]'),  # Touching spans stay apart
+            RedactionSpan(12, 20, 'ner', 'PERSON', '[Redacted PII]'),  # Inside the email
+        ]
+        merged = merge_spans(spans)
+
+        assert [(span.start, span.end, span.label) for span in merged] == [
+            (0, 4, 'PERSON'), (4, 8, 'PERSON'), (10, 30, 'EMAIL')]
+        assert apply_spans("x" * 32, merged) == "[Redacted PII][Redacted PII]xx[REDACTED EMAIL]xx"
+
+
+    def test_hybrid_plan(self, ruler_nlp):
+        text = "Contact John in Berlin at john.doe@example.com"
+        plan = ReductionService(nlp=ruler_nlp).hybrid_plan(text)
+
+        assert [(text[span.start:span.end], span.source, span.label) for span in plan] == [
+            ("John", 'ner', 'PERSON'),
+            ("Berlin", 'ner', 'GPE'),
+            ("john.doe@example.com", 'regex', 'EMAIL'),
+        ]
+        assert apply_spans(text, plan) == "Contact [Redacted PII] in [Redacted PII] at [REDACTED EMAIL]"
+
+
+
+    def test_hybrid_never_double_redacts_placeholders(self, ruler_nlp):
+        # A model that would tag the placeholders, and one that tags the email itself.
+        ruler_nlp.get_pipe("entity_ruler").add_patterns([
+            {"label": "ORG", "pattern": "REDACTED"},
+            {"label": "PERSON", "pattern": "jane@example.com"},
+        ])
+        service = ReductionService(nlp=ruler_nlp)
+        text = "Ask John at jane@example.com or 9875673452"
+
+        assert service.hybrid_redact(text) == "Ask [Redacted PII] at [REDACTED EMAIL] or [REDACTED PHONE]"
+        assert [span.source for span in service.hybrid_plan(text)] == ['ner', 'regex', 'regex']
+
+
+    def test_hybrid_runs_ner_once_over_the_original_text(self, ruler_nlp):
+        text = "Contact John in Berlin at john.doe@example.com or (123) 456-7890. " * 3000
+        ruler_nlp.add_pipe("record_texts")
+        service = ReductionService(nlp=ruler_nlp, cache=None)
+        NER_TEXTS.clear()
+
+        redacted = service.hybrid_redact(text)
+        # NER isn't rerun on the regex output, so hybrid redaction costs one pass of each detector.
+        assert NER_TEXTS == [text]
+        assert redacted == "Contact [Redacted PII] in [Redacted PII] at [REDACTED EMAIL] or [REDACTED PHONE]. " * 3000
+
+
+    def test_hybrid_redact_stream(self, ruler_nlp):
+        service = ReductionService(nlp=ruler_nlp)
+        sentences = [
+            "Contact John in Berlin at john.doe@example.com.",
+            "Call Jane Smith on +1 (123) 456-7890 today!",
+            "Tonia moved to Zurich\nand her number is 9875673452",
+            # Only the date and number are redacted, but they are found by the words in front of them.
+            "Her date of birth: March 3, 1975 and MRN #A1234567 are on file.",
+            "DOB: 1990-01-02",
+        ]
+        text = " ".join(sentences[index % len(sentences)] for index in range(60))
+        expected = service.hybrid_redact(text)
+        assert expected.count("[REDACTED DOB]") == 24 and expected.count("[REDACTED MRN]") == 12
+
+        # Small chunks put plenty of entities, emails and phone numbers on chunk edges.
+        for chunk_size, overlap in [(40, 30), (97, 40), (140, 30), (500, 100)]:
+            assert "".join(service.hybrid_redact_stream(text, chunk_size, overlap)) == expected
+
+        pieces = [text[start:start + 13] for start in range(0, len(text), 13)]
+        assert "".join(service.hybrid_redact_stream(iter(pieces), 60, 30)) == expected
+        assert "".join(service.hybrid_redact_stream(io.BytesIO(text.encode()), 60, 30)) == expected
+
+        # Output is produced before the whole input has been read.
+        source = io.StringIO(text)
+        next(service.hybrid_redact_stream(source, 100, 40))
+        assert source.tell() < len(text)
+
+
+class TestRedactStreamRoute:
+    @pytest.fixture
+    def failing_after(self, ruler_nlp, monkeypatch):
+        """Makes the route's service fail on the detection pass after the given number of windows."""
+        from routes import api_routes
+
+        def make(windows):
+            service = ReductionService(nlp=ruler_nlp, cache=None)
+            detect, calls = service._detect, []
+
+            def flaky_detect(text):
+                calls.append(text)
+                if len(calls) > windows:
+                    raise RuntimeError("detector crashed")
+                return detect(text)
+
+            service._detect = flaky_detect
+            monkeypatch.setattr(api_routes, 'ReductionService', lambda: service)
+            return service
+        return make
+
+    def test_failures_are_reported(self, app, client, auth_headers, failing_after):
+        from routes.api_routes import STREAM_ERROR_MARKER
+        app.config.update(REDACTION_STREAM_CHUNK_SIZE=40, REDACTION_STREAM_OVERLAP=10)
+        headers = auth_headers('get:redaction')
+        text = "Contact John at john.doe@example.com today. " * 10
+
+        failing_after(0)
+        response = client.post('/redact/stream', data=text, headers=headers)
+        assert response.status_code == 500
+        assert response.get_json()['success'] is False
+
+        # Once the response has started, the body ends with a marker instead of just stopping.
+        failing_after(2)
+        response = client.post('/redact/stream', data=text, headers=headers)
+        body = response.get_data(as_text=True)
+        assert response.status_code == 200
+        assert body.startswith("Contact [Redacted PII] at [REDACTED EMAIL]")
+        assert body.endswith(STREAM_ERROR_MARKER)
+
+        failing_after(1000)
+        body = client.post('/redact/stream', data=text, headers=headers).get_data(as_text=True)
+        assert STREAM_ERROR_MARKER not in body and body.count("[REDACTED EMAIL]") == 10
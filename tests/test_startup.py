@@ -0,0 +1,74 @@
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Budgets in seconds; generous enough for a slow CI runner, tight enough to catch
+# an eager spaCy import or a database round trip sneaking back into startup.
+IMPORT_BUDGET = float(os.getenv("IMPORT_TIME_BUDGET", "1.5"))
+FIRST_REQUEST_BUDGET = float(os.getenv("FIRST_REQUEST_BUDGET", "2.5"))
+
+FIRST_REQUEST_SCRIPT = """
+import time
+start = time.perf_counter()
+from app import create_app
+app = create_app({
+    "SQLALCHEMY_DATABASE_URI": "sqlite://",
+    "DB_CREATE_ALL": True,
+    "SPACY_WARMUP": False,
+})
+status = app.test_client().get("/health/db").status_code
+print(status, time.perf_counter() - start)
+"""
+
+# The model is only loaded by the first request, so a missing model must not stop
+# create_app (used by `flask db upgrade`, `flask create-vault` and seed.py).
+MISSING_MODEL_SCRIPT = """
+from app import create_app
+app = create_app({
+    "SQLALCHEMY_DATABASE_URI": "sqlite://",
+    "DB_CREATE_ALL": True,
+    "SPACY_MODEL": "no_such_model",
+    "SPACY_WARMUP": True,
+})
+client = app.test_client()
+print(client.get("/health/db").status_code, client.get("/health/db").status_code)
+"""
+
+
+def run_python(*args, cwd=ROOT):
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    result = subprocess.run([sys.executable, *args], cwd=cwd, env=env, capture_output=True, text=True, timeout=120)
+    assert result.returncode == 0, result.stderr
+    return result
+
+
+def import_profile(module):
+    """Returns the cumulative import time in seconds of every module imported, from `python -X importtime`."""
+    stderr = run_python("-X", "importtime", "-c", f"import {module}").stderr
+    cumulative = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, total, name = line.split("|")
+        if total.strip().isdigit():
+            cumulative[name.strip()] = int(total) / 1e6
+    return cumulative
+
+
+class TestStartup:
+    def test_app_import_time(self):
+        profile = import_profile("app")
+        assert "spacy" not in profile, "spaCy should only be imported when a model is loaded"
+        assert profile["app"] < IMPORT_BUDGET
+
+    def test_time_to_first_request(self, tmp_path):
+        # Run from a temporary directory, which is where create_app writes app.log.
+        status, seconds = run_python("-c", FIRST_REQUEST_SCRIPT, cwd=tmp_path).stdout.split()
+        assert status == "200"
+        assert float(seconds) < FIRST_REQUEST_BUDGET
+
+    def test_missing_model_only_fails_redaction(self, tmp_path):
+        assert run_python("-c", MISSING_MODEL_SCRIPT, cwd=tmp_path).stdout.split() == ["200", "200"]
+        assert "Could not load spaCy model 'no_such_model'" in (tmp_path / "app.log").read_text()
@@ -0,0 +1,100 @@
+from datetime import datetime, timedelta, timezone
+
+import jwt
+import pytest
+from flask import jsonify
+from sqlalchemy import event
+
+from extensions.auth.token import TokenCache, get_token_cache
+from extensions.database import db
+from models.user import User
+from routes.api_routes import token_required
+
+SECRET = 'test-secret'
+
+
+@pytest.fixture
+def client(app, monkeypatch):
+    monkeypatch.setenv('SECRET_KEY', SECRET)
+    get_token_cache().clear()
+
+    @token_required(permissions='get:redaction')
+    def whoami(current_user, user_role):
+        return jsonify({'id': current_user.id, 'role': user_role})
+
+    app.add_url_rule('/whoami', view_func=whoami)
+    return app.test_client()
+
+
+@pytest.fixture
+def user(app):
+    user = User(username='clinician', role='admin', permissions='get:redaction post:messages')
+    user.set_password('secret')
+    return user.insert()
+
+
+def make_token(user, permissions=None):
+    claims = {
+        'username': user.username,
+        'role': user.role,
+        'permissions': permissions or user.permissions,
+        'exp': datetime.now(timezone.utc) + timedelta(hours=1),
+    }
+    return {'Authorization': 'Bearer ' + jwt.encode(claims, SECRET, algorithm='HS256')}
+
+
+class TestTokenCache:
+    def test_repeated_calls_skip_decode_and_user_query(self, client, user):
+        headers = make_token(user)
+        queries = []
+        listener = lambda *args: queries.append(args[2])
+        event.listen(db.engine, 'before_cursor_execute', listener)
+        try:
+            for _ in range(20):
+                response = client.get('/whoami', headers=headers)
+                assert response.status_code == 200
+                assert response.get_json() == {'id': user.id, 'role': 'admin'}
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', listener)
+        assert len(queries) == 1
+        assert get_token_cache().hits == 19
+
+    def test_deactivation_applies_to_the_next_request(self, client, user):
+        headers = make_token(user)
+        assert client.get('/whoami', headers=headers).status_code == 200
+
+        user.is_active = False
+        user.update()
+        assert client.get('/whoami', headers=headers).status_code == 401
+
+    def test_revoked_permission_applies_to_the_next_request(self, client, user):
+        headers = make_token(user)
+        assert client.get('/whoami', headers=headers).status_code == 200
+
+        user.dict_update(permissions='post:messages')
+        assert client.get('/whoami', headers=headers).status_code == 403
+
+    def test_missing_permission_in_token(self, client, user):
+        assert client.get('/whoami', headers=make_token(user, 'post:messages')).status_code == 403
+
+    def test_claims_expire_with_the_token(self):
+        now = [1000.0]
+        cache = TokenCache(clock=lambda: now[0])
+        decoded = []
+
+        def decode(token):
+            decoded.append(token)
+            return {'username': 'clinician', 'permissions': 'a b', 'exp': 1060}
+
+        assert cache.verify('token', decode).permissions == frozenset({'a', 'b'})
+        cache.verify('token', decode)
+        assert len(decoded) == 1
+        now[0] = 1060
+        cache.verify('token', decode)
+        assert len(decoded) == 2
+
+    def test_cache_is_bounded(self):
+        cache = TokenCache(max_entries=2)
+        for number in range(5):
+            cache.verify(f'token-{number}', lambda token: {'username': token, 'exp': 2 ** 40})
+        assert len(cache._tokens) == 2
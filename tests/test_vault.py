@@ -0,0 +1,116 @@
+import pytest
+from sqlalchemy import event, inspect
+
+from extensions.database import db
+from models.message import Message
+from models.patient import Patient
+from models.vault import VaultEntry
+from services import vault as vault_module
+from services.redaction import ReductionService
+from services.vault import TOKEN_PATTERN, TokenVault
+
+TEXTS = [
+    "John moved to Berlin, write to john@example.com",
+    "Jane Smith and John will call 555-123-4567",
+    "Nothing sensitive here",
+]
+
+
+@pytest.fixture
+def service(ruler_nlp):
+    return ReductionService(nlp=ruler_nlp, cache=None)
+
+
+@pytest.fixture
+def vault(app, monkeypatch):
+    instance = TokenVault(b'test-vault-key', cache_size=100)
+    monkeypatch.setattr(vault_module, '_vault', instance)
+    return instance
+
+
+def vault_statements():
+    statements = []
+    event.listen(db.engines['vault'], 'before_cursor_execute',
+                 lambda *args: args[2] != 'BEGIN' and statements.append(args[2]))
+    return statements
+
+
+class TestTokenVault:
+
+    def test_tokens_are_deterministic_and_keyed(self):
+        first, second = TokenVault(b'key-1'), TokenVault(b'key-2')
+        assert first.token_for('PERSON', 'John') == first.token_for('PERSON', 'John')
+        assert first.token_for('PERSON', 'John') != first.token_for('GPE', 'John')
+        assert first.token_for('PERSON', 'John') != second.token_for('PERSON', 'John')
+
+    def test_vault_needs_an_explicit_key(self, app, client, auth_headers, monkeypatch):
+        from services import ingestion
+        monkeypatch.setattr(vault_module, '_vault', None)
+        monkeypatch.setattr(ingestion, '_ingestor', None)
+        app.config.update(SECRET_KEY='mysecretkey', VAULT_KEY=None, INGESTION_TOKENIZE=True)
+
+        # No key is derived from SECRET_KEY, so stored tokens can't be brute-forced with a default secret.
+        assert vault_module.init_app(app) is None
+        with pytest.raises(RuntimeError, match="VAULT_KEY"):
+            ingestion.init_app(app)
+        response = client.post('/messages/detokenize', json={'ids': [1]}, headers=auth_headers('get:phi'))
+        assert response.status_code == 503
+
+        app.config['VAULT_KEY'] = 'a-long-random-secret'
+        assert vault_module.init_app(app) is not None
+        assert ingestion.init_app(app).vault is vault_module.get_vault()
+
+    def test_vault_table_lives_in_its_own_bind(self, app):
+        assert inspect(db.engines['vault']).has_table('vault_entries')
+        assert not inspect(db.engine).has_table('vault_entries')
+
+    def test_tokenize_stores_each_value_once_in_one_statement(self, app, service, vault):
+        statements = vault_statements()
+        results = vault.tokenize_texts(TEXTS, service)
+        tokenized = [result['final_reduct_text'] for result in results]
+        assert all(result['success'] for result in results)
+        assert 'John' not in tokenized[0] and 'john@example.com' not in tokenized[0]
+        assert tokenized[2] == TEXTS[2]
+        # "John" appears twice but is one vault entry with one token.
+        john = TOKEN_PATTERN.search(tokenized[0]).group(0)
+        assert john in tokenized[1]
+        assert VaultEntry.query.count() == 5
+        assert len([statement for statement in statements if statement.startswith('INSERT')]) == 1
+
+        # Values already in the LRU are not written again.
+        statements.clear()
+        vault.tokenize_texts(TEXTS[:1], service)
+        assert statements == []
+
+    def test_detokenize_many_in_one_query(self, app, service, vault):
+        tokenized = [result['final_reduct_text'] for result in vault.tokenize_texts(TEXTS, service)]
+        cold = TokenVault(b'test-vault-key')
+        statements = vault_statements()
+        assert cold.detokenize_many(tokenized * 50) == TEXTS * 50
+        assert len(statements) == 1
+        assert cold.detokenize_many(tokenized) == TEXTS
+        assert len(statements) == 1
+        assert cold.hits == 5 and cold.misses == 5
+
+    def test_unknown_tokens_are_left_in_place(self, app, vault):
+        text = f"Hello [[PERSON:{'0' * 32}]]"
+        assert vault.detokenize(text) == text
+        assert vault.detokenize_many([None, '']) == [None, '']
+
+    def test_ingested_messages_are_tokenized_and_detokenized_for_authorized_users(
+            self, app, client, auth_headers, service, vault):
+        from services.ingestion import IncomingMessage, MessageIngestor, _utc
+        Patient(email='john@example.com', phone='+15551234567').insert()
+        ingestor = MessageIngestor(app, service=service, vault=vault, background=False)
+        ingestor.submit([IncomingMessage(f'wamid.{n}', '+15551234567', text, _utc(0), 'WhatsApp')
+                         for n, text in enumerate(TEXTS)])
+        stored = Message.query.order_by(Message.id).all()
+        assert 'John' not in stored[0].content and TOKEN_PATTERN.search(stored[0].content)
+
+        ids = [message.id for message in stored]
+        response = client.post('/messages/detokenize', json={'ids': ids}, headers=auth_headers('get:phi'))
+        assert [item['content'] for item in response.get_json()['messages']] == TEXTS
+        assert client.post('/messages/detokenize', json={'ids': ids},
+                           headers=auth_headers('get:messages', username='reader')).status_code == 403
+        assert client.post('/messages/detokenize', json={'ids': 'all'},
+                           headers=auth_headers('get:phi', username='other')).status_code == 400